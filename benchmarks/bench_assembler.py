@@ -0,0 +1,295 @@
+"""Throughput and memory benchmark of the assembler on synthetic programs.
+
+Each case generates a `Program` with about `size` mnemonics and measures
+the instructions assembled per second (best of several runs) and the peak
+memory allocated while assembling (traced in a separate run). The results
+are compared with ``benchmarks/baseline.json``; the benchmark fails if a
+case is slower or uses more memory than its baseline by more than the
+respective tolerance. Peak memory hardly varies between runs and machines,
+but throughput depends on the machine and its load, so the baseline should
+be saved again (``--save-baseline``) when the reference machine changes.
+
+Cases whose code contains absolute addresses (calls and DPTR loads) cannot
+be larger than the 64 KiB address space and are skipped above their
+maximum size.
+
+Run with ``python benchmarks/bench_assembler.py [--sizes 1000 1000000]``.
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from pathlib import Path
+
+from yay import Mod, Program, sub
+from yay.cpus.MCS_51 import LookupTableDptr
+from yay.mnemonic import RawData
+
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+class Benchmark(Program, cpu="MCS_51"):
+    # Measure the assembler itself, not the replay of cached fragments.
+    fragment_cache = None
+
+
+def labels(size):
+    """Many global labels with backward and forward relative jumps and
+    relaxed jumps.
+    """
+    count = size // 4
+
+    class Labels(Benchmark):
+        def main(self):
+            for i in range(count):
+                Label(f"label_{i}")
+                inc(R0)
+                djnz(R7, f"label_{i}")
+                sjmp(f"label_{i + 1}")
+                jump(f"label_{i}")
+            Label(f"label_{count}")
+
+    return Labels
+
+
+def subs(size, body_length=8):
+    """A chain of subs as deep as the program is long, where each sub also
+    calls an earlier one.
+    """
+    count = size // (body_length + 3)
+
+    def make_body(i):
+        def body(self):
+            for _ in range(body_length):
+                inc(R0)
+            if i + 1 < count:
+                getattr(self, f"sub_{i + 1}")()
+            getattr(self, f"sub_{i // 2}")()
+        body.__name__ = f"sub_{i}"
+        return body
+
+    namespace = {f"sub_{i}": sub(make_body(i)) for i in range(count)}
+    namespace["main"] = lambda self: self.sub_0()
+    return type(Benchmark)("Subs", (Benchmark, ), namespace)
+
+
+def mods(size, body_length=8):
+    """Many instances of a `Mod`, each with its own sub."""
+    count = size // (body_length + 2)
+
+    class Worker(Mod):
+        @sub
+        def work(self):
+            for _ in range(body_length):
+                inc(R0)
+
+    class Mods(Benchmark):
+        mods = [Worker]
+
+        def main(self):
+            worker = self.mnemonic("Worker")
+            for _ in range(count):
+                worker().work()
+
+    return Mods
+
+
+def lookup_table(size):
+    """One `LookupTableDptr` with `size` entries."""
+
+    class LookupTable(Benchmark):
+        mods = [LookupTableDptr]
+
+        def main(self):
+            table = self.mnemonic("LookupTableDptr")(
+                {key: bytes([key & 0xFF]) for key in range(size)},
+                1,
+            )
+            mov(A, 42)
+            table.lookup_unsafe()
+
+    return LookupTable
+
+
+def block_macros(size):
+    """Nested block macros from `macros.yay`."""
+    count = size // 12
+
+    class BlockMacros(Benchmark):
+        def main(self):
+            for _ in range(count):
+                with self.using(R1, R2):
+                    with self.loop(R3, 10):
+                        with self.ifeq(A, 42):
+                            inc(R0)
+                        with self.skip():
+                            dec(R0)
+                        with self.until(A, 0):
+                            dec()
+
+    return BlockMacros
+
+
+# Maps case names to the function that generates the program and the
+# maximum size of the case.
+CASES = OrderedDict([
+    ("labels", (labels, None)),
+    ("subs", (subs, 20000)),
+    ("mods", (mods, 20000)),
+    ("lookup_table", (lookup_table, 50000)),
+    ("block_macros", (block_macros, None)),
+])
+
+
+def assemble(program_type):
+    """Assemble `program_type` and return the number of its instructions,
+    counting each byte of raw data as one.
+    """
+    program = program_type()
+    program.to_binary()
+    return sum(
+        len(opcode.data) if isinstance(opcode, RawData) else 1
+        for opcode in program._opcodes
+    )
+
+
+def measure(program_type, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        # Like `timeit`, time without the cyclic garbage collector.
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            instructions = assemble(program_type)
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        assemble(program_type)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "instructions": instructions,
+        "instructions_per_second": instructions / best,
+        "peak_memory": peak,
+    }
+
+
+def run(cases, sizes):
+    results = OrderedDict()
+    for name in cases:
+        make_program, maximum_size = CASES[name]
+        for size in sizes:
+            if maximum_size is not None and size > maximum_size:
+                continue
+            repeat = max(3, min(20, 200000 // size))
+            results[f"{name}/{size}"] = measure(make_program(size), repeat)
+    return results
+
+
+def compare(results, baseline, speed_tolerance, memory_tolerance):
+    """Print `results` next to `baseline` and return the names of the cases
+    that regressed by more than the tolerances.
+    """
+    regressions = []
+    print(
+        f"{'case':24}{'instructions':>14}{'instr/s':>12}{'vs base':>9}"
+        f"{'peak KiB':>11}{'vs base':>9}"
+    )
+    for name, result in results.items():
+        speed = result["instructions_per_second"]
+        memory = result["peak_memory"]
+        line = (
+            f"{name:24}{result['instructions']:>14}{speed:>12.0f}"
+        )
+        base = baseline.get(name)
+        if base is None:
+            print(f"{line}{'':>9}{memory / 1024:>11.0f}")
+            continue
+        speed_ratio = speed / base["instructions_per_second"]
+        memory_ratio = memory / base["peak_memory"]
+        print(
+            f"{line}{speed_ratio:>9.2f}{memory / 1024:>11.0f}"
+            f"{memory_ratio:>9.2f}"
+        )
+        if (
+            speed_ratio < 1 - speed_tolerance
+            or memory_ratio > 1 + memory_tolerance
+        ):
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        help="approximate numbers of mnemonics of the generated programs",
+        nargs="+",
+        type=int,
+        default=DEFAULT_SIZES,
+    )
+    parser.add_argument(
+        "--cases",
+        help="the cases to run",
+        nargs="+",
+        choices=list(CASES),
+        default=list(CASES),
+    )
+    parser.add_argument(
+        "--speed-tolerance",
+        help="allowed relative decrease of instructions per second",
+        type=float,
+        default=0.5,
+    )
+    parser.add_argument(
+        "--memory-tolerance",
+        help="allowed relative increase of peak memory",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--save-baseline",
+        help=f"store the results in {BASELINE.name}",
+        action="store_true",
+    )
+    args = parser.parse_args(argv)
+
+    results = run(args.cases, args.sizes)
+
+    baseline = {}
+    if BASELINE.exists():
+        with BASELINE.open() as baseline_file:
+            baseline = json.load(baseline_file)
+    regressions = compare(
+        results,
+        baseline,
+        args.speed_tolerance,
+        args.memory_tolerance,
+    )
+
+    if args.save_baseline:
+        baseline.update(results)
+        with BASELINE.open("w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+            baseline_file.write("\n")
+    elif regressions:
+        print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
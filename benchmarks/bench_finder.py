@@ -0,0 +1,39 @@
+"""Benchmark for the cost `YayFinder` adds to imports of non-yay modules.
+
+Run with ``python benchmarks/bench_finder.py``.
+"""
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+from yay.importer import YayFinder
+
+
+def main(entries=200, number=200):
+    with tempfile.TemporaryDirectory() as directory:
+        path = [str(Path(directory, str(n))) for n in range(entries)]
+        for entry in path:
+            Path(entry).mkdir()
+        old_path = sys.path[:]
+        sys.path[:] = path
+        try:
+            finder = YayFinder()
+            unscoped = min(timeit.repeat(
+                lambda: finder.find_spec("numpy", None),
+                number=number,
+            ))
+            finder.set_scope(prefixes=["firmware"])
+            scoped = min(timeit.repeat(
+                lambda: finder.find_spec("numpy", None),
+                number=number,
+            ))
+        finally:
+            sys.path[:] = old_path
+    print(f"{entries} sys.path entries")
+    print(f"unscoped: {unscoped / number * 1e6:8.1f} us per import")
+    print(f"scoped:   {scoped / number * 1e6:8.1f} us per import")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark for reassembling a program after editing one of its subs.
+
+A synthetic program with 500 subs is reassembled after the body of one sub
+was changed, without the fragment cache and with a warm cache. The best of
+several alternating runs of both is reported.
+
+Run with ``python benchmarks/bench_fragment_cache.py``.
+"""
+import time
+
+from yay import Program, sub
+from yay.fragments import FragmentCache
+
+
+SUB_TEMPLATE = """
+@sub
+def sub_{n}(self):
+    mov(R7, {value})
+    with self.loop(R7):
+        mov(A, R0)
+        add({n} % 256)
+        mov(P1, A)
+    for i in range(8):
+        mov(R{register}, i)
+"""
+
+
+def make_program(subs=500, edited=None, cache=None):
+    namespace = {"sub": sub}
+    for n in range(subs):
+        value = 17 if n != edited else 42
+        source = SUB_TEMPLATE.format(n=n, value=value, register=n % 8)
+        exec(source, namespace)
+
+    def main(self):
+        for n in range(subs):
+            getattr(self, f"sub_{n}")()
+        self.infinitely()
+
+    body = {f"sub_{n}": namespace[f"sub_{n}"] for n in range(subs)}
+    body.update(main=main, fragment_cache=cache)
+    return type("Synthetic", (Program, ), body, cpu="MCS_51")
+
+
+def assemble(program_type):
+    start = time.perf_counter()
+    binary = program_type().to_binary()
+    return binary, time.perf_counter() - start
+
+
+def main(repeat=20):
+    # Warm up the signature dispatch caches.
+    assemble(make_program())
+    cache = FragmentCache()
+    assemble(make_program(cache=cache))
+
+    # Both variants are measured alternately, so that changes of the load of
+    # the machine affect both of them alike.
+    uncached = []
+    cached = []
+    for n in range(repeat):
+        uncached.append(assemble(make_program(edited=n))[1])
+        cached.append(assemble(make_program(edited=n, cache=cache))[1])
+    uncached = min(uncached)
+    cached = min(cached)
+    print(f"without cache:  {uncached * 1000:8.1f} ms")
+    print(f"with cache:     {cached * 1000:8.1f} ms")
+    print(f"speedup:        {uncached / cached:8.2f}")
+
+    assert (
+        assemble(make_program(edited=250, cache=cache))[0]
+        == assemble(make_program(edited=250))[0]
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Micro-benchmark for creating `Program` instances, as in parameter sweeps
+that build many small programs.
+
+Run with ``python benchmarks/bench_instantiation.py``.
+"""
+import timeit
+
+from yay import Program, macro, sub
+from yay.cpus.MCS_51 import Delay
+
+
+class Empty(Program, cpu="AT89S8253"):
+    def main(self):
+        pass
+
+
+class Small(Program, cpu="AT89S8253"):
+    mods = [Delay]
+    F_CPU = 12_000_000
+
+    @macro
+    def toggle(self, bit):
+        cpl(bit)
+
+    @sub
+    def blink(self):
+        with self.loop(R6, 10):
+            self.toggle(P1[0])
+            self.delay.ms(100)
+
+    def main(self):
+        self.delay = Delay()
+        self.blink()
+        self.infinitely()
+
+
+CASES = {
+    "Empty()": Empty,
+    "Small()": Small,
+    "Small().to_binary()": lambda: Small().to_binary(),
+}
+
+
+def main(number=2000):
+    Small().to_binary()
+    for name, case in CASES.items():
+        seconds = min(timeit.repeat(case, number=number, repeat=5))
+        print(f"{name:24} {seconds / number * 1e6:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Benchmark for parsing and lowering a large `.yay` source.
+
+Run with ``python benchmarks/bench_lowering.py``.
+"""
+import timeit
+
+import yay
+from yay.importer import lower
+
+
+def synthetic_source(macros=2000):
+    lines = [
+        "from yay import Program, macro",
+        "",
+        "TABLE = [",
+        *(f"    ({n}, {n * 3 % 256}, 'entry_{n}')," for n in range(macros)),
+        "]",
+        "",
+        "class Main(Program, cpu='MCS_51'):",
+    ]
+    for n in range(macros):
+        lines.extend([
+            "    @macro",
+            f"    def macro_{n}(self, value={n}):",
+            "        A <- value",
+            f"        ^R0 <- A + {n % 256}",
+            "        if value > 128:",
+            "            R7 <- TABLE[value][1]",
+        ])
+    return "\n".join(lines) + "\n"
+
+
+def main(number=3):
+    source = synthetic_source()
+    lines = source.count("\n")
+    parse = min(timeit.repeat(lambda: yay.ast.parse(source), number=number))
+    parse_and_lower = min(timeit.repeat(
+        lambda: lower(yay.ast.parse(source)),
+        number=number,
+    ))
+    print(f"{lines} lines")
+    print(f"parse:           {parse / number * 1000:8.1f} ms")
+    print(f"parse and lower: {parse_and_lower / number * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
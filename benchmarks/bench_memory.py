@@ -0,0 +1,40 @@
+"""Memory benchmark: bytes allocated per appended instruction.
+
+Run with ``python benchmarks/bench_memory.py``.
+"""
+import tracemalloc
+
+from yay import Program
+
+
+class Benchmark(Program, cpu="MCS_51"):
+    def main(self):
+        for n in range(self.repetitions):
+            mov(A, R0)
+            mov(R7, n % 256)
+            add(Byte(42))
+            djnz(R7, "main")
+            acall("main")
+
+
+def bytes_per_instruction(repetitions):
+    program = Benchmark()
+    program.repetitions = repetitions
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    program.add_label("main")
+    program.main()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(
+        stat.size_diff for stat in after.compare_to(before, "filename")
+    )
+    return allocated / len(program._opcodes)
+
+
+def main(repetitions=10000):
+    print(f"{bytes_per_instruction(repetitions):8.1f} bytes per instruction")
+
+
+if __name__ == "__main__":
+    main()
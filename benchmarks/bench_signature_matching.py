@@ -0,0 +1,40 @@
+"""Micro-benchmark for signature matching of common instructions.
+
+Run with ``python benchmarks/bench_signature_matching.py``.
+"""
+import timeit
+
+from yay import Program
+
+
+class Benchmark(Program, cpu="MCS_51"):
+    pass
+
+
+def cases(program):
+    names = program._cpu_namespace
+    mov, add, djnz = names["mov"], names["add"], names["djnz"]
+    A, R0, R7, P1 = names["A"], names["R0"], names["R7"], names["P1"]
+    Byte, at = names["Byte"], names["at"]
+    direct = Byte(42)
+    return {
+        "mov(A, R0)": lambda: mov(A, R0, auto=False),
+        "mov(R7, 42)": lambda: mov(R7, 42, auto=False),
+        "mov(direct, direct)": lambda: mov(direct, P1, auto=False),
+        "mov(at(R0), 17)": lambda: mov(at(R0), 17, auto=False),
+        "add(R0)": lambda: add(R0, auto=False),
+        "add(42)": lambda: add(42, auto=False),
+        "add(direct)": lambda: add(direct, auto=False),
+        "djnz(R7, label)": lambda: djnz(R7, "label", auto=False),
+        "djnz(direct, label)": lambda: djnz(direct, "label", auto=False),
+    }
+
+
+def main(number=20000):
+    for name, case in cases(Benchmark()).items():
+        seconds = min(timeit.repeat(case, number=number, repeat=5))
+        print(f"{name:24} {seconds / number * 1e6:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Startup benchmark for the `yay` command line interface.
+
+Measures the wall clock time and the total import time reported by
+``python -X importtime`` for ``yay --help`` and for assembling
+``examples/mcs_51/blink.yay``, and fails if an import time budget is
+exceeded.
+
+Run with ``python benchmarks/bench_startup.py``.
+"""
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "examples"
+
+# Total import time budgets in milliseconds.
+BUDGETS = {
+    "yay --help": 50,
+    "yay blink.yay": 150,
+}
+
+
+def import_time(stderr):
+    """Sum the self times of all imports reported by `-X importtime`."""
+    total_us = 0
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            self_us = line.split(":", 1)[1].split("|")[0].strip()
+            if self_us.isdigit():
+                total_us += int(self_us)
+    return total_us / 1000
+
+
+def run(args, repeat=5):
+    command = [sys.executable, "-X", "importtime", "-m", "yay", *args]
+    best_wall = best_imports = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(
+            command,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+        best_wall = min(best_wall, time.perf_counter() - start)
+        best_imports = min(best_imports, import_time(result.stderr))
+    return best_wall * 1000, best_imports
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        cases = {
+            "yay --help": ["--help"],
+            "yay blink.yay": [
+                str(EXAMPLES / "mcs_51" / "blink.yay"),
+                "-o", str(Path(directory) / "blink.hex"),
+            ],
+        }
+        over_budget = False
+        for name, args in cases.items():
+            wall, imports = run(args)
+            budget = BUDGETS[name]
+            status = "ok" if imports <= budget else "OVER BUDGET"
+            over_budget |= imports > budget
+            print(
+                f"{name:16} {wall:8.1f} ms wall, {imports:8.1f} ms imports"
+                f" (budget {budget} ms) {status}"
+            )
+    sys.exit(over_budget)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
+import sys
+from pathlib import Path
+
 from setuptools import find_packages, setup
+from setuptools.command.build_py import build_py
 
 requirements = [
     "setuptools",
@@ -9,14 +13,61 @@ requirements = [
     "yay_ast",
 ]
 
+
+def precompile(description, compile_file, filenames):
+    """Call `compile_file` with each of `filenames`.
+
+    Precompiling needs the runtime dependencies, which are not necessarily
+    installed in the build environment, so it is skipped if they are
+    missing. The files are then compiled when they are first used.
+    """
+    for filename in filenames:
+        try:
+            compile_file(str(filename))
+        except ImportError as err:
+            print(
+                f"warning: not precompiling {description}: {err}",
+                file=sys.stderr,
+            )
+            return
+
+
+class build_py_with_yay_cache(build_py):
+    """Precompile the bundled `.yay` libraries and CPU configurations so
+    that importing them never parses `.yay` source or YAML.
+    """
+
+    def run(self):
+        super().run()
+        try:
+            from yay.cpu import compile_cpu_config
+            from yay.importer import compile_yay_file
+        except ImportError as err:
+            print(
+                f"warning: not precompiling .yay files and CPU "
+                f"configurations: {err}",
+                file=sys.stderr,
+            )
+            return
+        package = Path(self.build_lib, "yay")
+        precompile(".yay files", compile_yay_file, package.glob("**/*.yay"))
+        precompile(
+            "CPU configurations",
+            compile_cpu_config,
+            package.glob("cpu_configurations/*.yml"),
+        )
+
+
 setup(
     name='yay',
+    version="0.1.0",
     packages=find_packages(),
     package_dir={'yay': 'yay'},
     include_package_data=True,
     package_data={
-        "yay": ["cpu_configurations/*.yml"],
+        "yay": ["cpu_configurations/*.yml", "cpus/*/*.yay"],
     },
+    cmdclass={"build_py": build_py_with_yay_cache},
     entry_points={
         "console_scripts": [
             "yay=yay.__main__:main",
@@ -1,11 +1,15 @@
 import decimal
 import functools
 import itertools
+import sys
 from pathlib import Path
 from textwrap import dedent
 
+from pytest import raises
+
+from yay import cpu
 from yay.cpu import make_cpu, read_cpu_config
-from yay.helpers import config_filename
+from yay.helpers import _read_config_cached, config_filename
 
 
 # Very crude, but this tests whether `make_cpu` finds the same file regardless
@@ -104,3 +108,39 @@ def test_call_many(tmpdir):
             "f": "boo"
         }
     }
+
+
+def test_make_cpu_is_shared_and_read_only():
+    cpu = make_cpu("AT89S8253")
+    assert make_cpu(Path(config_filename("cpu_configurations/AT89S8253.yml"))) is cpu
+    with raises(TypeError):
+        cpu["registers"]["R0"] = None
+    with raises(TypeError):
+        cpu["mnemonics"]["add"] = None
+
+
+def test_cpu_config_is_cached(tmpdir, mocker):
+    mocker.patch.object(sys, "dont_write_bytecode", False)
+    parent_yml = tmpdir.join("parent.yml")
+    child_yml = tmpdir.join("child.yml")
+    parent_yml.write("foo: 1\nbar: 2\n")
+    child_yml.write(f"inherit_from: {parent_yml.strpath!r}\nbar: 3\n")
+    assert read_cpu_config(child_yml.strpath)["foo"] == 1
+
+    config_layers = mocker.patch.object(
+        cpu, "_config_layers", side_effect=cpu._config_layers
+    )
+    assert read_cpu_config(child_yml.strpath) == {
+        "inherit_from": parent_yml.strpath,
+        "foo": 1,
+        "bar": 3,
+    }
+    assert not config_layers.called
+
+    # Changing a file the configuration inherits from invalidates the cache.
+    parent_yml.write("foo: 42\nbar: 2\n")
+    _read_config_cached.cache_clear()
+    assert read_cpu_config(child_yml.strpath)["foo"] == 42
+    assert config_layers.call_count == 1
+    assert read_cpu_config(child_yml.strpath)["foo"] == 42
+    assert config_layers.call_count == 1
@@ -1,4 +1,5 @@
-import shutil
+import subprocess
+import sys
 from itertools import chain
 from pathlib import Path
 
@@ -21,8 +22,7 @@ def read(hex_filename):
 )
 def test_example(tmpdir, yay_filename):
     expected_filename = yay_filename.with_suffix(".hex")
-    # Copy to tempdir to prevent bytecode caching
-    yay_filename = shutil.copy(yay_filename, tmpdir)
+    yay_filename = str(yay_filename)
     test_file = tmpdir.join("output.hex")
 
     main([yay_filename, "-o", test_file.strpath])
@@ -36,3 +36,67 @@ def test_example(tmpdir, yay_filename):
         ])
 
     assert read(test_file) == read(expected_filename)
+
+
+@mark.parametrize("jobs", ["1", "2"])
+def test_batch(tmpdir, capsys, jobs):
+    yay_filenames = sorted(map(str, Path("examples/").glob("**/*.yay")))
+    broken = tmpdir.join("broken.yay")
+    broken.write("this is not valid\n")
+    outdir = tmpdir.join("out")
+
+    status = main([
+        *yay_filenames,
+        broken.strpath,
+        "--outdir", outdir.strpath,
+        "--jobs", jobs,
+    ])
+
+    assert status == 1
+    for yay_filename in map(Path, yay_filenames):
+        assert (
+            read(outdir.join(f"{yay_filename.stem}.hex"))
+            == read(yay_filename.with_suffix(".hex"))
+        )
+    assert not outdir.join("broken.hex").exists()
+    errors = capsys.readouterr().err.splitlines()
+    assert errors[0].startswith(f"{broken.strpath}: ")
+
+
+def test_batch_manifest(tmpdir):
+    yay_filename = Path("examples/mcs_51/blink.yay").resolve()
+    manifest = tmpdir.join("manifest")
+    manifest.write(f"# comment\n\n{yay_filename} out/blink.hex\n")
+
+    assert main(["--manifest", manifest.strpath]) == 0
+
+    assert (
+        read(tmpdir.join("out", "blink.hex"))
+        == read(yay_filename.with_suffix(".hex"))
+    )
+
+
+def test_link_object_file(tmpdir):
+    yay_filename = Path("examples/mcs_51/morse.yay")
+    object_file = tmpdir.join("morse.o")
+    hex_file = tmpdir.join("morse.hex")
+
+    main([str(yay_filename), "-f", "object", "-o", object_file.strpath])
+    assert main(["link", object_file.strpath, "-o", hex_file.strpath]) == 0
+
+    assert read(hex_file) == read(yay_filename.with_suffix(".hex"))
+
+
+def test_cli_does_not_import_multiprocessing():
+    modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, yay.cli; print(*sys.modules)",
+        ],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout.split()
+    assert "concurrent.futures" not in modules
+    assert "multiprocessing" not in modules
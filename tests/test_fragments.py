@@ -0,0 +1,210 @@
+from types import ModuleType
+
+from yay import Program as _Program
+from yay import sub
+from yay.cpus.MCS_51 import Bit
+from yay.fragments import FragmentCache
+from yay.mnemonic import RawData
+
+
+class Program(_Program, cpu="AT89S8253"):
+    pass
+
+
+config = ModuleType("config")
+
+
+class Config:
+    value = 1
+
+
+def make_delay(iterations=3):
+    @sub
+    def delay(self):
+        mov(R7, iterations)
+        with self.loop(R7):
+            nop()
+            jnb(P1[0], "skip")
+            cpl(P1[1])
+            Label("skip")
+
+    return delay
+
+
+def make_program(cache, nops=0, delay=None):
+    class Test(Program):
+        fragment_cache = cache
+
+        def main(self):
+            Label("main")
+            for _ in range(nops):
+                nop()
+            self.delay()
+            jump("main")
+
+    Test.delay = make_delay() if delay is None else delay
+    return Test
+
+
+def uncached(nops=0, delay=None):
+    return make_program(None, nops, delay)().to_binary()
+
+
+def test_fragment_is_replayed():
+    cache = FragmentCache()
+    assert make_program(cache)().to_binary() == uncached()
+    assert len(cache) == 1
+
+    program = make_program(cache, nops=3)()
+    assert program.to_binary() == uncached(nops=3)
+    assert len(cache) == 1
+    assert any(isinstance(opcode, RawData) for opcode in program._opcodes)
+
+
+def test_changed_closure_is_not_replayed():
+    cache = FragmentCache()
+    make_program(cache)().to_binary()
+    delay = make_delay(iterations=5)
+    assert (
+        make_program(cache, delay=delay)().to_binary()
+        == uncached(delay=make_delay(iterations=5))
+    )
+    assert len(cache) == 2
+
+
+def test_sub_calling_sub_is_not_cached():
+    cache = FragmentCache()
+
+    class Test(Program):
+        fragment_cache = cache
+
+        @sub
+        def outer(self):
+            self.inner()
+
+        @sub
+        def inner(self):
+            nop()
+
+        def main(self):
+            self.outer()
+
+    Test().to_binary()
+    assert len(cache) == 1
+
+
+def test_sub_reading_position_is_not_cached():
+    cache = FragmentCache()
+
+    class Test(Program):
+        fragment_cache = cache
+
+        @sub
+        def data(self):
+            self.add_binary_data(b"abc")
+
+        def main(self):
+            self.data()
+
+    Test().to_binary()
+    assert len(cache) == 0
+
+
+def test_sub_including_file_is_not_cached(tmpdir):
+    cache = FragmentCache()
+    binary_file = tmpdir.join("data.bin")
+
+    class Test(Program):
+        fragment_cache = cache
+
+        @sub
+        def data(self):
+            self.incbin(binary_file.strpath)
+
+        def main(self):
+            self.data()
+
+    for content in [b"abc", b"xyz"]:
+        binary_file.write_binary(content)
+        assert content in Test().to_binary()
+    assert len(cache) == 0
+
+
+def test_sub_using_operand_is_cached():
+    def make_toggle(bit):
+        @sub
+        def delay(self):
+            cpl(bit)
+
+        return delay
+
+    cache = FragmentCache()
+    for bit in [Bit(0x90), Bit(0x90), Bit(0x91)]:
+        assert (
+            make_program(cache, delay=make_toggle(bit))().to_binary()
+            == uncached(delay=make_toggle(bit))
+        )
+    assert len(cache) == 2
+
+
+def test_sub_with_relaxed_jump_is_replayed():
+    cache = FragmentCache()
+
+    @sub
+    def delay(self):
+        Label("again")
+        nop()
+        jump("again")
+
+    assert make_program(cache, delay=delay)().to_binary() == uncached(delay=delay)
+    assert make_program(cache, delay=delay)().to_binary() == uncached(delay=delay)
+    assert len(cache) == 1
+
+
+def test_cache_is_disabled_by_default():
+    class Test(Program):
+        @sub
+        def set_value(self):
+            self.value = 5
+
+        @sub
+        def use_value(self):
+            mov(A, self.value)
+
+        def main(self):
+            self.value = 1
+            self.set_value()
+            self.use_value()
+
+    assert Program.fragment_cache is None
+    assert Test().to_binary() == Test().to_binary()
+
+
+def test_changed_module_attribute_is_not_replayed():
+    @sub
+    def delay(self):
+        mov(A, config.value)
+
+    cache = FragmentCache()
+    for value in [1, 2]:
+        config.value = value
+        assert (
+            make_program(cache, delay=delay)().to_binary()
+            == uncached(delay=delay)
+        )
+    assert len(cache) == 2
+
+
+def test_changed_class_attribute_is_not_replayed():
+    @sub
+    def delay(self):
+        mov(A, Config.value)
+
+    cache = FragmentCache()
+    for value in [1, 2]:
+        Config.value = value
+        assert (
+            make_program(cache, delay=delay)().to_binary()
+            == uncached(delay=delay)
+        )
+    assert len(cache) == 2
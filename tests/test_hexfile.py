@@ -0,0 +1,71 @@
+from io import BytesIO
+
+from pytest import raises
+
+from yay import Program as _Program
+from yay.hexfile import IHexWriter, write_ihex
+
+
+class Program(_Program, cpu="AT89S8253"):
+    pass
+
+
+def render(chunks, *args, **kwargs):
+    outfile = BytesIO()
+    write_ihex(chunks, outfile, *args, **kwargs)
+    return outfile.getvalue().decode().splitlines()
+
+
+def test_write_ihex_matches_to_ihex():
+    class Test(Program):
+        def main(self):
+            for i in range(40):
+                mov(R7, i)
+            jump("main")
+            Label("main")
+
+    test = Test()
+    test.relocate(0x1234)
+    outfile = BytesIO()
+    test.write_ihex(outfile)
+    assert outfile.getvalue() == test.to_ihex().encode()
+
+
+def test_record_length():
+    assert render([b"\x01\x02", b"\x03"], record_length=2) == [
+        ":020000000102FB",
+        ":0100020003FA",
+        ":00000001FF",
+    ]
+
+
+def test_extended_linear_address():
+    assert render([bytes(4)], 0xfffe, extended_linear_address=True) == [
+        ":02FFFE00000001",
+        ":020000040001F9",
+        ":020000000000FE",
+        ":00000001FF",
+    ]
+
+
+def test_address_above_64k_requires_extended_linear_address():
+    with raises(ValueError):
+        render([bytes(4)], 0xfffe)
+
+
+def test_invalid_record_length():
+    with raises(ValueError):
+        IHexWriter(BytesIO(), record_length=256)
+
+
+def test_seek():
+    outfile = BytesIO()
+    with IHexWriter(outfile) as writer:
+        writer.write(b"\x01")
+        writer.seek(0x100)
+        writer.write(b"\x02")
+    assert outfile.getvalue().decode().splitlines() == [
+        ":0100000001FE",
+        ":0101000002FC",
+        ":00000001FF",
+    ]
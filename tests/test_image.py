@@ -0,0 +1,105 @@
+from io import BytesIO
+
+from pytest import raises
+
+from yay import Program as _Program
+from yay.image import AssembledImage
+
+
+class Program(_Program, cpu="AT89S8253"):
+    pass
+
+
+def test_regions_are_merged():
+    image = AssembledImage(size=16)
+    image.write(4, b"ef")
+    image.write(0, b"ab")
+    image.write(2, b"cd")
+    image.write(10, b"xy")
+    image.write(8, b"")
+    assert image.regions == [(0, 6), (10, 12)]
+    assert image.to_binary() == b"abcdef\0\0\0\0xy"
+
+
+def test_overlapping_writes_raise():
+    image = AssembledImage(size=16)
+    image.write(4, b"abcd")
+    for address, data in [(2, b"abc"), (7, b"a"), (5, b"a"), (0, bytes(16))]:
+        with raises(ValueError, match="overlaps"):
+            image.write(address, data)
+    assert image.regions == [(4, 8)]
+
+
+def test_image_grows():
+    image = AssembledImage(size=4)
+    image.write(0x10000, b"a")
+    assert image.end == 0x10001
+    assert image.view(0x10000).tobytes() == b"a"
+
+
+def test_segments_are_views():
+    image = AssembledImage()
+    image.write(0x100, b"abc")
+    image.write(0x10, b"x")
+    segments = image.segments()
+    assert [(start, data.tobytes()) for start, data in segments] == [
+        (0x10, b"x"),
+        (0x100, b"abc"),
+    ]
+    assert all(isinstance(data, memoryview) for _, data in segments)
+
+
+def test_sections():
+    class Test(Program):
+        def main(self):
+            ljmp("main")
+            self.org(0x0B)
+            jump("timer")
+            self.org(0x100)
+            Label("main")
+            jump("main")
+            self.org(0x80)
+            Label("timer")
+            cpl(P1[0])
+            jump("done")
+            Label("done")
+            reti()
+
+    test = Test()
+    assert test.image.regions == [
+        (0, 3), (0x0B, 0x0E), (0x80, 0x85), (0x100, 0x103),
+    ]
+    binary = test.to_binary()
+    assert binary[:3] == bytes([0x02, 0x01, 0x00])
+    # Jumps before the last `org` are not relaxed.
+    assert binary[0x0B:0x0E] == bytes([0x02, 0x00, 0x80])
+    assert binary[0x100:] == bytes([0x02, 0x01, 0x00])
+    assert binary[0x80:0x85] == bytes([0xB2, 0x90, 0x80, 0x00, 0x32])
+
+    outfile = BytesIO()
+    test.write_ihex(outfile)
+    assert outfile.getvalue() == test.to_ihex().encode()
+
+
+def test_overlapping_sections_raise():
+    class Test(Program):
+        def main(self):
+            nop()
+            nop()
+            self.org(1)
+            nop()
+
+    with raises(ValueError, match="overlaps"):
+        Test().to_binary()
+
+
+def test_outputs_share_one_assembly():
+    class Test(Program):
+        def main(self):
+            nop()
+
+    test = Test()
+    image = test.image
+    test.to_binary()
+    test.to_ihex()
+    assert test.image is image
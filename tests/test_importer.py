@@ -0,0 +1,160 @@
+import subprocess
+import sys
+from textwrap import dedent
+
+from pytest import fixture
+
+import yay
+from yay import importer
+from yay.importer import (
+    YayFileLoader, YayFinder, cache_path, import_yay_file, lower,
+)
+
+
+SOURCE = dedent("""\
+    from yay import Program
+
+    class Main(Program, cpu="MCS_51"):
+        def main(self):
+            A <- {}
+""")
+
+
+@fixture(autouse=True)
+def write_bytecode(mocker):
+    mocker.patch.object(sys, "dont_write_bytecode", False)
+
+
+def write_source(tmpdir, value):
+    yay_file = tmpdir.join("test.yay")
+    yay_file.write(SOURCE.format(value))
+    return yay_file.strpath
+
+
+def count_compilations(mocker):
+    return mocker.patch.object(
+        YayFileLoader,
+        "source_to_code",
+        side_effect=YayFileLoader.source_to_code,
+        autospec=True,
+    )
+
+
+def test_code_is_cached(tmpdir, mocker):
+    yay_filename = write_source(tmpdir, 42)
+    import_yay_file(yay_filename)
+    source_to_code = count_compilations(mocker)
+    module = import_yay_file(yay_filename)
+    assert not source_to_code.called
+    assert module.Main().to_binary() == bytes([0x74, 42])
+
+
+def test_cache_path_does_not_clash_with_python_files(tmpdir):
+    assert cache_path(tmpdir.join("test.yay").strpath) != (
+        cache_path(tmpdir.join("test.py").strpath)
+    )
+
+
+def test_changed_source_is_recompiled(tmpdir):
+    import_yay_file(write_source(tmpdir, 42))
+    module = import_yay_file(write_source(tmpdir, 17))
+    assert module.Main().to_binary() == bytes([0x74, 17])
+
+
+def test_cache_is_invalidated_by_yay_version(tmpdir, mocker):
+    yay_filename = write_source(tmpdir, 42)
+    import_yay_file(yay_filename)
+    mocker.patch.object(importer, "_versions_key", return_value=b"other")
+    source_to_code = count_compilations(mocker)
+    import_yay_file(yay_filename)
+    assert source_to_code.called
+
+
+def test_cache_key_depends_on_lowering():
+    assert importer._file_digest(importer.__file__).encode() in (
+        importer._versions_key()
+    )
+
+
+def test_cache_key_does_not_import_yay_ast():
+    imported = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from yay import importer; importer._versions_key();"
+            " print('yay_ast' in sys.modules)",
+        ],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stdout
+    assert imported.strip() == "False"
+
+
+def test_cached_code_has_filename_of_source(tmpdir, mocker):
+    original = tmpdir.mkdir("original")
+    import_yay_file(write_source(original, 42))
+    moved = tmpdir.join("moved")
+    original.copy(moved)
+    source_to_code = count_compilations(mocker)
+    module = import_yay_file(moved.join("test.yay").strpath)
+    assert not source_to_code.called
+    assert module.Main.main.__code__.co_filename == (
+        moved.join("test.yay").strpath
+    )
+
+
+def test_lower_arrow_assign_and_deref():
+    load = yay.ast.Load()
+    location = dict(lineno=1, col_offset=0)
+    tree = yay.ast.Module(
+        body=[
+            yay.ast.ArrowAssign(
+                targets=[yay.ast.Name(id="a", ctx=load, **location)],
+                value=yay.ast.UnaryOp(
+                    op=yay.ast.Deref(),
+                    operand=yay.ast.Name(id="b", ctx=load, **location),
+                    **location
+                ),
+                **location
+            ),
+        ],
+        type_ignores=[],
+    )
+    calls = []
+    namespace = dict(
+        a="a",
+        b="b",
+        at=lambda x: ("at", x),
+        mov=lambda *args: calls.append(args),
+    )
+    exec(compile(lower(tree), "<test>", "exec"), namespace)
+    assert calls == [("a", ("at", "b"))]
+
+
+def test_finder_finds_new_files(tmpdir):
+    finder = YayFinder(roots=[tmpdir.strpath])
+    assert finder.find_spec("test_module", None) is None
+    tmpdir.join("test_module.yay").write("")
+    assert finder.find_spec("test_module", None).origin == (
+        tmpdir.join("test_module.yay").strpath
+    )
+
+
+def test_finder_finds_submodules_in_package_path(tmpdir):
+    tmpdir.mkdir("package").join("test_module.yay").write("")
+    finder = YayFinder(roots=[tmpdir.strpath])
+    package_path = [tmpdir.join("package").strpath]
+    assert finder.find_spec("package.test_module", None) is not None
+    assert finder.find_spec("package.test_module", package_path) is not None
+    assert finder.find_spec("package.other", package_path) is None
+
+
+def test_finder_scope(tmpdir):
+    tmpdir.join("test_module.yay").write("")
+    finder = YayFinder(roots=[tmpdir.strpath], prefixes=["firmware"])
+    assert finder.find_spec("test_module", None) is None
+    assert finder.is_in_scope("firmware.test_module")
+    assert finder.is_in_scope("yay.cpus.MCS_51.macros")
+    finder.set_scope(roots=[tmpdir.strpath])
+    assert finder.find_spec("test_module", None) is not None
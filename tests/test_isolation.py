@@ -1,6 +1,6 @@
 from pytest import fixture, mark, raises
 
-from yay import Program
+from yay import Program, macro
 from yay.cpu import make_cpu
 
 
@@ -10,7 +10,8 @@ def Foo():
         def main(self):
             with raises(AttributeError):
                 R0.not_existing_attribute
-            R0.not_existing_attribute = 42
+            with raises(AttributeError):
+                R0.not_existing_attribute = 42
     return Foo
 
 
@@ -20,7 +21,8 @@ def Bar():
         def main(self):
             with raises(AttributeError):
                 R0.not_existing_attribute
-            R0.not_existing_attribute = 42
+            with raises(AttributeError):
+                R0.not_existing_attribute = 42
     return Bar
 
 
@@ -57,3 +59,37 @@ def test_cpu_unaffected(Foo):
     Foo().to_binary()
     with raises(AttributeError):
         make_cpu("AT89S8253")["registers"]["R0"].not_existing_attribute
+
+
+def test_registers_are_bound_per_program(Foo, Bar):
+    foo = Foo()
+    bar = Bar()
+    assert foo._cpu_namespace["R0"] is not bar._cpu_namespace["R0"]
+    assert foo._cpu_namespace["R0"].program is foo
+    assert bar._cpu_namespace["R0"].program is bar
+    assert make_cpu("AT89S8253")["registers"]["R0"].program is None
+
+
+def test_macros_are_bound_per_program():
+    class Test(Program, cpu="AT89S8253"):
+        @macro
+        def register(self):
+            return R0
+
+        def main(self):
+            pass
+
+    foo = Test()
+    bar = Test()
+    assert foo.register() is foo._cpu_namespace["R0"]
+    assert bar.register() is bar._cpu_namespace["R0"]
+    assert foo.loop.__func__ is not bar.loop.__func__
+
+
+def test_binding_does_not_create_classes(Foo):
+    nop = make_cpu("AT89S8253")["mnemonics"]["nop"]
+    foo = Foo()
+    assert foo.mnemonic("nop").cls is nop
+    foo.mnemonic("nop")()
+    assert type(foo._opcodes[-1]) is nop
+    assert foo._opcodes[-1].program is foo
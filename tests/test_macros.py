@@ -1,3 +1,5 @@
+from pytest import mark
+
 from yay import Program as _Program
 from yay import sub
 
@@ -110,18 +112,38 @@ def test_sub_direct():
     assert Test().to_binary() == Expected().to_binary()
 
 
-def test_ljmp_infinitely():
+@mark.parametrize("nops, jump", [
+    (10, "sjmp"),
+    (1000, "ajmp"),
+    (3000, "ljmp"),
+])
+def test_infinitely(nops, jump):
     class Test(Program):
         def main(self):
             with self.infinitely():
-                for _ in range(1000):
+                for _ in range(nops):
                     nop()
 
     class Expected(Program):
         def main(self):
             Label("infinite_loop")
-            for _ in range(1000):
+            for _ in range(nops):
+                nop()
+            self.mnemonic(jump)("infinite_loop")
+
+    assert Test().to_binary() == Expected().to_binary()
+
+
+def test_skip():
+    class Test(Program):
+        def main(self):
+            with self.skip():
                 nop()
-            ljmp("infinite_loop")
+
+    class Expected(Program):
+        def main(self):
+            sjmp("down")
+            nop()
+            Label("down")
 
     assert Test().to_binary() == Expected().to_binary()
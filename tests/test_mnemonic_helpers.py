@@ -1,8 +1,14 @@
-from pytest import fixture, raises
+import pickle
+from copy import copy, deepcopy
+
+from pytest import fixture, mark, raises
 
 from yay import InvalidRegisterError, Program
 from yay.cpu import make_cpu
-from yay.cpus.MCS_51 import Byte, DptrOffset, at
+from yay.cpus.MCS_51 import (
+    Bit, Byte, DptrOffset, IndirectRegister, NamedBit, NotBit, Register, SFR,
+    at
+)
 from yay.mnemonic import Mnemonic
 
 
@@ -17,12 +23,11 @@ globals().update(cpu["sfrs"])
 
 
 @fixture
-def test_mnemonic(mocker):
-    mocker.patch("yay.mnemonic.Mnemonic.__init__", return_value=None)
+def test_mnemonic():
     class TestProgram(Program, cpu="MCS_51"):
         pass
     TestMnemonic = Mnemonic.bind_program(TestProgram())
-    return TestMnemonic()
+    return TestMnemonic.new()
 
 
 def test_matches_args(test_mnemonic):
@@ -83,3 +88,31 @@ def test_matches_kwargs(test_mnemonic):
     for kwargs, argument_format, expected in tests:
         matches, _ = test_mnemonic.matches_kwargs(kwargs, argument_format)
         assert bool(matches) is expected
+
+
+def test_operands_are_interned():
+    cpu = make_cpu("AT89S8253")
+    P1 = cpu["sfrs"]["P1"]
+    assert Bit(0x90) is Bit(0x90)
+    assert P1[0] is Bit(0x90)
+    assert ~P1[0] is ~Bit(0x90)
+    assert Byte(0x30) is Byte(0x30)
+    assert Byte(0x30) is not Bit(0x30)
+    assert copy(P1) is P1
+    assert deepcopy([P1[0]])[0] is P1[0]
+    assert pickle.loads(pickle.dumps(P1[0])) is P1[0]
+    with raises(AttributeError):
+        Bit(0x90).name = "P1.0"
+
+
+@mark.parametrize("operand, kind", [
+    (Byte(0x30), "direct"),
+    (SFR("P1", 0x90), "direct"),
+    (Bit(0x90), "bit"),
+    (NamedBit("F0", 0xD5), "bit"),
+    (NotBit(0x90), "not_bit"),
+    (Register(0), "register"),
+    (IndirectRegister(0), "indirect"),
+])
+def test_operand_kind(operand, kind):
+    assert operand.kind == kind
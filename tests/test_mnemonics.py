@@ -1,7 +1,10 @@
 from pytest import mark, raises
 
 from yay import Program as _Program
-from yay import InvalidRegisterError, WrongSignatureException
+from yay import (
+    InvalidConfigError, InvalidRegisterError, WrongSignatureException
+)
+from yay.mnemonic import compile_opcode
 
 
 class Program(_Program, cpu="AT89S8253"):
@@ -268,3 +271,81 @@ def test_Lit():
                 Lit(i)
 
     assert Test().to_binary() == bytes(range(10))
+
+
+def test_signature_dispatch_resolves_alternatives():
+    mnemonics = []
+
+    class Test(Program):
+        def main(self):
+            Label("label")
+            for _ in range(2):
+                mnemonics.append(sjmp("label"))
+                mnemonics.append(djnz(R7, 0))
+                mnemonics.append(add(Byte(42)))
+                mnemonics.append(add(42))
+
+    Test().to_binary()
+    alternatives = [mnemonic.signature.alternatives_taken for mnemonic in mnemonics]
+    signatures = [mnemonic.signature.signature for mnemonic in mnemonics]
+    assert alternatives == 2 * [{"relative": "label"}, {"relative": "addr16"}, {}, {}]
+    assert signatures == 2 * [("label", ), ("register", "addr16"), ("direct", ), ("immediate", )]
+    assert mnemonics[0].signature is mnemonics[4].signature
+
+
+def test_signature_dispatch_rejects_repeatedly():
+    class Test(Program):
+        def main(self):
+            add(Byte(42))
+            add(420)
+
+    for _ in range(2):
+        with raises(WrongSignatureException):
+            Test().to_binary()
+
+
+@mark.parametrize("opcode", [
+    [[0, 1, 0]],
+    [[300]],
+    [["unknown"]],
+    [[0, 0, 0, 0, 0, 0, 0, 2]],
+    [[0, 0, 0, 0, 0, 0, "r1", "x0"]],
+    [[0, 0, 0, 0, 0, 0, 0, "a0"]],
+])
+def test_invalid_opcode_format_fails_when_compiled(opcode):
+    signature = {"signature": ["register"], "opcode": opcode}
+    with raises(InvalidConfigError):
+        compile_opcode(signature, {"r": "register", "a": "addr11"})
+
+
+def test_compiled_opcode():
+    encode = compile_opcode(
+        {
+            "signature": ["register", "addr11", "immediate"],
+            "opcode": [
+                [1, 0, "a9", "a8", 1, "r2", "r1", "r0"],
+                ["a7", "a6", "a5", "a4", "a3", "a2", "a1", "a0"],
+                ["immediate"],
+            ],
+        },
+        {"r": "register", "a": "addr11"},
+    )
+    assert encode.argnames == ("register", "addr11", "immediate")
+    assert encode(5, 0x2a5, -2) == bytes([0b1010_1101, 0xa5, 0xfe])
+    with raises(ValueError):
+        encode(5, 0x2a5, 256)
+
+
+def test_mnemonics_are_slotted():
+    mnemonics = []
+
+    class Test(Program):
+        def main(self):
+            mnemonics.append(mov(A, R0))
+            mnemonics.append(Lit(42))
+            mnemonics.append(jump("main"))
+            Label("main")
+
+    Test().to_binary()
+    for mnemonic in mnemonics:
+        assert not hasattr(mnemonic, "__dict__")
@@ -0,0 +1,192 @@
+import json
+import pickle
+from io import BytesIO
+
+from pytest import mark, raises
+
+from yay import Mod, macro, sub
+from yay import Program as _Program
+from yay.objects import LinkError, ObjectFile, link
+
+
+class Program(_Program, cpu="AT89S8253"):
+    fragment_cache = None
+
+
+class Delay(Mod):
+    @sub
+    def wait(self):
+        with self.program.loop(R7, 10):
+            nop()
+
+
+class Library(Program):
+    mods = [Delay]
+
+    @macro
+    def blink(self):
+        Label("blink")
+        cpl(P1[0])
+        Delay().wait()
+        jump("blink_done")
+        for _ in range(3):
+            nop()
+        Label("blink_done")
+        ret()
+
+    def main(self):
+        self.blink()
+
+
+class Application(Program):
+    @macro
+    def application(self):
+        Label("start")
+        mov(A, 42)
+        call("blink")
+        jnb(P1[1], "start")
+        jump("start")
+
+    def main(self):
+        self.application()
+
+
+class Linked(Application, Library):
+    mods = [Delay]
+
+    def main(self):
+        self.application()
+        self.blink()
+
+
+def roundtrip(obj):
+    buffer = BytesIO()
+    obj.dump(buffer)
+    buffer.seek(0)
+    return ObjectFile.load(buffer)
+
+
+def test_linked_object_equals_program():
+    obj = roundtrip(Library().to_object())
+    assert obj.symbols == ("blink", "blink_done")
+    assert obj.references == ()
+    assert obj.origin is None
+    assert link([obj]).to_binary() == Library().to_binary()
+
+
+def test_link_resolves_references_between_objects():
+    application = Application().to_object()
+    assert application.references == ("blink", )
+
+    objects = [roundtrip(application), roundtrip(Library().to_object())]
+    assert link(objects).to_binary() == Linked().to_binary()
+
+    binary = link(objects, origin=0x100).to_binary()
+    relocated = Linked()
+    relocated.relocate(0x100)
+    assert binary == relocated.to_binary()
+
+
+def test_objects_can_be_linked_into_programs():
+    library = Library().to_object()
+
+    class Test(Application):
+        mods = [Delay]
+
+        def main(self):
+            self.application()
+            self.link(library)
+
+    assert Test().to_binary() == Linked().to_binary()
+
+
+def test_link_errors():
+    with raises(LinkError, match="Undefined symbols: \\['blink'\\]"):
+        link([Application().to_object()])
+    with raises(LinkError, match="defined multiply"):
+        link([Library().to_object(), Library().to_object()])
+
+
+def test_object_reading_its_position_is_absolute():
+    class Table(Program):
+        def main(self):
+            position = self.add_binary_data(b"abc")
+            mov(DPTR, position)
+            jump("end")
+            Label("end")
+
+    class Padding(Program):
+        def main(self):
+            nop()
+
+    table = Table()
+    table.relocate(0x10)
+    table = table.to_object()
+    assert table.origin == 0x10
+
+    binary = link([Padding().to_object(), table]).to_binary()
+    assert binary == bytes([0, *bytes(15), *b"abc", 0x90, 0, 0x10, 0x80, 0])
+
+    with raises(LinkError, match="Cannot place object at 0x10"):
+        link([table], origin=0x20).to_binary()
+
+
+def test_mod_subs_can_be_exported():
+    class DelayLibrary(Program):
+        mods = [Delay]
+
+        def main(self):
+            Delay().wait()
+
+    class Caller(Program):
+        mods = [Delay]
+
+        def main(self):
+            Delay().wait()
+
+    class Expected(Program):
+        mods = [Delay]
+
+        def main(self):
+            delay = Delay()
+            delay.wait()
+            delay.wait()
+
+    library = roundtrip(DelayLibrary().to_object(export_subs=True))
+    assert library.symbols == ("Delay.wait", )
+    caller = roundtrip(Caller().to_object(extern=[Delay]))
+    assert caller.symbols == ()
+    assert caller.references == ("Delay.wait", )
+    assert link([caller, library]).to_binary() == Expected().to_binary()
+
+
+def test_object_for_other_configuration_is_rejected():
+    obj = Library().to_object()
+    obj.cpu_digest = "other"
+    with raises(LinkError, match="different configuration"):
+        link([obj]).to_binary()
+
+
+def test_load_rejects_other_files():
+    with raises(LinkError, match="Not an object file"):
+        ObjectFile.load(BytesIO(pickle.dumps(Library().to_object())))
+
+
+@mark.parametrize("corrupt, message", [
+    (lambda event: {**event, "signature": 999}, "Invalid signature 999"),
+    (lambda event: {**event, "mnemonic": "no_such"}, "Unknown mnemonic"),
+    (lambda event: {**event, "arguments": []}, "Invalid signature"),
+], ids=["signature", "mnemonic", "arguments"])
+def test_corrupted_relocation_is_rejected(corrupt, message):
+    outfile = BytesIO()
+    Library().to_object().dump(outfile)
+    data = json.loads(outfile.getvalue().decode())
+    index, event = next(
+        (index, event)
+        for index, event in enumerate(data["events"])
+        if event.get("signature") is not None
+    )
+    data["events"][index] = corrupt(event)
+    obj = ObjectFile.load(BytesIO(json.dumps(data).encode()))
+    with raises(LinkError, match=f"{message}.* event {index} "):
+        link([obj]).to_binary()
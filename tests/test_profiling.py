@@ -0,0 +1,61 @@
+import json
+
+from yay import Program, profiling
+from yay.cli import main
+
+
+class Blink(Program, cpu="AT89S8253"):
+    def main(self):
+        Label("loop")
+        inc(R0)
+        ajmp("loop")
+
+
+def test_profile_records_phases_and_counters():
+    with profiling.profiled() as profile:
+        Blink().to_binary()
+
+    assert profiling.active is None
+    assert {"make_cpu", "main", "subs", "relax", "encode fixups", "output"} <= (
+        profile.phases.keys()
+    )
+    assert profile.phases["match"][0] == 2
+    assert profile.counters["mnemonics"] == 2
+    assert profile.counters["labels"] == 1
+
+
+def test_profile_is_off_by_default():
+    Blink().to_binary()
+    assert profiling.active is None
+
+
+def test_cli_profile_json(tmpdir, capsys):
+    main([
+        "examples/mcs_51/blink.yay",
+        "-o", tmpdir.join("blink.hex").strpath,
+        "--profile",
+        "--profile-format", "json",
+    ])
+    profile = json.loads(capsys.readouterr().err)
+    assert {"import", "main", "output"} <= profile["phases"].keys()
+    assert profile["counters"]["mnemonics"] > 0
+
+
+def test_cli_profile_merges_batch_jobs(tmpdir, capsys):
+    status = main([
+        "examples/mcs_51/blink.yay",
+        "examples/mcs_51/echo.yay",
+        "--outdir", tmpdir.strpath,
+        "--profile",
+    ])
+    assert status == 0
+    report = capsys.readouterr().err
+    assert report.startswith("phase")
+    assert "mnemonics" in report
+
+
+def test_cli_profile_before_input_file(tmpdir, capsys):
+    outfile = tmpdir.join("blink.hex")
+    main(["--profile", "examples/mcs_51/blink.yay", "-o", outfile.strpath])
+    assert capsys.readouterr().err.startswith("phase")
+    assert outfile.check()
@@ -5,7 +5,8 @@ from textwrap import dedent
 from pytest import mark, raises
 
 from yay import Program as _Program
-from yay import block_macro, macro, sub
+from yay import Mod, block_macro, macro, sub
+from yay.cpus.MCS_51 import LookupTableDptr
 
 
 class Program(_Program, cpu="AT89S8253"):
@@ -105,7 +106,7 @@ def test_sub():
     class Expected(Program):
         def main(self):
             nop()
-            lcall("foo")
+            acall("foo")
             nop()
             Label("foo")
             inc()
@@ -126,6 +127,80 @@ def test_unused_sub_does_not_emit_body():
     assert Test().to_binary() == b""
 
 
+def test_sub_labels_are_per_program():
+    class Test(Program):
+        @sub
+        def foo(self):
+            inc()
+
+        def main(self):
+            self.foo()
+            jump("end")
+            Label("end")
+
+    assert Test().to_binary() == Test().to_binary()
+
+
+def test_deep_chain_of_subs_across_mods():
+    executed = []
+
+    class A(Mod):
+        @sub
+        def first(self):
+            executed.append("first")
+            mov(R0, 1)
+            self.program.b.second()
+
+        @sub
+        def fourth(self):
+            executed.append("fourth")
+            mov(R0, 4)
+            self.program.b.fifth()
+
+    class B(Mod):
+        @sub
+        def second(self):
+            executed.append("second")
+            mov(R0, 2)
+            self.program.c.third()
+
+        @sub
+        def fifth(self):
+            executed.append("fifth")
+            mov(R0, 5)
+
+    class C(Mod):
+        @sub
+        def third(self):
+            executed.append("third")
+            mov(R0, 3)
+            self.program.a.fourth()
+
+    class Test(Program):
+        mods = [A, B, C]
+
+        def main(self):
+            self.a, self.b, self.c = (self.mnemonic(name)() for name in "ABC")
+            self.a.first()
+            self.a.first()
+
+    class Expected(Program):
+        def main(self):
+            acall("first")
+            acall("first")
+            names = ["first", "second", "third", "fourth", "fifth"]
+            callees = names[1:] + [None]
+            for n, (name, callee) in enumerate(zip(names, callees), start=1):
+                Label(name)
+                mov(R0, n)
+                if callee is not None:
+                    acall(callee)
+                ret()
+
+    assert Test().to_binary() == Expected().to_binary()
+    assert executed == ["first", "second", "third", "fourth", "fifth"]
+
+
 @mark.xfail(reason="Not sure if this should be implemented.")
 def test_opcodes_in_class_body():
     class InBody(Program):
@@ -488,3 +563,361 @@ def test_add_binary_data():
     test = Test()
     assert test.to_binary() == bytes([42, *range(12), 27])
     assert test.data_position == 1
+
+
+def test_add_binary_data_appends_one_block():
+    class Test(Program):
+        def main(self):
+            self.add_binary_data(bytes(32 * 1024))
+            self.add_binary_data([1, 2, 3])
+
+    test = Test()
+    assert test.to_binary() == bytes(32 * 1024) + bytes([1, 2, 3])
+    assert len(test._opcodes) == 2
+
+
+def test_incbin(tmpdir):
+    binary_file = tmpdir.join("data.bin")
+    binary_file.write_binary(bytes(range(16)))
+    empty_file = tmpdir.join("empty.bin")
+    empty_file.write_binary(b"")
+
+    class Test(Program):
+        def main(self):
+            Lit(42)
+            self.whole = self.incbin(binary_file.strpath)
+            self.part = self.incbin(binary_file.strpath, offset=4, length=3)
+            self.incbin(empty_file.strpath)
+
+    test = Test()
+    assert test.to_binary() == bytes([42, *range(16), 4, 5, 6])
+    assert (test.whole, test.part) == (1, 17)
+
+    with raises(ValueError):
+        Program().incbin(binary_file.strpath, offset=8, length=9)
+
+
+@mark.parametrize("offset, length", [(-1, None), (-4, 2), (0, -1), (4, -2)])
+def test_incbin_rejects_negative_offset_and_length(tmpdir, offset, length):
+    binary_file = tmpdir.join("data.bin")
+    binary_file.write_binary(bytes(range(16)))
+    with raises(ValueError):
+        Program().incbin(binary_file.strpath, offset=offset, length=length)
+
+
+def test_lookup_table_dptr_layout():
+    class Test(Program):
+        mods = [LookupTableDptr]
+
+        def main(self):
+            self.table = LookupTableDptr({3: b"ab", 4: b"c", 6: b"def"}, 3)
+
+    assert Test().to_binary() == b"ab\0c\0\0\0\0\0def"
+
+
+def test_assembly_scales_linearly_with_branches():
+    def opcodes_visited(branches):
+        visited = 0
+
+        class CountingOpcodes(list):
+            def __iter__(self):
+                nonlocal visited
+                for opcode in super().__iter__():
+                    visited += 1
+                    yield opcode
+
+        class Test(Program, opcode_destination=CountingOpcodes):
+            def main(self):
+                for n in range(branches):
+                    Label(f"label_{n}")
+                    sjmp(f"label_{n}")
+                    acall(f"label_{n}")
+
+        Test().to_binary()
+        return visited
+
+    assert opcodes_visited(200) == 2 * opcodes_visited(100)
+
+
+def test_position_of_mnemonic():
+    mnemonics = []
+
+    class Test(Program):
+        def main(self):
+            mnemonics.append(nop())
+            mnemonics.append(ljmp(0))
+            mnemonics.append(nop())
+
+    test = Test()
+    test.relocate(0x100)
+    test.to_binary()
+    assert [mnemonic.position for mnemonic in mnemonics] == [0x100, 0x101, 0x104]
+
+
+def test_only_position_dependent_mnemonics_are_fixups():
+    class Test(Program):
+        def main(self):
+            Label("start")
+            mov(A, 42)
+            sjmp("start")
+            add(R3)
+            jump("start")
+            self.add_binary_data(b"ab")
+            lcall(0x10)
+            acall(0x10)
+
+    test = Test()
+    binary = test.to_binary()
+    assert [type(fixup).__name__ for fixup in test._fixups] == [
+        "sjmp", "jump", "RawData", "acall",
+    ]
+    assert list(test._fixup_offsets) == [2, 3, 3, 6]
+    assert test._code == bytes([0x74, 42, 0x2B, 0x12, 0x00, 0x10])
+    assert binary == bytes([
+        0x74, 42, 0x80, 0xFC, 0x2B, 0x02, 0x00, 0x00, *b"ab", 0x12, 0x00,
+        0x10, 0x11, 0x10,
+    ])
+
+
+def test_relaxed_jump_uses_shortest_form():
+    class Test(Program):
+        def main(self):
+            Label("start")
+            jump("start")
+            jump("end")
+            for _ in range(200):
+                nop()
+            Label("end")
+            jump(0x1000)
+
+    class Expected(Program):
+        def main(self):
+            Label("start")
+            sjmp("start")
+            ajmp("end")
+            for _ in range(200):
+                nop()
+            Label("end")
+            ljmp(0x1000)
+
+    assert Test().to_binary() == Expected().to_binary()
+
+
+@mark.parametrize("nops, short_jump", [(124, "sjmp"), (125, "ajmp")])
+def test_relaxed_jump_is_widened_when_necessary(nops, short_jump):
+    class Test(Program):
+        def main(self):
+            jump("end")
+            for _ in range(nops):
+                nop()
+            jump(0x1000)
+            Label("end")
+
+    class Expected(Program):
+        def main(self):
+            self.mnemonic(short_jump)("end")
+            for _ in range(nops):
+                nop()
+            ljmp(0x1000)
+            Label("end")
+
+    test = Test()
+    assert test.to_binary() == Expected().to_binary()
+    assert test.labels["end"] == nops + 5
+
+
+def test_relaxed_call():
+    class Test(Program):
+        def main(self):
+            call("near")
+            call(0x1000)
+            Label("near")
+
+    class Expected(Program):
+        def main(self):
+            acall("near")
+            lcall(0x1000)
+            Label("near")
+
+    assert Test().to_binary() == Expected().to_binary()
+
+
+def test_reading_position_keeps_preceding_jumps_long():
+    class Test(Program):
+        def main(self):
+            jump("end")
+            self.data_position = self.add_binary_data(b"ab")
+            jump("end")
+            Label("end")
+
+    test = Test()
+    assert test.to_binary() == bytes([0x02, 0x00, 0x07, *b"ab", 0x80, 0x00])
+    assert test.data_position == 3
+
+
+def test_reading_position_of_mnemonic_keeps_preceding_jumps_long():
+    class Test(Program):
+        def main(self):
+            jump("end")
+            self.nop_position = nop().position
+            Label("end")
+
+    test = Test()
+    assert test.to_binary() == bytes([0x02, 0x00, 0x04, 0x00])
+    assert test.nop_position == 3
+
+
+def test_reading_label_keeps_preceding_jumps_long():
+    class Test(Program):
+        def main(self):
+            with self.skip():
+                nop()
+            Label("table")
+            Lit(1)
+            mov(DPTR, self.labels["table"])
+
+    class Expected(Program):
+        def main(self):
+            ljmp("skip")
+            nop()
+            Label("skip")
+            Label("table")
+            Lit(1)
+            mov(DPTR, 4)
+
+    assert Test().to_binary() == Expected().to_binary()
+
+
+def test_reading_label_address_keeps_preceding_jumps_long():
+    class Test(Program):
+        def main(self):
+            jump("table")
+            Label("table")
+            Lit(1)
+            mov(DPTR, self.label_address("table"))
+
+    class Expected(Program):
+        def main(self):
+            ljmp("table")
+            Label("table")
+            Lit(1)
+            mov(DPTR, 3)
+
+    assert Test().to_binary() == Expected().to_binary()
+
+
+def test_shrinking_jumps_keeps_absolute_jumps_in_their_block():
+    class Test(Program):
+        def main(self):
+            jump("end")
+            for _ in range(2043):
+                nop()
+            ajmp(0x802)
+            Label("end")
+
+    class Expected(Program):
+        def main(self):
+            ljmp("end")
+            for _ in range(2043):
+                nop()
+            ajmp(0x802)
+            Label("end")
+
+    assert Test().to_binary() == Expected().to_binary()
+
+
+def test_new_label_name_counts_per_prefix():
+    program = Program()
+    assert program.new_label_name("a") == "a_0"
+    assert program.new_label_name("b") == "b_0"
+    assert program.new_label_name("a") == "a_1"
+
+
+def test_macro_labels_do_not_enter_labels():
+    class Test(Program):
+        def main(self):
+            Label("start")
+            with self.loop(R7, 3):
+                nop()
+            with self.skip():
+                nop()
+
+    test = Test()
+    test.to_binary()
+    assert test.labels == {"start": 0}
+
+
+def test_labels_of_subs_are_global():
+    class Test(Program):
+        @sub
+        def first(self):
+            Label("first_loop")
+            sjmp("first_loop")
+
+        def main(self):
+            self.first()
+            sjmp("first_loop")
+
+    class Expected(Program):
+        def main(self):
+            acall("first")
+            sjmp("first")
+            Label("first")
+            sjmp("first")
+            ret()
+
+    test = Test()
+    assert test.to_binary() == Expected().to_binary()
+    assert test.labels["first_loop"] == 4
+
+
+def test_label_scope_in_subs():
+    class Test(Program):
+        @sub
+        def first(self):
+            with self.label_scope():
+                Label("here")
+                sjmp("here")
+
+        @sub
+        def second(self):
+            with self.label_scope():
+                nop()
+                Label("here")
+                sjmp("here")
+
+        def main(self):
+            self.first()
+            self.second()
+
+    class Expected(Program):
+        def main(self):
+            acall("first")
+            acall("second")
+            Label("first")
+            sjmp("first")
+            ret()
+            Label("second")
+            nop()
+            Label("second_here")
+            sjmp("second_here")
+            ret()
+
+    test = Test()
+    assert test.to_binary() == Expected().to_binary()
+    assert "here" not in test.labels
+
+
+def test_label_address_looks_up_enclosing_scopes():
+    program = Program()
+    program.add_label("outer")
+    with program.label_scope():
+        program.add_label("inner")
+        local = program.new_label_name("local")
+        program.add_label(local)
+        with program.label_scope():
+            assert program.offsetof("inner") == 0
+            assert program.offsetof("outer") == 0
+    assert program.label_address(local) == 0
+    with raises(KeyError):
+        program.label_address("inner")
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+import stat
+from textwrap import dedent
+
+from pytest import fixture
+
+from yay.server import BuildServer, Target, start_unix_server
+
+
+MAIN = dedent("""\
+    from {library} import VALUE
+    from yay import Program
+
+    class Main(Program, cpu="MCS_51"):
+        def main(self):
+            A <- VALUE
+""")
+
+
+@fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@fixture
+def build_server(tmpdir):
+    build_server = BuildServer(tmpdir.strpath)
+    yield build_server
+    build_server.close()
+
+
+def touch(path, content):
+    # Make sure that the mtime changes even on file systems with a coarse
+    # timestamp resolution.
+    mtime = path.stat().mtime if path.exists() else 0
+    path.write(content)
+    os.utime(path.strpath, ns=(0, int((mtime + 2) * 1e9)))
+
+
+@fixture
+def project(tmpdir, monkeypatch):
+    # The library name must be unique, because library modules stay in
+    # `sys.modules`.
+    library = f"server_lib_{id(tmpdir)}"
+    monkeypatch.syspath_prepend(tmpdir.strpath)
+    touch(tmpdir.join(f"{library}.yay"), "VALUE = 42\n")
+    tmpdir.join("main.yay").write(MAIN.format(library=library))
+    tmpdir.join("other.yay").write(MAIN.format(library="yay").replace(
+        "from yay import VALUE",
+        "VALUE = 17",
+    ))
+    return tmpdir, library
+
+
+def target(tmpdir, name):
+    return Target.from_request({
+        "input": tmpdir.join(f"{name}.yay").strpath,
+        "output": tmpdir.join(f"{name}.bin").strpath,
+        "format": "binary",
+    })
+
+
+def test_duplicate_requests_are_merged(loop, build_server, project):
+    tmpdir, _ = project
+    main = target(tmpdir, "main")
+
+    async def build_twice():
+        return await asyncio.gather(
+            build_server.build(main),
+            build_server.build(main),
+        )
+
+    assert loop.run_until_complete(build_twice()) == [None, None]
+    assert build_server.builds == 1
+    assert tmpdir.join("main.bin").read_binary() == bytes([0x74, 42])
+
+
+def test_changed_library_rebuilds_affected_targets(loop, build_server, project):
+    tmpdir, library = project
+    main, other = target(tmpdir, "main"), target(tmpdir, "other")
+    for watched in [main, other]:
+        build_server.watch(watched)
+        assert loop.run_until_complete(build_server.build(watched)) is None
+
+    assert loop.run_until_complete(build_server.rebuild_changed()) == []
+
+    touch(tmpdir.join(f"{library}.yay"), "VALUE = 23\n")
+    assert loop.run_until_complete(build_server.rebuild_changed()) == [main]
+    assert tmpdir.join("main.bin").read_binary() == bytes([0x74, 23])
+    assert tmpdir.join("other.bin").read_binary() == bytes([0x74, 17])
+    assert build_server.builds == 3
+
+
+def test_protocol(loop, build_server, project):
+    tmpdir, _ = project
+
+    socket_path = tmpdir.join("server.sock").strpath
+
+    async def request(*lines):
+        server = await start_unix_server(build_server.handle, socket_path)
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        responses = []
+        for line in lines:
+            writer.write(line + b"\n")
+            responses.append(json.loads((await reader.readline()).decode()))
+        writer.write_eof()
+        # The server closes the connection when it has handled all requests.
+        assert await reader.read() == b""
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return responses
+
+    valid, invalid, missing, outside = loop.run_until_complete(request(
+        json.dumps({
+            "input": tmpdir.join("main.yay").strpath,
+            "output": tmpdir.join("main.hex").strpath,
+        }).encode(),
+        b"not json",
+        json.dumps({
+            "input": tmpdir.join("missing.yay").strpath,
+            "output": tmpdir.join("missing.hex").strpath,
+        }).encode(),
+        json.dumps({
+            "input": tmpdir.join("main.yay").strpath,
+            "output": tmpdir.join("..", "main.hex").strpath,
+        }).encode(),
+    ))
+
+    assert valid["ok"]
+    assert tmpdir.join("main.hex").exists()
+    assert not invalid["ok"]
+    assert not missing["ok"]
+    assert "FileNotFoundError" in missing["error"]
+    assert not outside["ok"]
+    assert "is not inside" in outside["error"]
+    assert not tmpdir.join("..", "main.hex").exists()
+
+
+def test_token_is_required_if_set(loop, project):
+    tmpdir, _ = project
+    build_server = BuildServer(tmpdir.strpath, token="secret")
+    request = {
+        "input": tmpdir.join("main.yay").strpath,
+        "output": tmpdir.join("main.bin").strpath,
+        "format": "binary",
+    }
+    try:
+        for token, ok in [(None, False), ("wrong", False), ("secret", True)]:
+            line = json.dumps(dict(request, token=token)).encode()
+            response = loop.run_until_complete(build_server.respond(line))
+            assert response["ok"] == ok
+    finally:
+        build_server.close()
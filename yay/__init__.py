@@ -1,18 +1,52 @@
 import sys
 
-import yay_ast as ast
-
-from yay.program import Program, sub, macro, block_macro, Mod
-from yay.helpers import (
-    InvalidRegisterError, InvalidConfigError, WrongSignatureException
-)
 from yay.importer import YayFinder
 
 
+__version__ = "0.1.0"
+
 __all__ = [
     "Program", "sub", "macro", "block_macro", "Mod", "InvalidRegisterError",
     "InvalidConfigError", "WrongSignatureException",
 ]
 
+# Attributes that are only imported on first access, so that e. g.
+# `yay --help` does not import `yay_ast`, PyYAML or the CPU models.
+_LAZY_ATTRIBUTES = {
+    "ast": ("yay_ast", None),
+    "Program": ("yay.program", "Program"),
+    "sub": ("yay.program", "sub"),
+    "macro": ("yay.program", "macro"),
+    "block_macro": ("yay.program", "block_macro"),
+    "Mod": ("yay.program", "Mod"),
+    "InvalidRegisterError": ("yay.helpers", "InvalidRegisterError"),
+    "InvalidConfigError": ("yay.helpers", "InvalidConfigError"),
+    "WrongSignatureException": ("yay.helpers", "WrongSignatureException"),
+}
+
+
+def _import_lazy_attribute(name):
+    from importlib import import_module
+
+    module_name, attribute = _LAZY_ATTRIBUTES[name]
+    value = import_module(module_name)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _LAZY_ATTRIBUTES:
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+        return _import_lazy_attribute(name)
+else:
+    # Module `__getattr__` (PEP 562) is not available, import eagerly.
+    for _name in _LAZY_ATTRIBUTES:
+        _import_lazy_attribute(_name)
+
 
-sys.meta_path.insert(0, YayFinder())
+# Use `finder.set_scope` to limit which modules are searched as `.yay` files.
+finder = YayFinder()
+sys.meta_path.insert(0, finder)
@@ -1,23 +1,187 @@
 import argparse
 import sys
+import traceback
+from pathlib import Path
 
+from yay import profiling
 from yay.importer import import_yay_file
 
 
+OUTPUT_SUFFIXES = {
+    "ihex": ".hex",
+    "binary": ".bin",
+    "object": ".o",
+}
+
+
 def _get_main_class(namespace, class_name):
     return getattr(namespace, class_name)
 
 
+def assemble(yay_file, main_class):
+    main_class = _get_main_class(import_yay_file(yay_file), main_class)
+    return main_class()
+
+
+def write_output(program, outfile, args):
+    if args.format == "object":
+        with open(outfile, "wb") as output_file:
+            program.to_object().dump(output_file)
+        return
+
+    if args.format == "ihex":
+        with open(outfile, "wb") as output_file:
+            program.write_ihex(
+                output_file,
+                record_length=args.record_length,
+                extended_linear_address=args.extended_linear_address,
+            )
+        return
+
+    output = getattr(program, f"to_{args.format}")()
+    # TODO: Is always encoding `str`s (currently only returned by
+    # `to_ihex`) always right?
+    if isinstance(output, str):
+        output = output.encode()
+    with open(outfile, "wb") as output_file:
+        output_file.write(output)
+
+
+def _assemble_job(job):
+    """Assemble one file of a batch and return the error message, if any,
+    and its `Profile` if `--profile` was given.
+
+    Runs in worker processes, which keep the CPU models and imported
+    libraries between jobs.
+    """
+    yay_file, outfile, args = job
+    profile = profiling.Profile() if args.profile else None
+    error = None
+    with profiling.profiled(profile):
+        try:
+            program = assemble(yay_file, args.main_class)
+            Path(outfile).parent.mkdir(parents=True, exist_ok=True)
+            write_output(program, outfile, args)
+        except Exception:
+            error = traceback.format_exc(limit=-1).rstrip()
+    return error, profile
+
+
+def read_manifest(manifest):
+    """Read `input output` pairs, one per line. Relative paths are relative
+    to the manifest’s directory.
+    """
+    directory = Path(manifest).parent
+    jobs = []
+    with open(manifest) as manifest_file:
+        for line_number, line in enumerate(manifest_file, start=1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                yay_file, outfile = line.split()
+            except ValueError:
+                raise ValueError(
+                    f"{manifest}:{line_number}: expected `input output`, "
+                    f"got {line!r}"
+                ) from None
+            jobs.append((str(directory / yay_file), str(directory / outfile)))
+    return jobs
+
+
+def batch_jobs(parser, args):
+    jobs = []
+    if args.manifest is not None:
+        try:
+            jobs.extend(read_manifest(args.manifest))
+        except (OSError, ValueError) as err:
+            parser.error(str(err))
+    if args.yay_files:
+        if args.outdir is None:
+            parser.error("`--outdir` is required to assemble multiple files")
+        suffix = OUTPUT_SUFFIXES.get(args.format, f".{args.format}")
+        for yay_file in args.yay_files:
+            outfile = Path(args.outdir, Path(yay_file).stem).with_suffix(suffix)
+            jobs.append((yay_file, str(outfile)))
+
+    outfiles = [outfile for _, outfile in jobs]
+    if len(set(outfiles)) != len(outfiles):
+        parser.error("multiple inputs are written to the same output file")
+    return jobs
+
+
+def run_batch(jobs, args, profile=None):
+    """Assemble all `jobs`, reporting errors per file in the order of `jobs`.
+
+    The profiles of all jobs are merged into `profile`. Return the number of
+    failed jobs.
+    """
+    jobs = [(yay_file, outfile, args) for yay_file, outfile in jobs]
+
+    if args.jobs > 1:
+        # Imported here, `multiprocessing` takes a noticeable part of the
+        # startup time.
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(args.jobs) as executor:
+            results = list(executor.map(_assemble_job, jobs))
+    else:
+        results = list(map(_assemble_job, jobs))
+
+    failed = 0
+    for (yay_file, _, _), (error, job_profile) in zip(jobs, results):
+        if error is not None:
+            failed += 1
+            print(f"{yay_file}: {error}", file=sys.stderr)
+        if profile is not None and job_profile is not None:
+            profile.merge(job_profile)
+    return failed
+
+
+def print_profile(profile, profile_format):
+    if profile_format == "json":
+        print(profile.to_json(), file=sys.stderr)
+    else:
+        print(profile.format(), file=sys.stderr)
+
+
+def assemble_one(args):
+    program = assemble(args.yay_files[0], args.main_class)
+
+    if args.outfile:
+        write_output(program, args.outfile, args)
+        return
+
+    output = getattr(program, f"to_{args.format}")()
+
+    if args.print_raw:
+        sys.stdout.buffer.write(output)
+    else:
+        print(output)
+
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv[1:]
 
+    if argv[:1] == ["serve"]:
+        from yay.server import main as serve
+        return serve(argv[1:])
+    if argv[:1] == ["link"]:
+        from yay.objects import main as link
+        return link(argv[1:])
+
     parser = argparse.ArgumentParser(
         prog="yay",
-        description="Yay assembler.",
+        description="Yay assembler. Run `yay serve --help` for the build"
+            " server and `yay link --help` to link object files.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
-    parser.add_argument("yay_file", help="the file that will be assembled")
+    parser.add_argument(
+        "yay_files",
+        nargs="*",
+        metavar="yay_file",
+        help="the files that will be assembled",
+    )
     parser.add_argument(
         "--main_class",
         help="the class that contains the main program",
@@ -38,24 +202,72 @@ def main(argv=None):
 
     parser.add_argument(
         "-f", "--format",
-        help="output format of the assembled program",
+        help="output format of the assembled program (e. g. `ihex`,"
+            " `binary` or `object`)",
         default="ihex"
     )
+    parser.add_argument(
+        "--record-length",
+        help="number of data bytes per Intel HEX record",
+        type=int,
+        default=16,
+    )
+    parser.add_argument(
+        "--extended-linear-address",
+        help="allow Intel HEX output above 64 KiB by emitting extended"
+            " linear address records",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--profile",
+        help="print the time spent in each phase and counters to stderr",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile-format",
+        help="format of the `--profile` report",
+        choices=["text", "json"],
+        default="text",
+    )
+
+    batch = parser.add_argument_group(
+        "batch mode",
+        "assemble many files, each into its own output file",
+    )
+    batch.add_argument(
+        "--manifest",
+        help="file with one `input output` pair per line",
+    )
+    batch.add_argument(
+        "--outdir",
+        help="write the assembled programs of all `yay_file`s to this"
+            " directory",
+    )
+    batch.add_argument(
+        "-j", "--jobs",
+        help="number of worker processes",
+        type=int,
+        default=1,
+    )
 
     args = parser.parse_args(argv)
 
-    main_class = _get_main_class(import_yay_file(args.yay_file), args.main_class)
-    program = main_class()
-    output = getattr(program, f"to_{args.format}")()
+    if args.manifest is not None or args.outdir is not None or len(args.yay_files) > 1:
+        if args.outfile or args.print_raw:
+            parser.error("`-o` and `-r` cannot be used in batch mode")
+        profile = profiling.Profile() if args.profile else None
+        failed = run_batch(batch_jobs(parser, args), args, profile)
+        if profile is not None:
+            print_profile(profile, args.profile_format)
+        return 1 if failed else 0
 
-    if args.outfile:
-        # TODO: Is always encoding `str`s (currently only returned by
-        # `to_ihex`) always right?
-        if isinstance(output, str):
-            output = output.encode()
-        with open(args.outfile, "wb") as outfile:
-            outfile.write(output)
-    elif args.print_raw:
-        sys.stdout.buffer.write(output)
-    else:
-        print(output)
+    if len(args.yay_files) != 1:
+        parser.error("expected one `yay_file`")
+
+    if not args.profile:
+        return assemble_one(args)
+    with profiling.profiled() as profile:
+        result = assemble_one(args)
+    print_profile(profile, args.profile_format)
+    return result
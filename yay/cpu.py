@@ -1,11 +1,17 @@
+import hashlib
 import os.path
+import sys
+from contextlib import suppress
+from functools import lru_cache
 from importlib import import_module
 from pathlib import Path
 
+import yay
 from yay.helpers import (
-    config_filename, read_config, recursive_merge, reverse_dict
+    config_filename, freeze, read_config, recursive_merge, reverse_dict
 )
-from yay.mnemonic import Lit, make_mnemonics
+from yay.importer import read_cached_code, write_cached_code
+from yay.mnemonic import Lit, make_mnemonics, make_relaxed_mnemonics
 
 
 def _import_object(from_, name):
@@ -75,14 +81,85 @@ def short_to_argname(signature_contents):
     })
 
 
-def read_cpu_config(config_name):
-    config = read_config(config_name)
+CACHE_FORMAT = 1
+_CACHE_MAGIC = f"yay-cpu\0{CACHE_FORMAT}\0{yay.__version__}\0".encode()
 
-    if "inherit_from" in config:
-        config = recursive_merge(
-            read_cpu_config(get_cpu_definition(config["inherit_from"])),
-            config
+
+def _config_layers(config_name):
+    """Return the configurations in the inheritance chain of `config_name`,
+    starting with `config_name` itself, as read from YAML.
+    """
+    layers = [read_config(config_name)]
+    while "inherit_from" in layers[-1]:
+        layers.append(
+            read_config(get_cpu_definition(layers[-1]["inherit_from"]))
         )
+    return layers
+
+
+def _layers_digest(config_name, layers):
+    """Hash the files of the inheritance chain of `config_name`.
+
+    Returns `None` if one of them cannot be read.
+    """
+    digest = hashlib.sha256()
+    filename = config_name
+    for layer in layers:
+        try:
+            with open(filename, "rb") as config_file:
+                digest.update(config_file.read())
+        except OSError:
+            return None
+        digest.update(b"\0")
+        if "inherit_from" in layer:
+            filename = get_cpu_definition(layer["inherit_from"])
+    return digest.digest()
+
+
+def config_cache_path(config_name):
+    """Return the path of the precompiled configuration of `config_name`."""
+    directory, filename = os.path.split(config_name)
+    return os.path.join(directory, "__pycache__", f"{filename}.cpu")
+
+
+def read_config_layers(config_name):
+    """Return the layers of `config_name` like `_config_layers`, reading
+    them from the precompiled configuration if it is up to date.
+
+    The cache is invalidated when any file in the inheritance chain changes.
+    """
+    cache_path = config_cache_path(config_name)
+    cached = read_cached_code(cache_path, _CACHE_MAGIC)
+    with suppress(TypeError, ValueError):
+        digest, layers = cached
+        if digest == _layers_digest(config_name, layers):
+            return layers
+
+    layers = _config_layers(config_name)
+    if not sys.dont_write_bytecode:
+        digest = _layers_digest(config_name, layers)
+        # Configurations containing values `marshal` does not support are
+        # not cached.
+        with suppress(OSError, ValueError):
+            write_cached_code(cache_path, _CACHE_MAGIC, (digest, layers))
+    return layers
+
+
+def compile_cpu_config(config_name):
+    """Precompile `config_name` and write its cache."""
+    layers = _config_layers(config_name)
+    write_cached_code(
+        config_cache_path(config_name),
+        _CACHE_MAGIC,
+        (_layers_digest(config_name, layers), layers),
+    )
+
+
+def _resolve_layers(layers):
+    config = layers[0]
+
+    if "inherit_from" in config:
+        config = recursive_merge(_resolve_layers(layers[1:]), config)
 
     for name, default in config.pop("importing", {}).items():
         _replace_imports(config[name], default)
@@ -93,6 +170,11 @@ def read_cpu_config(config_name):
     return config
 
 
+def read_cpu_config(config_name):
+    return _resolve_layers(read_config_layers(config_name))
+
+
+@lru_cache(maxsize=None)
 def get_cpu_definition(cpu_name):
     if isinstance(cpu_name, Path) or os.path.isabs(cpu_name):
         return str(cpu_name)
@@ -100,8 +182,68 @@ def get_cpu_definition(cpu_name):
         return config_filename(f"cpu_configurations/{cpu_name}.yml")
 
 
+def type_matchers(config):
+    """Map each type name to its matchers, including alternatives."""
+    matchers = config["parse_helpers"]["matchers"]
+    return {
+        typename: [
+            (matcher_type, getattr(matchers, f"is_{matcher_type}"))
+            for matcher_type in [typename, *contents.get("alternatives", [])]
+        ]
+        for typename, contents in config["signature_contents"].items()
+    }
+
+
+def split_namespace(model):
+    """Return the names of all sections in `model["all"]` that have to be
+    bound to each program (those with a `bind_program` method) and all
+    other names.
+    """
+    namespace = {}
+    for section_name in model["all"]:
+        namespace.update(model[section_name])
+    to_bind = {}
+    unbound = {}
+    for name, item in namespace.items():
+        if hasattr(item, "bind_program"):
+            to_bind[name] = item
+        else:
+            unbound[name] = item
+    return to_bind, unbound
+
+
+def _config_digest(config_name, layers):
+    digest = _layers_digest(config_name, layers)
+    if digest is None:
+        digest = hashlib.sha256(repr(layers).encode()).digest()
+    return digest.hex()
+
+
+@lru_cache(maxsize=None)
+def _make_cpu_model(cpu_definition):
+    layers = read_config_layers(cpu_definition)
+    # Identifies the configuration, e. g. in object files, which refer to
+    # signatures by their index.
+    digest = _config_digest(cpu_definition, layers)
+    config = freeze(_resolve_layers(layers))
+    mnemonics = make_mnemonics(config)
+    mnemonics.update(make_relaxed_mnemonics(config))
+    mnemonics["Lit"] = Lit
+    model = dict(
+        config,
+        mnemonics=mnemonics,
+        type_matchers=type_matchers(config),
+        digest=digest,
+    )
+    model["names_to_bind"], model["unbound_names"] = split_namespace(model)
+    return freeze(model)
+
+
 def make_cpu(cpu_name):
-    config = read_cpu_config(get_cpu_definition(cpu_name))
-    config["mnemonics"] = make_mnemonics(config)
-    config["mnemonics"]["Lit"] = Lit
-    return config
+    """Return the CPU model for `cpu_name`.
+
+    The model is built once per process and shared between all callers, so
+    it is read-only. Objects that need per-program state (e. g. `Register`)
+    are copied by their `bind_program` method.
+    """
+    return _make_cpu_model(get_cpu_definition(cpu_name))
@@ -42,8 +42,53 @@ class Carry:
     pass
 
 
-class Register:
-    def __init__(self, number, can_indirect=False):
+class _Operand:
+    """Base of the operand classes that are interned per address.
+
+    Instances are immutable flyweights: constructing an operand with the same
+    arguments again returns the same object. `kind` tells the matchers which
+    kind of operand an object is.
+    """
+    __slots__ = ()
+
+    kind = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._instances = {}
+
+    def __new__(cls, *args):
+        try:
+            return cls._instances[args]
+        except KeyError:
+            pass
+        operand = super().__new__(cls)
+        operand._initialize(*args)
+        cls._instances[args] = operand
+        return operand
+
+    # Operands are immutable, so copies are the operand itself.
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return type(self), self._arguments()
+
+
+class Register(_Operand):
+    # Bound registers belong to one program. State of the program (e. g. the
+    # selected register bank) is stored on the program, not on them.
+    __slots__ = ("program", "number", "can_indirect", "as_indirect")
+
+    kind = "register"
+
+    def __new__(cls, number, can_indirect=False):
+        return super().__new__(cls, number, can_indirect)
+
+    def _initialize(self, number, can_indirect):
         self.program = None
         self.number = number
         self.can_indirect = can_indirect
@@ -52,6 +97,9 @@ class Register:
         else:
             self.as_indirect = None
 
+    def _arguments(self):
+        return self.number, self.can_indirect
+
     def __int__(self):
         return self.number
 
@@ -70,15 +118,30 @@ class Register:
     def bind_program(self, program):
         if self.program is not None:
             raise RuntimeError("`Register.bind_program` called multiply")
-        self.program = program
-        return self
+        # The CPU model is shared between programs, so each program gets its
+        # own (not interned) copy.
+        bound = object.__new__(type(self))
+        bound._initialize(self.number, self.can_indirect)
+        bound.program = program
+        return bound
+
+
+class IndirectRegister(_Operand):
+    __slots__ = ("indirect_number", )
 
+    kind = "indirect"
 
-class IndirectRegister:
-    def __init__(self, number):
+    can_indirect = True
+
+    def _initialize(self, number):
         self.indirect_number = number
-        self.can_indirect = True
-        self.as_indirect = self
+
+    def _arguments(self):
+        return self.indirect_number,
+
+    @property
+    def as_indirect(self):
+        return self
 
     def __int__(self):
         return self.indirect_number
@@ -90,10 +153,17 @@ class IndirectRegister:
         return f"IR{self.indirect_number}()"
 
 
-class Byte:
-    def __init__(self, byte_addr):
+class Byte(_Operand):
+    __slots__ = ("byte_addr", )
+
+    kind = "direct"
+
+    def _initialize(self, byte_addr):
         self.byte_addr = byte_addr
 
+    def _arguments(self):
+        return self.byte_addr,
+
     def __int__(self):
         return self.byte_addr
 
@@ -102,17 +172,22 @@ class Byte:
 
 
 class SFR(Byte):
-    def __init__(self, name, byte_addr):
+    __slots__ = ("name", "bit_addressable")
+
+    def _initialize(self, name, byte_addr):
         if byte_addr not in range(128, 256):
             raise ValueError(
                 f"`byte_addr` must be in range(128, 256), not {byte_addr}"
             )
-        super().__init__(byte_addr)
+        super()._initialize(byte_addr)
         self.name = name
         self.bit_addressable = (
             self.byte_addr >= 0x80 and not self.byte_addr % 8
         )
 
+    def _arguments(self):
+        return self.name, self.byte_addr
+
     def __getitem__(self, bit):
         if not self.bit_addressable:
             raise TypeError(f"{self} is not bit addressable")
@@ -125,10 +200,17 @@ class SFR(Byte):
         return f"SFR(name={self.name!r}, byte_addr={self.byte_addr})"
 
 
-class Bit:
-    def __init__(self, bit_addr):
+class Bit(_Operand):
+    __slots__ = ("bit_addr", )
+
+    kind = "bit"
+
+    def _initialize(self, bit_addr):
         self.bit_addr = bit_addr
 
+    def _arguments(self):
+        return self.bit_addr,
+
     def __invert__(self):
         return NotBit(self.bit_addr)
 
@@ -139,10 +221,17 @@ class Bit:
         return f"Bit({self.bit_addr})"
 
 
-class NotBit:
-    def __init__(self, not_bit_addr):
+class NotBit(_Operand):
+    __slots__ = ("not_bit_addr", )
+
+    kind = "not_bit"
+
+    def _initialize(self, not_bit_addr):
         self.not_bit_addr = not_bit_addr
 
+    def _arguments(self):
+        return self.not_bit_addr,
+
     def __int__(self):
         return self.not_bit_addr
 
@@ -151,10 +240,15 @@ class NotBit:
 
 
 class NamedBit(Bit):
-    def __init__(self, name, bit_addr):
-        super().__init__(bit_addr)
+    __slots__ = ("name", )
+
+    def _initialize(self, name, bit_addr):
+        super()._initialize(bit_addr)
         self.name = name
 
+    def _arguments(self):
+        return self.name, self.bit_addr
+
     def __repr__(self):
         return f"Bit(name={self.name!r}, bit_addr={self.bit_addr})"
 
@@ -193,7 +287,7 @@ class LookupTableDptr(Mod):
             length = len(value)
             if length < itemlength:
                 value += b"\0" * (itemlength - length)
-            table[key * itemlength:key * (itemlength + 1)] = value
+            table[key * itemlength:(key + 1) * itemlength] = value
 
         self.position = self.program.add_binary_data(table)
 
@@ -205,7 +299,7 @@ class LookupTableDptr(Mod):
         Iff `self` does not contain `A`, `C` is set and the contents of `A`
         are not changed.
         """
-        not_in_range = self.new_label_name("not_in_range")
+        not_in_range = self.program.new_label_name("not_in_range")
 
         self.in_range.direct()
         jnc(not_in_range)
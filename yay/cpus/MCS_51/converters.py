@@ -1,5 +1,5 @@
 def addr16_from_label(mnemonic, label):
-    return mnemonic.program.labels[label]
+    return mnemonic.program.label_address(label, mnemonic.label_scope)
 
 
 def relative_from_addr16(mnemonic, addr16):
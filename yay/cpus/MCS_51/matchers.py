@@ -1,21 +1,59 @@
+from bisect import bisect
+
 from yay.cpus.MCS_51 import (
-    Accumulator, Carry, DPTR, DptrOffset, IndirectDptr, Label, PcOffset
+    Accumulator, Bit, Byte, Carry, DPTR, DptrOffset, IndirectDptr,
+    IndirectRegister, Label, NotBit, PC, PcOffset, Register
 )
 
 
+_INT_BOUNDARIES = (-2 ** 7, 0, 2 ** 8, 2 ** 11, 2 ** 16)
+_OPERAND_TYPES = (
+    Accumulator, Bit, Byte, Carry, DPTR, DptrOffset, IndirectDptr,
+    IndirectRegister, Label, NotBit, PC, PcOffset, Register,
+)
+
+
+def operand_key(candidate):
+    """Classify `candidate` for the signature dispatch of mnemonics.
+
+    All candidates with the same key are matched by the same matchers below.
+    Returns `None` for candidates that cannot be classified this way.
+    """
+    candidate_type = type(candidate)
+    if candidate_type is int:
+        return int, bisect(_INT_BOUNDARIES, candidate)
+    elif issubclass(candidate_type, str):
+        return candidate_type
+    elif getattr(candidate_type, "kind", None) is not None:
+        return (
+            candidate_type,
+            is_direct(candidate),
+            is_bit(candidate),
+            is_not_bit(candidate),
+        )
+    elif issubclass(candidate_type, _OPERAND_TYPES):
+        return candidate_type,
+    else:
+        return None
+
+
+def _kind(candidate):
+    return getattr(type(candidate), "kind", None)
+
+
 def is_direct(candidate):
-    return hasattr(candidate, "byte_addr") and candidate.byte_addr in range(256)
+    return _kind(candidate) == "direct" and 0 <= candidate.byte_addr < 256
 
 
 is_direct_dest = is_direct
 
 
 def is_register(candidate):
-    return hasattr(candidate, "number")
+    return _kind(candidate) == "register"
 
 
 def is_indirect(candidate):
-    return hasattr(candidate, "indirect_number")
+    return _kind(candidate) == "indirect"
 
 
 def is_immediate(candidate):
@@ -31,7 +69,7 @@ def is_label(candidate):
 
 
 def is_relative(candidate, from_alternative=False):
-    return from_alternative and candidate in range(-2 ** 7, 2 ** 7 - 1)
+    return from_alternative and candidate in range(-2 ** 7, 2 ** 7)
 
 
 def is_addr11(candidate, from_alternative=False):
@@ -67,11 +105,11 @@ def is_carry(candidate):
 
 
 def is_bit(candidate):
-    return hasattr(candidate, "bit_addr") and candidate.bit_addr in range(256)
+    return _kind(candidate) == "bit" and 0 <= candidate.bit_addr < 256
 
 
 def is_not_bit(candidate):
-    return hasattr(candidate, "not_bit_addr") and candidate.not_bit_addr in range(256)
+    return _kind(candidate) == "not_bit" and 0 <= candidate.not_bit_addr < 256
 
 
 def is_pushpop_register(candidate, from_alternative=False):
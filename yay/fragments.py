@@ -0,0 +1,469 @@
+"""Cache of the mnemonics emitted by the bodies of subs.
+
+Executing the body of a `sub` runs arbitrary Python code and matches and
+encodes every mnemonic it appends. When the same body is emitted again with
+the same inputs (e. g. when a program is reassembled after another sub was
+edited), the recorded fragment is replayed instead.
+
+A fragment is keyed by the CPU and a fingerprint of everything the body can
+see by name: its code, defaults and closure, the globals it references and
+the attributes of `self` (and of `self.program` for subs of a `Mod`) that it
+references. The opcodes of mnemonics whose encoding does not depend on their
+position are stored as raw bytes; all others (jumps and calls to labels,
+relaxed jumps) are fixups that are encoded again after the program is laid
+out.
+
+Bodies that depend on state that cannot be fingerprinted, that read the
+current position or that reference labels from outside the body (e. g. by
+calling another sub) are not cached.
+
+Replaying a fragment does not run the body, so only the mnemonics and labels
+it emitted are reproduced. Its other side effects (e. g. setting attributes
+of `self` that later code reads) are not. The cache is therefore disabled by
+default and must only be enabled (with `Program.fragment_cache`) for
+programs whose sub bodies have no side effects besides emitting code.
+"""
+import sys
+from collections import OrderedDict, namedtuple
+from contextlib import suppress
+from weakref import WeakKeyDictionary
+from types import (
+    BuiltinFunctionType, CodeType, FunctionType, MethodType, ModuleType,
+)
+
+from yay.labels import LocalLabel
+from yay.mnemonic import RawData
+
+
+class Uncacheable(Exception):
+    pass
+
+
+_SCALARS = (type(None), bool, int, float, complex, str, bytes)
+
+# Code objects are only kept alive by the functions that use them, so these
+# do not grow in long running processes that import changed files again.
+_code_keys = WeakKeyDictionary()
+_code_names = WeakKeyDictionary()
+
+
+def code_key(code):
+    """Return a hashable key for `code` that ignores its location."""
+    try:
+        return _code_keys[code]
+    except KeyError:
+        pass
+    key = _code_keys[code] = (
+        code.co_code,
+        code.co_names,
+        code.co_varnames,
+        code.co_freevars,
+        code.co_cellvars,
+        code.co_argcount,
+        code.co_kwonlyargcount,
+        code.co_flags,
+        tuple(
+            code_key(const) if isinstance(const, CodeType)
+            else (type(const), const)
+            for const in code.co_consts
+        ),
+    )
+    return key
+
+
+def code_names(code):
+    """Return all names that `code` and its nested code objects reference."""
+    try:
+        return _code_names[code]
+    except KeyError:
+        pass
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names.update(code_names(const))
+    names = _code_names[code] = tuple(sorted(names))
+    return names
+
+
+def _module_filename(cls):
+    module = sys.modules.get(cls.__module__)
+    return getattr(module, "__file__", None) or ""
+
+
+def _slot_values(obj):
+    """The values of the `__slots__` of `obj` (e. g. interned operands)."""
+    values = []
+    for cls in type(obj).__mro__:
+        slots = vars(cls).get("__slots__", ())
+        if isinstance(slots, str):
+            slots = slots,
+        for slot in slots:
+            if slot not in ("__dict__", "__weakref__"):
+                values.append((slot, getattr(obj, slot, None)))
+    return tuple(values)
+
+
+class Fingerprinter:
+    """Compute hashable fingerprints of values as seen from `program`.
+
+    Objects of the CPU namespace of `program` are fingerprinted by their
+    name, so fingerprints are equal for different programs. Functions,
+    methods and classes are only fingerprinted once per `Fingerprinter`,
+    which is used for one assembly.
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self._in_progress = set()
+        # Maps `id`s to the fingerprinted object (to keep the `id` valid) and
+        # its fingerprint.
+        self._memo = {}
+        # Maps classes to the attributes of them and their bases.
+        self._namespaces = {}
+        self._cpu_macros = {}
+
+    def body(self, f, receiver):
+        names = code_names(f.__code__)
+        fingerprint = [self(f), self.attributes(receiver, names)]
+        if receiver is not self.program:
+            fingerprint.append(self.attributes(self.program, names))
+        return tuple(fingerprint)
+
+    def attributes(self, obj, names):
+        attributes = []
+        for name in names:
+            try:
+                value = self._lookup(obj, name)
+            except AttributeError:
+                continue
+            attributes.append((name, self.named(value, names)))
+        return tuple(attributes)
+
+    def _class_namespace(self, cls):
+        """The attributes of `cls` and its bases, as `getattr` finds them."""
+        try:
+            return self._namespaces[cls]
+        except KeyError:
+            namespace = self._namespaces[cls] = {}
+            for base in reversed(cls.__mro__):
+                namespace.update(vars(base))
+            return namespace
+
+    def _cpu_macro(self, obj, name):
+        """Return the macro `name` of the CPU of `obj` or `None`, see
+        `Program.__getattr__`.
+        """
+        if obj is not self.program:
+            cpu_macro = getattr(type(obj), "_cpu_macro", None)
+            return None if cpu_macro is None else cpu_macro(obj, name)
+        try:
+            return self._cpu_macros[name]
+        except KeyError:
+            value = self._cpu_macros[name] = obj._cpu_macro(name)
+            return value
+
+    def _lookup(self, obj, name):
+        """Look up the attribute `name` of `obj` without running code (e. g.
+        properties).
+        """
+        if isinstance(obj, type):
+            try:
+                return self._class_namespace(obj)[name]
+            except KeyError:
+                raise AttributeError(name) from None
+        instance_dict = getattr(obj, "__dict__", {})
+        if name in instance_dict:
+            return instance_dict[name]
+        namespace = self._class_namespace(type(obj))
+        if name in namespace:
+            value = namespace[name]
+        else:
+            value = self._cpu_macro(obj, name)
+            if value is None:
+                raise AttributeError(name)
+        if getattr(value, "is_macro", False) and not getattr(
+                value, "is_sub", False):
+            # Macros are bound to the program when they are first looked up,
+            # so look them up like the body would to fingerprint the same
+            # object whether or not they were used before.
+            return getattr(obj, name)
+        return value
+
+    def named(self, value, names):
+        """Fingerprint `value` referenced by code that uses `names`.
+
+        Modules and the classes of `.py` files (which `_class` only
+        fingerprints by name) are fingerprinted by those of their attributes
+        that are referenced by `names`.
+        """
+        if isinstance(value, ModuleType):
+            kind, name = "module", value.__name__
+        elif (
+            isinstance(value, type)
+            and _module_filename(value).endswith(".py")
+        ):
+            kind, name = "class", (value.__module__, value.__qualname__)
+        else:
+            return self(value)
+        if id(value) in self._in_progress:
+            return "recursive",
+        self._in_progress.add(id(value))
+        try:
+            return kind, name, self.attributes(value, names)
+        finally:
+            self._in_progress.discard(id(value))
+
+    def __call__(self, value):
+        value_type = type(value)
+        if value_type in _SCALARS:
+            return value_type, value
+        elif isinstance(value, _SCALARS):
+            # Subclasses of builtins (e. g. `LocalLabel`) can be
+            # distinguished by identity.
+            raise Uncacheable(value)
+
+        if value is self.program:
+            return "program",
+        name = self.program._cpu_object_name(value)
+        if name is not None:
+            return "cpu", name
+
+        with suppress(KeyError):
+            return self._memo[id(value)][1]
+        if id(value) in self._in_progress:
+            return "recursive",
+        self._in_progress.add(id(value))
+        try:
+            fingerprint = self._fingerprint(value)
+        finally:
+            self._in_progress.discard(id(value))
+        if isinstance(value, (FunctionType, MethodType, type)):
+            self._memo[id(value)] = value, fingerprint
+        return fingerprint
+
+    def _fingerprint(self, value):
+        if isinstance(value, (tuple, list)):
+            return type(value), tuple(map(self, value))
+        elif isinstance(value, (set, frozenset)):
+            return type(value), frozenset(map(self, value))
+        elif isinstance(value, dict):
+            return type(value), tuple(
+                (self(key), self(item)) for key, item in value.items()
+            )
+        elif isinstance(value, FunctionType):
+            return self._function(value)
+        elif isinstance(value, MethodType):
+            return "method", self(value.__func__), self(value.__self__)
+        elif isinstance(value, (staticmethod, classmethod)):
+            return type(value), self(value.__func__)
+        elif isinstance(value, property):
+            return "property", self(value.fget)
+        elif isinstance(value, BuiltinFunctionType):
+            return "builtin", value.__module__, value.__qualname__
+        elif isinstance(value, ModuleType):
+            # Only modules referenced by name can be fingerprinted, see
+            # `named`.
+            raise Uncacheable(value)
+        elif isinstance(value, type):
+            return self._class(value)
+        elif getattr(value, "is_sub", False):
+            return "sub", self(value.f)
+        elif hasattr(value, "__dict__"):
+            return (
+                "object",
+                self(type(value)),
+                self(vars(value)),
+                self(_slot_values(value)),
+            )
+        elif _slot_values(value):
+            return "object", self(type(value)), self(_slot_values(value))
+        raise Uncacheable(value)
+
+    def _function(self, function):
+        closure = []
+        for cell in function.__closure__ or ():
+            try:
+                closure.append(self(cell.cell_contents))
+            except ValueError:
+                closure.append("empty")
+        names = code_names(function.__code__)
+        return (
+            "function",
+            code_key(function.__code__),
+            self(function.__defaults__),
+            self(function.__kwdefaults__),
+            tuple(closure),
+            tuple(
+                (name, self.named(function.__globals__[name], names))
+                for name in names
+                if name in function.__globals__
+            ),
+        )
+
+    def _class(self, cls):
+        # Only classes that can change while the process runs (those of
+        # `.yay` files and those created at runtime) are compared by content.
+        # The attributes of other classes that a body references are
+        # fingerprinted by `named`.
+        is_local = "<locals>" in cls.__qualname__
+        if not _module_filename(cls).endswith(".yay") and not is_local:
+            return "class", cls.__module__, cls.__qualname__
+        return (
+            "class",
+            cls.__module__,
+            cls.__qualname__,
+            tuple(map(self, cls.__bases__)),
+            tuple(
+                (name, self(value))
+                for name, value in vars(cls).items()
+                if not name.startswith("__") and name != "_abc_impl"
+            ),
+        )
+
+
+class _Local(namedtuple("_Local", "index")):
+    """Placeholder for a local label created inside a fragment."""
+
+
+class _CpuObject(namedtuple("_CpuObject", "name")):
+    """Placeholder for an object of the program’s CPU namespace."""
+
+
+class _AddLabel(namedtuple("_AddLabel", "label")):
+    pass
+
+
+class Recording:
+    """Collects what the body of a sub does to a program while it runs."""
+
+    def __init__(self):
+        self.events = []
+        self.local_labels = {}
+        self.is_relocatable = True
+
+    def add_label(self, label):
+        self.events.append(_AddLabel(label))
+
+    def new_label(self, label):
+        self.local_labels[id(label)] = len(self.local_labels), label
+
+    def to_fragment(self, program):
+        """Return the recorded fragment or `None` if it cannot be replayed.
+
+        The opcodes of consecutive mnemonics that do not depend on their
+        position are joined into one `bytes` object.
+        """
+        if not self.is_relocatable:
+            return None
+        events = []
+        encoded = bytearray()
+        try:
+            for event in self.events:
+                if isinstance(event, RawData):
+                    encoded += event.data
+                    continue
+                if not isinstance(event, _AddLabel) and event.is_fixed:
+                    encoded += event.find_opcode()
+                    continue
+                if encoded:
+                    events.append(bytes(encoded))
+                    encoded.clear()
+                events.append(self._portable_event(program, event))
+        except Uncacheable:
+            return None
+        if encoded:
+            events.append(bytes(encoded))
+        return Fragment(
+            [label for _, label in self.local_labels.values()],
+            events,
+        )
+
+    def _portable_event(self, program, event):
+        if isinstance(event, _AddLabel):
+            return _AddLabel(self._portable(program, event.label))
+
+        if not program._is_cpu_mnemonic(event):
+            raise Uncacheable(event)
+        name = type(event).__name__
+        args = tuple(self._portable(program, arg) for arg in event._args)
+        return name, event.signature, args
+
+    def _portable(self, program, value):
+        if type(value) is LocalLabel:
+            try:
+                return _Local(self.local_labels[id(value)][0])
+            except KeyError:
+                raise Uncacheable(value) from None
+        name = program._cpu_object_name(value)
+        if name is not None:
+            return _CpuObject(name)
+        if getattr(value, "program", None) is not None:
+            raise Uncacheable(value)
+        return value
+
+
+class Fragment:
+    __slots__ = ("local_labels", "events")
+
+    def __init__(self, local_labels, events):
+        self.local_labels = tuple(str(label) for label in local_labels)
+        self.events = tuple(events)
+
+    def replay(self, program):
+        labels = [LocalLabel(name) for name in self.local_labels]
+        namespace = program._cpu_namespace
+
+        def resolve(value):
+            value_type = type(value)
+            if value_type is _Local:
+                return labels[value.index]
+            elif value_type is _CpuObject:
+                return namespace[value.name]
+            return value
+
+        for event in self.events:
+            event_type = type(event)
+            if event_type is bytes:
+                program.append(RawData(event))
+            elif event_type is _AddLabel:
+                program.add_label(resolve(event.label))
+            else:
+                name, signature, args = event
+                namespace[name].restore(signature, tuple(map(resolve, args)))
+
+
+class FragmentCache:
+    """Least recently used cache of the fragments emitted by sub bodies."""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._fragments = OrderedDict()
+
+    def key(self, fingerprinter, f, receiver):
+        """Return the key of the body `f` called with `receiver` or `None`
+        if it cannot be cached.
+        """
+        try:
+            return (
+                fingerprinter.program._cpu_name,
+                fingerprinter.body(f, receiver),
+            )
+        except Uncacheable:
+            return None
+
+    def get(self, key):
+        fragment = self._fragments.get(key)
+        if fragment is not None:
+            self._fragments.move_to_end(key)
+        return fragment
+
+    def put(self, key, fragment):
+        self._fragments[key] = fragment
+        if len(self._fragments) > self.maxsize:
+            self._fragments.popitem(last=False)
+
+    def clear(self):
+        self._fragments.clear()
+
+    def __len__(self):
+        return len(self._fragments)
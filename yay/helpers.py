@@ -1,16 +1,15 @@
+import os.path
 import sys
 from collections.abc import Mapping
 from copy import deepcopy
 from functools import lru_cache, wraps
-from types import FunctionType, MethodType
+from types import FunctionType, MappingProxyType
 
-from pkg_resources import resource_filename
-
-from yaml import load
 try:
-    from yaml import CLoader as Loader
+    from importlib.resources import files
 except ImportError:
-    from yaml import Loader
+    # Python < 3.9
+    files = None
 
 
 class InvalidRegisterError(ValueError):
@@ -26,11 +25,20 @@ class WrongSignatureException(TypeError):
 
 
 def config_filename(config_name):
-    return resource_filename("yay", config_name)
+    if files is None:
+        return os.path.join(os.path.dirname(__file__), config_name)
+    return str(files("yay").joinpath(config_name))
 
 
 @lru_cache()
 def _read_config_cached(config_name):
+    # PyYAML is only imported when a configuration is actually read.
+    from yaml import load
+    try:
+        from yaml import CLoader as Loader
+    except ImportError:
+        from yaml import Loader
+
     with open(config_name) as yaml_file:
         return load(yaml_file, Loader=Loader)
 
@@ -56,41 +64,113 @@ def recursive_merge(base, update):
     return merged
 
 
+def freeze(value):
+    """Recursively turn `dict`s and `list`s into read-only equivalents."""
+    if isinstance(value, Mapping):
+        return MappingProxyType({
+            key: freeze(item)
+            for key, item in value.items()
+        })
+    elif isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    else:
+        return value
+
+
 def twos_complement(number, bits, ranged=True):
     """Normalize negative values to their two’s complement values.
 
     Positive values are left unchanged if they are in ``range(2**bits)``,
     otherwise the last `bits` bits of them are taken.
     """
-    allowed_values = range(-2**(bits - 1), 2**bits)
-    if ranged and number not in allowed_values:
+    if ranged and not -2**(bits - 1) <= number < 2**bits:
+        allowed_values = range(-2**(bits - 1), 2**bits)
         raise ValueError(f"`number` not in `{allowed_values}`")
     return number & (2 ** bits - 1)
 
 
-def inject_names(names):
-    def decorator(f):
-        f_globals = dict(getattr(f, "_initial_globals", f.__globals__))
-        f_globals.update(names)
+class LayeredGlobals(dict):
+    """Globals that look names up in `names` first and then in the globals
+    of a module (and its builtins).
 
-        new_f = FunctionType(
-            f.__code__,
-            f_globals,
-            argdefs=f.__defaults__,
-            closure=f.__closure__
+    Names are copied into the dict when they are first looked up, so
+    creating it does not copy either namespace.
+    """
+    __slots__ = ("names", "module_globals", "builtins")
+
+    def __init__(self, names, module_globals):
+        builtins = module_globals.get("__builtins__", sys.modules["builtins"])
+        super().__init__(__builtins__=builtins)
+        self.names = names
+        self.module_globals = module_globals
+        self.builtins = getattr(builtins, "__dict__", builtins)
+
+    def __missing__(self, name):
+        try:
+            value = self.names[name]
+        except KeyError:
+            try:
+                value = self.module_globals[name]
+            except KeyError:
+                value = self.builtins[name]
+        self[name] = value
+        return value
+
+    def __contains__(self, name):
+        return (
+            dict.__contains__(self, name)
+            or name in self.names
+            or name in self.module_globals
         )
-        new_f._initial_globals = f.__globals__
-        new_f = wraps(f)(new_f)
 
-        if hasattr(f, "__self__"):
-            new_f = MethodType(new_f, f.__self__)
 
-        return new_f
-    return decorator
+def with_globals(f, f_globals):
+    """Return a copy of the function `f` that uses `f_globals`."""
+    new_f = FunctionType(
+        f.__code__,
+        f_globals,
+        argdefs=f.__defaults__,
+        closure=f.__closure__
+    )
+    new_f.__kwdefaults__ = f.__kwdefaults__
+    return wraps(f)(new_f)
+
+
+class BoundClass:
+    """`cls` bound to `program` without creating a subclass.
+
+    Calling it creates an instance of `cls` whose `program` attribute is
+    `program`. All other attributes are looked up on `cls`.
+    """
+    __slots__ = ("cls", "program")
+
+    def __init__(self, cls, program):
+        self.cls = cls
+        self.program = program
+
+    def new(self):
+        """Return an instance of `cls` bound to `program` without calling
+        its `__init__`.
+        """
+        instance = self.cls.__new__(self.cls)
+        instance.program = self.program
+        return instance
+
+    def __call__(self, *args, **kwargs):
+        instance = self.cls.__new__(self.cls)
+        instance.program = self.program
+        instance.__init__(*args, **kwargs)
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self.cls, name)
+
+    def __repr__(self):
+        return f"<bound class {self.cls.__qualname__}>"
 
 
 def _bind_program(cls, program):
-    return type(cls.__name__, (cls, ), dict(program=program))
+    return BoundClass(cls, program)
 
 
 def with_bind_program(cls):
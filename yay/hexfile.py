@@ -0,0 +1,96 @@
+"""Streaming Intel HEX output.
+
+Records are written while the encoded program is traversed, so the memory
+needed to write a program does not depend on its size.
+"""
+
+
+class IHexWriter:
+    """Write data records for consecutive data starting at `address` to the
+    binary file `outfile`.
+
+    Each data record holds at most `record_length` bytes. Data above 64 KiB
+    is only allowed with `extended_linear_address`, in which case the upper
+    16 bits of the address are set by extended linear address records and
+    data records do not cross 64 KiB boundaries.
+    """
+
+    def __init__(
+            self,
+            outfile,
+            address=0,
+            record_length=16,
+            extended_linear_address=False):
+        if not 1 <= record_length <= 0xff:
+            raise ValueError(
+                f"`record_length` must be in range(1, 256), not {record_length}"
+            )
+        self._outfile = outfile
+        self._address = address
+        self._record_length = record_length
+        self._extended_linear_address = extended_linear_address
+        self._upper_address = 0
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._next_record_length():
+            self._write_data_record()
+
+    def seek(self, address):
+        """Write the remaining data and continue at `address`."""
+        while self._buffer:
+            self._write_data_record()
+        self._address = address
+
+    def close(self):
+        """Write the remaining data and the end of file record."""
+        while self._buffer:
+            self._write_data_record()
+        self._write_record(0x01, 0, b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def _next_record_length(self):
+        return min(self._record_length, 0x10000 - (self._address & 0xffff))
+
+    def _write_data_record(self):
+        length = self._next_record_length()
+        data = self._buffer[:length]
+        del self._buffer[:length]
+
+        upper_address = self._address >> 16
+        if upper_address != self._upper_address:
+            if not self._extended_linear_address:
+                raise ValueError(
+                    f"Address {self._address:#x} does not fit into 16 bits"
+                )
+            self._write_record(0x04, 0, upper_address.to_bytes(2, "big"))
+            self._upper_address = upper_address
+
+        self._write_record(0x00, self._address & 0xffff, data)
+        self._address += len(data)
+
+    def _write_record(self, record_type, address, data):
+        record = bytes([len(data), address >> 8, address & 0xff, record_type])
+        record += data
+        checksum = -sum(record) & 0xff
+        self._outfile.write(
+            b":%s%02X\n" % (record.hex().upper().encode(), checksum)
+        )
+
+
+def write_ihex(chunks, outfile, address=0, **kwargs):
+    """Write the `bytes` objects in `chunks` to `outfile` as one contiguous
+    block of Intel HEX data records starting at `address`.
+
+    `kwargs` are passed to `IHexWriter`.
+    """
+    with IHexWriter(outfile, address, **kwargs) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
@@ -0,0 +1,113 @@
+"""Memory image of an assembled program.
+
+A program is laid out once into an `AssembledImage`, from which all output
+formats are rendered. The image is one `bytearray` covering the address
+space, so views of it do not copy, and it keeps track of the regions that
+were written to, so sections of a program can be placed anywhere as long as
+they do not overlap.
+"""
+from bisect import bisect_right
+
+from yay.hexfile import IHexWriter
+
+
+class AssembledImage:
+    """A `bytearray` of `size` bytes (the 64 KiB address space of most
+    targets by default), which grows when data is written beyond its end.
+
+    Written regions are kept as sorted, non-overlapping, non-adjacent
+    `[start, end)` ranges; writing to an address that was already written
+    raises `ValueError`. Views returned by `view` must be released before
+    the image grows.
+    """
+
+    def __init__(self, size=0x10000):
+        self._memory = bytearray(size)
+        self._starts = []
+        self._ends = []
+
+    def write(self, address, data):
+        """Write the bytes-like `data` at `address`."""
+        length = len(data)
+        if not length:
+            return
+        if address < 0:
+            raise ValueError(f"Cannot write to negative address {address:#x}")
+        end = address + length
+        index = bisect_right(self._starts, address)
+        if index and self._ends[index - 1] > address:
+            self._overlap(address, end, index - 1)
+        if index < len(self._starts) and self._starts[index] < end:
+            self._overlap(address, end, index)
+
+        if end > len(self._memory):
+            self._memory += bytes(end - len(self._memory))
+        self._memory[address:end] = data
+
+        joins_previous = index and self._ends[index - 1] == address
+        joins_next = index < len(self._starts) and self._starts[index] == end
+        if joins_previous and joins_next:
+            self._ends[index - 1] = self._ends.pop(index)
+            del self._starts[index]
+        elif joins_previous:
+            self._ends[index - 1] = end
+        elif joins_next:
+            self._starts[index] = address
+        else:
+            self._starts.insert(index, address)
+            self._ends.insert(index, end)
+
+    def _overlap(self, start, end, index):
+        raise ValueError(
+            f"[{start:#x}, {end:#x}) overlaps the data at "
+            f"[{self._starts[index]:#x}, {self._ends[index]:#x})"
+        )
+
+    @property
+    def regions(self):
+        """The written `(start, end)` ranges in ascending order."""
+        return list(zip(self._starts, self._ends))
+
+    @property
+    def end(self):
+        """The end of the last region (0 if nothing was written)."""
+        return self._ends[-1] if self._ends else 0
+
+    def view(self, start=0, end=None):
+        """Return a `memoryview` of the image from `start` to `end`
+        (default: the end of the last region) without copying.
+        """
+        return memoryview(self._memory)[start:self.end if end is None else end]
+
+    def segments(self):
+        """Return `(start, view)` for each region."""
+        view = memoryview(self._memory)
+        return [
+            (start, view[start:end])
+            for start, end in zip(self._starts, self._ends)
+        ]
+
+    def to_binary(self):
+        """Return the image from address 0 to the end of the last region."""
+        return bytes(self.view())
+
+    def to_ihex(self, as_str=True):
+        from ihex import IHex
+
+        ihex = IHex()
+        for start, data in self.segments():
+            ihex.insert_data(start, bytes(data))
+        if as_str:
+            return ihex.write()
+        else:
+            return ihex
+
+    def write_ihex(self, outfile, **kwargs):
+        """Write all regions as Intel HEX to the binary file `outfile`.
+
+        `kwargs` are passed to `yay.hexfile.IHexWriter`.
+        """
+        with IHexWriter(outfile, **kwargs) as writer:
+            for start, data in self.segments():
+                writer.seek(start)
+                writer.write(data)
@@ -1,17 +1,26 @@
+import _imp
 import ast
+import hashlib
+import marshal
+import os
 import sys
+from contextlib import suppress
+from functools import lru_cache
 from importlib.machinery import SourceFileLoader
-from importlib.util import module_from_spec, spec_from_loader
-from pathlib import Path
+from importlib.util import (
+    MAGIC_NUMBER, find_spec, module_from_spec, spec_from_loader,
+)
 
 import yay
+from yay import profiling
 
 
 def import_yay_file(yay_filename, name="main"):
-    spec = spec_for_yay_file(yay_filename, name)
-    module = module_from_spec(spec)
-    spec.loader.exec_module(module)
-    return module
+    with profiling.phase("import"):
+        spec = spec_for_yay_file(yay_filename, name)
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
 
 
 def spec_for_yay_file(yay_filename, module_name="main"):
@@ -20,78 +29,291 @@ def spec_for_yay_file(yay_filename, module_name="main"):
 
 
 class YayFinder:
-    def find_on_path(self, name):
+    """Meta path finder for `.yay` modules.
+
+    The contents of each searched directory are cached and only listed again
+    when the directory’s mtime changes, like `importlib.machinery.FileFinder`
+    does. Top-level modules are searched in `roots` (default: `sys.path`),
+    and only modules whose names start with one of `prefixes` (default: all)
+    are searched at all. Modules in the `yay` package are always in scope.
+    """
+
+    def __init__(self, roots=None, prefixes=None):
+        self._directories = {}
+        self.set_scope(roots, prefixes)
+
+    def set_scope(self, roots=None, prefixes=None):
+        self.roots = None if roots is None else [str(root) for root in roots]
+        self.prefixes = None if prefixes is None else ("yay", *prefixes)
+
+    def invalidate_caches(self):
+        self._directories.clear()
+
+    def is_in_scope(self, name):
+        if self.prefixes is None:
+            return True
+        return any(
+            name == prefix or name.startswith(f"{prefix}.")
+            for prefix in self.prefixes
+        )
+
+    def _contents(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return frozenset()
+        cached = self._directories.get(directory)
+        if cached is None or cached[0] != mtime:
+            try:
+                contents = frozenset(os.listdir(directory))
+            except OSError:
+                contents = frozenset()
+            cached = self._directories[directory] = mtime, contents
+        return cached[1]
+
+    def find_on_path(self, name, path=None):
         parts = name.split(".")
-        for path in map(Path, sys.path):
-            filename = path.joinpath(*parts).with_suffix(".yay")
-            if filename.exists():
-                return str(filename)
+        if path is None:
+            directories = sys.path if self.roots is None else self.roots
+        else:
+            # Submodules are only searched in their package’s `__path__`.
+            directories = path
+            parts = parts[-1:]
+        filename = f"{parts[-1]}.yay"
+        for directory in directories:
+            directory = os.path.join(directory or os.curdir, *parts[:-1])
+            if filename in self._contents(directory):
+                return os.path.join(directory, filename)
 
     def find_spec(self, name, path, target=None):
-        if target is not None:
-            raise ImportError("`target is not None` case is not supported")
+        if not self.is_in_scope(name):
+            return None
 
-        filename = self.find_on_path(name)
+        filename = self.find_on_path(name, path)
         if filename is not None:
+            if target is not None:
+                raise ImportError("`target is not None` case is not supported")
             return spec_for_yay_file(filename, name)
 
 
+def _file_digest(filename):
+    with open(filename, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def _installed_digest(name):
+    """Return a digest of the files of the top-level module `name` without
+    importing it.
+    """
+    spec = find_spec(name)
+    if spec is None or spec.origin is None:
+        return ""
+    if spec.submodule_search_locations is None:
+        filenames = [spec.origin]
+    else:
+        filenames = [
+            os.path.join(directory, filename)
+            for directory in spec.submodule_search_locations
+            for filename in sorted(os.listdir(directory))
+        ]
+    return hashlib.sha256(" ".join(
+        _file_digest(filename)
+        for filename in filenames
+        if os.path.isfile(filename)
+    ).encode()).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def _versions_key():
+    return "\0".join([
+        MAGIC_NUMBER.hex(),
+        yay.__version__,
+        # The version of yay is not changed with every change of the
+        # lowering below.
+        _file_digest(__file__),
+        # `yay_ast` is only imported if a file has to be compiled.
+        _installed_digest("yay_ast"),
+    ]).encode()
+
+
+def cache_key(source):
+    """Return the key of the code object compiled from `source`.
+
+    The key changes with the source, yay, the lowering in this module,
+    `yay_ast` and the bytecode format.
+    """
+    return hashlib.sha256(_versions_key() + b"\0" + source).digest()
+
+
+def cache_path(yay_filename):
+    """Return the path of the cached code for `yay_filename`.
+
+    `importlib.util.cache_from_source` strips the extension, so it would
+    return the same path for `foo.yay` and `foo.py`.
+    """
+    directory, filename = os.path.split(yay_filename)
+    return os.path.join(
+        directory,
+        "__pycache__",
+        f"{filename}.{sys.implementation.cache_tag}.pyc",
+    )
+
+
+def read_cached_code(bytecode_path, key):
+    """Return the cached code at `bytecode_path` or `None` if it is missing
+    or does not match `key`.
+    """
+    try:
+        with open(bytecode_path, "rb") as bytecode_file:
+            data = bytecode_file.read()
+    except OSError:
+        return None
+    if data[:len(key)] != key:
+        return None
+    with suppress(EOFError, ValueError, TypeError):
+        return marshal.loads(data[len(key):])
+    return None
+
+
+def write_cached_code(bytecode_path, key, code):
+    directory = os.path.dirname(bytecode_path)
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first so that concurrent imports never read
+    # a partially written file.
+    data = key + marshal.dumps(code)
+    temporary_path = f"{bytecode_path}.{os.getpid()}"
+    try:
+        with open(temporary_path, "wb") as bytecode_file:
+            bytecode_file.write(data)
+        os.replace(temporary_path, bytecode_path)
+    except OSError:
+        with suppress(OSError):
+            os.unlink(temporary_path)
+        raise
+
+
+def compile_yay_file(yay_filename):
+    """Compile `yay_filename` and write its cached code."""
+    loader = YayFileLoader("__main__", yay_filename)
+    with open(yay_filename, "rb") as yay_file:
+        source = yay_file.read()
+    write_cached_code(
+        cache_path(yay_filename),
+        cache_key(source),
+        loader.source_to_code(source, yay_filename),
+    )
+
+
 class YayFileLoader(SourceFileLoader):
+    def get_code(self, fullname):
+        source_path = self.get_filename(fullname)
+        source = self.get_data(source_path)
+        key = cache_key(source)
+        bytecode_path = cache_path(source_path)
+
+        code = read_cached_code(bytecode_path, key)
+        if code is not None:
+            # The code may have been compiled at another path (e. g. in the
+            # build directory by `setup.py`).
+            _imp._fix_co_filename(code, source_path)
+            return code
+
+        code = self.source_to_code(source, source_path)
+        if not sys.dont_write_bytecode:
+            with suppress(OSError):
+                write_cached_code(bytecode_path, key, code)
+        return code
+
     def source_to_code(self, data, *args, **kwargs):
-        node = yay.ast.parse(data)
-        node = MovTransformer().visit(node)
-        node = DerefTransformer().visit(node)
-        node = ToPythonAstTransformer().visit(node)
-        ast.fix_missing_locations(node)
-        return super().source_to_code(
-            node,
-            *args,
-            **kwargs
-        )
+        with profiling.phase("transform"):
+            return super().source_to_code(
+                lower(yay.ast.parse(data)),
+                *args,
+                **kwargs
+            )
 
 
-class CopyLocationMixin:
-    def visit(self, node):
-        return yay.ast.copy_location(
-            super().visit(node),
-            node
-        )
+def _python_ast_types():
+    python_ast_types = {}
+    for name in dir(ast):
+        python_type = getattr(ast, name)
+        yay_type = getattr(yay.ast, name, None)
+        if (
+            isinstance(python_type, type)
+            and issubclass(python_type, ast.AST)
+            and yay_type is not None
+        ):
+            python_ast_types[yay_type] = python_type
+    return python_ast_types
 
 
-class MovTransformer(CopyLocationMixin, yay.ast.NodeTransformer):
-    def visit_ArrowAssign(self, node):
-        if len(node.targets) > 1:
-            raise RuntimeError("This cannot happen!")
+# Maps `yay_ast` node types to the `ast` node types they are lowered to.
+# Filled on first use so that importing this module does not import
+# `yay_ast`.
+_PYTHON_AST_TYPES = {}
 
-        return yay.ast.Expr(
-            yay.ast.Call(
-                func=yay.ast.Name(id="mov", ctx=yay.ast.Load()),
-                args=[node.targets[0], node.value],
-                keywords=[]
-            )
-        )
 
+def _with_location(python_node, node):
+    for attribute in node._attributes:
+        value = getattr(node, attribute, None)
+        if value is not None:
+            setattr(python_node, attribute, value)
+    return python_node
 
-class DerefTransformer(CopyLocationMixin, yay.ast.NodeTransformer):
-    def visit_UnaryOp(self, node):
-        if not isinstance(node.op, yay.ast.Deref):
-            return node
 
-        return yay.ast.Call(
-            func=yay.ast.Name(id="at", ctx=yay.ast.Load()),
-            args=[node.operand],
+def _call(name, args, node):
+    """Return the Python AST for `name(*args)` located at `node`."""
+    return _with_location(
+        ast.Call(
+            func=_with_location(ast.Name(id=name, ctx=ast.Load()), node),
+            args=args,
             keywords=[],
-        )
+        ),
+        node,
+    )
+
+
+def _lower_field(value):
+    if isinstance(value, yay.ast.AST):
+        return _lower(value)
+    elif isinstance(value, list):
+        return [
+            _lower(item) if isinstance(item, yay.ast.AST) else item
+            for item in value
+        ]
+    else:
+        return value
+
 
+def lower(node):
+    """Lower the `yay_ast` tree `node` to a Python AST in a single pass.
 
-class ToPythonAstTransformer(CopyLocationMixin, yay.ast.NodeTransformer):
-    def replace_node(self, node):
-        self.generic_visit(node)
+    `a <- b` becomes `mov(a, b)` and `^a` becomes `at(a)`.
+    """
+    if not _PYTHON_AST_TYPES:
+        _PYTHON_AST_TYPES.update(_python_ast_types())
+    return ast.fix_missing_locations(_lower(node))
 
-        PyAstType = getattr(ast, type(node).__name__)
-        return PyAstType(**dict(yay.ast.iter_fields(node)))
 
-    def __getattr__(self, name):
-        if not name.startswith("visit_"):
-            raise AttributeError
-        return self.replace_node
+def _lower(node):
+    node_type = type(node)
+    if node_type is yay.ast.ArrowAssign:
+        if len(node.targets) > 1:
+            raise RuntimeError("This cannot happen!")
+        return _with_location(
+            ast.Expr(
+                value=_call(
+                    "mov",
+                    [_lower(node.targets[0]), _lower(node.value)],
+                    node,
+                ),
+            ),
+            node,
+        )
+    elif node_type is yay.ast.UnaryOp and type(node.op) is yay.ast.Deref:
+        return _call("at", [_lower(node.operand)], node)
+
+    python_node = _PYTHON_AST_TYPES[node_type]()
+    for name in node._fields:
+        setattr(python_node, name, _lower_field(getattr(node, name, None)))
+    return _with_location(python_node, node)
@@ -0,0 +1,49 @@
+class LocalLabel(str):
+    """A label name generated by `Program.new_label_name` or a label added
+    inside a label scope (see `Program.label_scope`).
+
+    Local labels are unique by identity, so they never clash with other
+    labels and their address is stored on the label itself instead of in
+    `Program.labels`.
+    """
+    address = None
+
+
+class LabelScope:
+    """The labels of a `Program.label_scope`, which map names to
+    `LocalLabel`s. Scopes are only referenced by the mnemonics appended inside
+    them, not by the program.
+    """
+    __slots__ = ("parent", "labels")
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.labels = {}
+
+
+class Labels(dict):
+    """The global labels of a program (`Program.labels`).
+
+    Code that reads an address may bake it into the program, so reading a
+    label pins the relaxable mnemonics before it like `Program.position`.
+    """
+    __slots__ = ("program",)
+
+    def __init__(self, program):
+        super().__init__()
+        self.program = program
+
+    # Reads an address without pinning, see `Program.label_address`.
+    address = dict.__getitem__
+
+    def _was_read(self):
+        if not self.program._layout_started:
+            self.program._address_was_read()
+
+    def __getitem__(self, label):
+        self._was_read()
+        return self.address(label)
+
+    def get(self, label, default=None):
+        self._was_read()
+        return super().get(label, default)
@@ -1,39 +1,272 @@
 import re
+from contextlib import suppress
 from functools import partial
+from types import MappingProxyType
 
+from yay import profiling
 from yay.helpers import (
     InvalidConfigError, WrongSignatureException, twos_complement,
-    with_bind_program,
 )
 
 
-def get_bit(number, bit):
-    return (number >> bit) & 1
+_SHORT_BIT_FORMAT = re.compile(r"(\w)(\d+)")
 
 
-def make_mnemonic(name, signatures):
-    return type(
-        name,
-        (Mnemonic, ),
-        dict(signatures=signatures)
+def _byte_out_of_range(number):
+    # Raises the same error as the unchecked two’s complement conversion.
+    return twos_complement(number, 8)
+
+
+def _compile_byte(byte_format, parameter, short_to_argname):
+    """Return a Python expression that evaluates to the byte `byte_format`.
+
+    `parameter` maps argument names to the names of the encoder’s parameters.
+    """
+    if len(byte_format) == 1:
+        item, = byte_format
+        if isinstance(item, int):
+            try:
+                return str(twos_complement(item, 8))
+            except ValueError as err:
+                raise InvalidConfigError(str(err)) from None
+        try:
+            name = parameter[item]
+        except (KeyError, TypeError):
+            raise InvalidConfigError(
+                f"`{item!r}` is not an argument of the signature"
+            ) from None
+        return f"({name} & 0xff if -0x80 <= {name} < 0x100 else _byte_out_of_range({name}))"
+    elif len(byte_format) == 8:
+        constant = 0
+        fields = {}
+        for position, bit_format in enumerate(reversed(byte_format)):
+            if isinstance(bit_format, int):
+                if bit_format not in (0, 1):
+                    raise InvalidConfigError(
+                        f"Bit must be either 0 or 1, not {bit_format}"
+                    )
+                constant |= bit_format << position
+                continue
+            match = _SHORT_BIT_FORMAT.fullmatch(str(bit_format))
+            if match is None or match.group(1) not in short_to_argname:
+                raise InvalidConfigError(
+                    f"`{bit_format!r}` is not a valid bit format"
+                )
+            argname = short_to_argname[match.group(1)]
+            if argname not in parameter:
+                raise InvalidConfigError(
+                    f"`{argname!r}` is not an argument of the signature"
+                )
+            digit = int(match.group(2))
+            # Bits of an argument that are moved by the same amount are
+            # extracted together with one mask.
+            key = parameter[argname], position - digit
+            fields[key] = fields.get(key, 0) | 1 << digit
+        terms = [str(constant)] if constant or not fields else []
+        for (name, shift), mask in fields.items():
+            if shift == 0:
+                terms.append(f"{name} & {mask:#x}")
+            elif shift > 0:
+                terms.append(f"({name} & {mask:#x}) << {shift}")
+            else:
+                terms.append(f"({name} >> {-shift}) & {mask >> -shift:#x}")
+        return " | ".join(f"({term})" for term in terms)
+    else:
+        raise InvalidConfigError(
+            f"`byte_format` length must be either 1 or 8, not {len(byte_format)}"
+        )
+
+
+def compile_opcode(signature, short_to_argname):
+    """Compile the opcode format of `signature` into an encoder function.
+
+    The encoder takes the values of the arguments listed in its `argnames`
+    attribute and returns the opcode as `bytes`. Invalid opcode formats
+    raise `InvalidConfigError`.
+    """
+    used = set()
+    for byte_format in signature["opcode"]:
+        for item in byte_format:
+            if isinstance(item, str):
+                match = _SHORT_BIT_FORMAT.fullmatch(item)
+                if match is not None and match.group(1) in short_to_argname:
+                    item = short_to_argname[match.group(1)]
+                used.add(item)
+    argnames = [name for name in signature["signature"] if name in used]
+    parameter = {name: f"_{index}" for index, name in enumerate(argnames)}
+
+    expressions = [
+        _compile_byte(byte_format, parameter, short_to_argname)
+        for byte_format in signature["opcode"]
+    ]
+    lines = [f"def encode({', '.join(parameter.values())}):"]
+    # Operands (e. g. `Register`, `Bit`) are encoded as their `__int__`.
+    lines.extend(f"    {name} = int({name})" for name in parameter.values())
+    lines.append(f"    return bytes(({''.join(f'{e}, ' for e in expressions)}))")
+
+    namespace = {"_byte_out_of_range": _byte_out_of_range}
+    exec("\n".join(lines), namespace)
+    encode = namespace["encode"]
+    encode.argnames = tuple(argnames)
+    return encode
+
+
+def compile_signatures(signatures, short_to_argname):
+    return [
+        dict(
+            signature,
+            encode=compile_opcode(signature, short_to_argname),
+            index=index,
+        )
+        for index, signature in enumerate(signatures)
+    ]
+
+
+def compile_dispatch(signatures):
+    """Group `signatures` by arity.
+
+    Each arity maps to a cache (filled by `Mnemonic.find_matching_signature`)
+    and the signatures with that arity in the order they are tried.
+    """
+    by_arity = {}
+    for signature in signatures:
+        by_arity.setdefault(len(signature["signature"]), []).append(signature)
+    return {
+        arity: ({}, tuple(candidates))
+        for arity, candidates in by_arity.items()
+    }
+
+
+def make_mnemonic(name, signatures, operand_key=None):
+    namespace = dict(
+        __slots__=(),
+        signatures=signatures,
+        _dispatch=compile_dispatch(signatures),
+        _records={},
     )
+    if operand_key is not None:
+        namespace["_operand_key"] = staticmethod(operand_key)
+    return type(name, (Mnemonic, ), namespace)
 
 
 def make_mnemonics(config):
+    operand_key = getattr(
+        config["parse_helpers"]["matchers"],
+        "operand_key",
+        None
+    )
+    short_to_argname = config.get("short_to_argname", {})
     return {
-        name: make_mnemonic(name, signatures)
+        name: make_mnemonic(
+            name,
+            compile_signatures(signatures, short_to_argname),
+            operand_key,
+        )
         for name, signatures in config["mnemonics"].items()
     }
 
 
-@with_bind_program
+def make_relaxed_mnemonics(config):
+    return {
+        name: type(
+            name,
+            (RelaxedMnemonic, ),
+            dict(__slots__=(), forms=tuple(forms)),
+        )
+        for name, forms in config.get("relaxed_mnemonics", {}).items()
+    }
+
+
+class Signature:
+    """A signature of a mnemonic together with the alternatives that were
+    taken to match it.
+
+    Instances are immutable and shared by all mnemonics that matched the same
+    signature in the same way.
+    """
+    __slots__ = (
+        "index", "argument_format", "signature", "alternatives_taken",
+        "opcode", "encode", "size", "operands",
+    )
+
+    def __init__(self, definition, alternatives_taken):
+        self.index = definition.get("index")
+        self.argument_format = tuple(definition["signature"])
+        self.signature = tuple(
+            alternatives_taken.get(name, name)
+            for name in self.argument_format
+        )
+        self.alternatives_taken = MappingProxyType(dict(alternatives_taken))
+        self.opcode = definition["opcode"]
+        self.encode = definition.get("encode")
+        self.size = len(self.opcode)
+        # Maps each argument name to the index of its value in the arguments
+        # and the type it has to be converted from (if any).
+        self.operands = MappingProxyType({
+            name: (index, alternatives_taken.get(name))
+            for index, name in enumerate(self.argument_format)
+        })
+
+    def __repr__(self):
+        return f"<Signature {self.signature}>"
+
+
+class BoundMnemonic(partial):
+    """A mnemonic class bound to a program, see `Mnemonic.bind_program`.
+
+    Calling it passes the program as the first argument to the mnemonic
+    class. All other attributes are looked up on the mnemonic class.
+    """
+
+    def __new__(cls, mnemonic_class, program):
+        return super().__new__(cls, mnemonic_class, program)
+
+    @property
+    def cls(self):
+        return self.func
+
+    @property
+    def program(self):
+        return self.args[0]
+
+    def __getattr__(self, name):
+        return getattr(self.func, name)
+
+    def __repr__(self):
+        return f"<bound class {self.func.__qualname__}>"
+
+    def new(self):
+        """Return an instance of the mnemonic bound to the program without
+        calling its `__init__`.
+        """
+        mnemonic = self.func.__new__(self.func)
+        mnemonic.program = self.program
+        return mnemonic
+
+    def restore(self, signature, args):
+        """Append a mnemonic that is known to match `signature` with `args`.
+
+        Used to replay cached fragments without matching `args` again.
+        """
+        mnemonic = self.new()
+        mnemonic._restore(signature, args)
+        return mnemonic
+
+
 class Mnemonic:
-    _SHORT_BIT_FORMAT = re.compile(r"(\w)(\d+)")
+    __slots__ = (
+        "program", "signature", "_args", "_opcode", "_position", "label_scope",
+    )
+
+    relaxable = False
 
-    program = None
     signatures = None
+    _dispatch = None
+    _records = None
+    _operand_key = None
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, program, *args, **kwargs):
+        self.program = program
         auto = kwargs.pop("auto", True)
 
         if args and kwargs:
@@ -41,24 +274,55 @@ class Mnemonic:
                 "Mixing of positional and keyword arguments is not allowed."
             )
 
-        self.signature = self.find_matching_signature(args, kwargs)
+        profile = profiling.active
+        if profile is None:
+            self.signature = self.find_matching_signature(args, kwargs)
+        else:
+            with profile.phase("match"):
+                self.signature = self.find_matching_signature(args, kwargs)
 
         if kwargs:
-            self._init_kwargs = kwargs
-        else:
-            self._init_kwargs = self.kwargs_from_args(
-                self.signature["signature"],
-                args
+            args = tuple(
+                kwargs[name] for name in self.signature.argument_format
             )
-
+        self._args = args
         self._opcode = None
+        self._position = None
+        self.label_scope = None
 
         if auto:
             self.program.append(self)
 
+    @classmethod
+    def bind_program(cls, program):
+        """Return `cls` bound to `program`: calling it appends the mnemonic
+        to `program`.
+
+        Mnemonics are bound to each program, so binding does not create a
+        class.
+        """
+        return BoundMnemonic(cls, program)
+
+    def _restore(self, signature, args):
+        self.signature = signature
+        self._args = args
+        self._opcode = None
+        self._position = None
+        self.label_scope = None
+        self.program.append(self)
+
     @property
     def size(self):
-        return len(self.signature["opcode"])
+        return self.signature.size
+
+    @property
+    def is_fixed(self):
+        """Whether the opcode does not depend on positions or labels.
+
+        Only arguments matched by an alternative (e. g. a label as
+        `relative`) are converted depending on the position.
+        """
+        return not self.signature.alternatives_taken
 
     @property
     def opcode(self):
@@ -71,27 +335,62 @@ class Mnemonic:
         return self.program.get_position(self)
 
     def find_matching_signature(self, args, kwargs):
+        if kwargs or self._dispatch is None:
+            signature = self._search_signature(self.signatures, args, kwargs)
+        else:
+            cache, candidates = self._dispatch.get(len(args), ({}, ()))
+            key = self._dispatch_key(args)
+            if key is None:
+                signature = self._search_signature(candidates, args, kwargs)
+            else:
+                try:
+                    signature = cache[key]
+                except KeyError:
+                    signature = cache[key] = self._search_signature(
+                        candidates, args, kwargs
+                    )
+
+        if signature is None:
+            raise WrongSignatureException(
+                f"Cannot call {self.__class__.__name__} with this signature: "
+                f"{args!r}, {kwargs!r}"
+            )
+        return signature
+
+    def _dispatch_key(self, args):
+        """Classify `args` so that equal keys match the same signature."""
+        if self._operand_key is None:
+            return None
+        key = tuple(map(self._operand_key, args))
+        if None in key:
+            return None
+        return key
+
+    def _search_signature(self, signatures, args, kwargs):
         if kwargs:
             matcher = partial(self.matches_kwargs, kwargs)
         else:
             matcher = partial(self.matches_args, args)
 
-        for signature in self.signatures:
-            argument_format = signature["signature"]
-            matches, alternatives_taken = matcher(argument_format)
+        for signature in signatures:
+            matches, alternatives_taken = matcher(signature["signature"])
             if matches:
-                signature = dict(signature)
-                signature["alternatives_taken"] = alternatives_taken
-                signature["signature"] = [
-                    alternatives_taken.get(name, name)
-                    for name in signature["signature"]
-                ]
-                return signature
-
-        raise WrongSignatureException(
-            f"Cannot call {self.__class__.__name__} with this signature: "
-            f"{args!r}, {kwargs!r}"
-        )
+                return self._interned_signature(signature, alternatives_taken)
+        return None
+
+    @classmethod
+    def _interned_signature(cls, definition, alternatives_taken):
+        if cls._records is None:
+            return Signature(definition, alternatives_taken)
+        key = definition["index"], tuple(alternatives_taken.items())
+        try:
+            return cls._records[key]
+        except KeyError:
+            record = cls._records[key] = Signature(
+                definition,
+                alternatives_taken,
+            )
+            return record
 
     def matches_args(self, args, argument_format):
         if len(args) != len(argument_format):
@@ -114,82 +413,166 @@ class Mnemonic:
             argument_format,
         )
 
-    @staticmethod
-    def kwargs_from_args(argument_format, args):
-        return dict(zip(argument_format, args))
-
     def find_opcode(self):
-        return bytes(
-            twos_complement(
-                self.process_byte(byte_format),
-                8
-            )
-            for byte_format in self.signature["opcode"]
-        )
-
-    def process_byte(self, byte_format):
-        if len(byte_format) == 1:
-            # TODO: Should arguments unconditionally be converted to `int`?
-            # Does this promote subtle bugs in production code?
-            return int(self.try_match_byte(byte_format[0]))
-        elif len(byte_format) == 8:
-            result = 0
-            for digit, bit_format in enumerate(reversed(byte_format)):
-                result |= self.try_match_bit(bit_format) << digit
-            return result
-        else:
-            raise InvalidConfigError(
-                f"`byte_format` length must be either 1 or 8, not {len(byte_format)}"
-            )
+        encode = self.signature.encode
+        return encode(*map(self.operand, encode.argnames))
 
-    def try_match_byte(self, byte_format):
-        try:
-            return int(byte_format)
-        except ValueError:
-            alternatives_taken = self.signature["alternatives_taken"]
-            if byte_format in alternatives_taken:
-                from_type = alternatives_taken[byte_format]
-                return self.program.convert(
-                    self,
-                    from_type,
-                    byte_format,
-                    self._init_kwargs[from_type]
-                )
-            else:
-                return self._init_kwargs[byte_format]
+    def operand(self, argname):
+        """Return the value of the argument `argname` of the signature.
 
-    def try_match_bit(self, bit_format):
-        try:
-            match = self._SHORT_BIT_FORMAT.match(bit_format)
-        except TypeError:
-            return int(bit_format)
-        short = match.group(1)
-        digit = int(match.group(2))
-        typename = self.program.cpu["short_to_argname"][short]
-        return get_bit(int(self.try_match_byte(typename)), digit)
+        Arguments that were matched by an alternative are converted.
+        """
+        index, from_type = self.signature.operands[argname]
+        value = self._args[index]
+        if from_type is None:
+            return value
+        return self.program.convert(self, from_type, argname, value)
 
     def __repr__(self):
-        if hasattr(self, "_init_kwargs"):
+        try:
             args = ", ".join(
                 f"{name}={value}"
-                for name, value in self._init_kwargs.items()
+                for name, value in zip(self.signature.signature, self._args)
             )
-        else:
+        except AttributeError:
             args = "?"
         return f"{self.__class__.__name__}({args})"
 
 
 class Lit(Mnemonic):
-    def __init__(self, byte, auto=True):
+    __slots__ = ("byte", )
+
+    _signature = Signature({"signature": ["byte"], "opcode": [["byte"]]}, {})
+
+    def __init__(self, program, byte, auto=True):
+        self.program = program
         if byte not in range(2 ** 8):
             raise WrongSignatureException(
                 f"`byte` must be in range(256), not `{byte}`"
             )
         self.byte = byte
-        self.signatures = [
-            {
-                "signature": [],
-                "opcode": [[byte]]
-            }
-        ]
-        super().__init__(auto=auto)
+        self.signature = self._signature
+        self._args = (byte, )
+        self._opcode = None
+        self._position = None
+        self.label_scope = None
+
+        if auto:
+            self.program.append(self)
+
+    def _restore(self, signature, args):
+        self.__init__(self.program, *args)
+
+    def find_opcode(self):
+        return bytes([self.byte])
+
+
+class RawData(Mnemonic):
+    """A block of bytes that is emitted verbatim.
+
+    `data` can be any bytes-like object (e. g. a `memoryview` of an `mmap`,
+    which is not copied) or an iterable of ints. The block is one entry in
+    the program regardless of its length.
+
+    Unlike other mnemonics, raw data is not bound to a program and has to be
+    appended explicitly.
+    """
+    __slots__ = ("data", )
+
+    # Raw data is never copied into the encoded code of the program.
+    is_fixed = False
+
+    def __init__(self, data):
+        if isinstance(data, memoryview):
+            data = data.cast("B") if data.format != "B" else data
+        elif not isinstance(data, bytes):
+            data = bytes(data)
+        self.data = data
+        self.program = None
+        self._position = None
+        self.label_scope = None
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def opcode(self):
+        return self.data
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.data!r})"
+
+
+class RelaxedMnemonic(Mnemonic):
+    """A jump or call that is assembled as one of the mnemonics in `forms`.
+
+    `forms` are ordered from shortest to longest. The instruction is appended
+    as the longest form that accepts `target`, `Program` then picks the
+    shortest form that reaches `target` when laying out the program.
+    """
+    __slots__ = ("candidates", "choice")
+
+    relaxable = True
+    is_fixed = False
+    # The form is only chosen when the program is laid out.
+    signature = None
+
+    forms = ()
+
+    def __init__(self, program, target, auto=True):
+        self.program = program
+        self._args = (target, )
+        self._position = None
+        self.label_scope = None
+        self.candidates = []
+        for form in self.forms:
+            with suppress(WrongSignatureException):
+                self.candidates.append(
+                    self.program.mnemonic(form)(target, auto=False)
+                )
+        if not self.candidates:
+            raise WrongSignatureException(
+                f"Cannot call {self.__class__.__name__} with this signature: "
+                f"{target!r}"
+            )
+        self.choice = len(self.candidates) - 1
+
+        if auto:
+            self.program.append(self)
+
+    def _restore(self, signature, args):
+        self.__init__(self.program, *args)
+
+    @property
+    def form(self):
+        return self.candidates[self.choice]
+
+    @property
+    def size(self):
+        return self.form.size
+
+    @property
+    def longest_size(self):
+        return self.candidates[-1].size
+
+    @property
+    def opcode(self):
+        return self._encode(self.form)
+
+    def _encode(self, candidate):
+        candidate._position = self._position
+        candidate.label_scope = self.label_scope
+        return candidate.find_opcode()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(target={self._args[0]})"
+
+    def reaches_target(self):
+        """Check whether the current form can encode the jump to `target`."""
+        try:
+            self._encode(self.form)
+        except ValueError:
+            return False
+        else:
+            return True
@@ -0,0 +1,513 @@
+"""Relocatable object files and the linker.
+
+`Program.to_object` runs a program (its `main` and the bodies of all subs it
+calls) without laying it out and returns an `ObjectFile`: the encoded bytes
+of all mnemonics whose encoding does not depend on their position, the
+labels it defines and relocations for all other mnemonics (jumps and calls
+to labels, relaxed jumps), whose arguments refer to symbols instead of
+addresses. Objects can be stored with `ObjectFile.dump` and are placed and
+patched into a program by `Program.link` or `link`, which replay them like
+cached fragments, so jumps between objects are relaxed as usual.
+
+Global labels are the symbols exported by an object; global labels that an
+object uses but does not define are references that another object has to
+define. All other labels (labels of subs, of `new_label_name` and labels
+inside label scopes) are local to their object, so the subs called by an
+object are part of it. A library can instead export the subs it emits under
+their qualified name (e. g. `Delay.wait`) and objects that use the library
+can refer to them without emitting them, see `Program.to_object`.
+
+Objects are stored as JSON, so loading them never executes code. They record
+a digest of the CPU configuration they were assembled with, as relocations
+refer to the signatures of mnemonics by their index.
+
+Objects whose code read the current position (e. g. to load the address of
+a lookup table) contain absolute addresses and can only be placed at the
+address they were assembled for, their `origin`.
+"""
+import argparse
+import json
+import sys
+from collections import namedtuple
+
+from yay.fragments import _AddLabel, _CpuObject, _Local
+from yay.labels import LocalLabel
+from yay.mnemonic import BoundMnemonic, RawData
+
+
+FORMAT_VERSION = 2
+
+
+class LinkError(Exception):
+    pass
+
+
+class _Pin(namedtuple("_Pin", "")):
+    """Marks where the relaxed jumps before it were pinned by reading the
+    position.
+    """
+
+
+class _Operand(namedtuple("_Operand", "module qualname arguments")):
+    """Placeholder for an operand (an object whose class has a `kind`, see
+    `yay.cpus.MCS_51._Operand`) that is not part of the CPU namespace.
+    """
+
+
+class ObjectFile:
+    """A program assembled without being placed at an address.
+
+    `events` are, in order, runs of encoded `bytes`, label definitions
+    (`_AddLabel`s of a global name or a `_Local` symbol), relocations
+    `(mnemonic name, signature index, alternatives taken, arguments)` and at
+    most one `_Pin`. The signature of relaxed mnemonics is `None`, they are
+    matched again when linked. `cpu_digest` identifies the configuration of
+    `cpu`. `local_symbols` are the names of the local labels, `symbols` the
+    exported global labels and `references` the global labels that are used
+    but not defined.
+    """
+    __slots__ = (
+        "cpu", "cpu_digest", "origin", "local_symbols", "symbols",
+        "references", "events",
+    )
+
+    def __init__(
+            self, cpu, cpu_digest, origin, local_symbols, symbols, references,
+            events):
+        self.cpu = cpu
+        self.cpu_digest = cpu_digest
+        self.origin = origin
+        self.local_symbols = tuple(local_symbols)
+        self.symbols = tuple(symbols)
+        self.references = tuple(references)
+        self.events = tuple(events)
+
+    def dump(self, outfile):
+        """Write the object to the binary file `outfile`."""
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data["events"] = [_encode_event(event) for event in self.events]
+        data["format"] = FORMAT_VERSION
+        outfile.write(json.dumps(data, separators=(",", ":")).encode())
+
+    @classmethod
+    def load(cls, infile):
+        """Read an object written by `dump` from the binary file `infile`."""
+        try:
+            data = json.loads(infile.read().decode())
+            version = data.pop("format")
+        except (ValueError, TypeError, KeyError, AttributeError):
+            raise LinkError("Not an object file") from None
+        if version != FORMAT_VERSION:
+            raise LinkError(
+                f"Unsupported object file version {version!r}, expected "
+                f"{FORMAT_VERSION}"
+            )
+        try:
+            data["events"] = [_decode_event(event) for event in data["events"]]
+            return cls(**data)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            raise LinkError("Malformed object file") from None
+
+    def __repr__(self):
+        return (
+            f"<ObjectFile cpu={self.cpu!r} origin={self.origin!r} "
+            f"symbols={list(self.symbols)!r} "
+            f"references={list(self.references)!r}>"
+        )
+
+
+def _encode_value(value):
+    if value is None or type(value) in (bool, int, str):
+        return value
+    value_type = type(value)
+    if value_type is _Local:
+        return {"local": value.index}
+    elif value_type is _CpuObject:
+        return {"cpu": value.name}
+    elif value_type is _Operand:
+        return {
+            "operand": [value.module, value.qualname],
+            "arguments": [_encode_value(arg) for arg in value.arguments],
+        }
+    raise LinkError(f"Cannot store {value!r} in an object file")
+
+
+def _decode_value(data):
+    if not isinstance(data, dict):
+        if data is not None and type(data) not in (bool, int, str):
+            raise ValueError(data)
+        return data
+    elif "local" in data:
+        return _Local(int(data["local"]))
+    elif "cpu" in data:
+        return _CpuObject(str(data["cpu"]))
+    module, qualname = map(str, data["operand"])
+    return _Operand(
+        module,
+        qualname,
+        tuple(_decode_value(arg) for arg in data["arguments"]),
+    )
+
+
+def _encode_event(event):
+    event_type = type(event)
+    if event_type is bytes:
+        return {"code": event.hex()}
+    elif event_type is _AddLabel:
+        return {"label": _encode_value(event.label)}
+    elif event_type is _Pin:
+        return {"pin": True}
+    name, index, alternatives, args = event
+    return {
+        "mnemonic": name,
+        "signature": index,
+        "alternatives": alternatives,
+        "arguments": [_encode_value(arg) for arg in args],
+    }
+
+
+def _decode_event(data):
+    if "code" in data:
+        return bytes.fromhex(data["code"])
+    elif "label" in data:
+        return _AddLabel(_decode_value(data["label"]))
+    elif "pin" in data:
+        return _Pin()
+    alternatives = data["alternatives"]
+    if alternatives is not None:
+        alternatives = tuple(
+            (str(name), str(alternative))
+            for name, alternative in alternatives
+        )
+    index = data["signature"]
+    return (
+        str(data["mnemonic"]),
+        None if index is None else int(index),
+        alternatives,
+        tuple(_decode_value(arg) for arg in data["arguments"]),
+    )
+
+
+def from_program(program, export_subs=False):
+    """Return the `ObjectFile` of the emitted but not laid out `program`.
+
+    With `export_subs`, the labels of the emitted subs are exported under
+    their qualified name (`sub.symbol`).
+    """
+    if len(program._sections) > 1:
+        raise LinkError(
+            "Programs with several sections (`org`) cannot be relocated"
+        )
+    local_symbols = []
+    # Maps `id`s of local labels (including those of label scopes) to their
+    # `_Local` symbol.
+    locals_by_key = {}
+
+    def local_symbol(key, name):
+        symbol = locals_by_key[key] = _Local(len(local_symbols))
+        local_symbols.append(str(name))
+        return symbol
+
+    definitions = [
+        (position, name) for name, position in program.labels.items()
+    ]
+    symbols = list(program.labels)
+    if export_subs:
+        for sub, label in program._sub_labels.items():
+            if type(label) is not LocalLabel:
+                # Not emitted, see `Program.to_object`.
+                continue
+            if sub.symbol in symbols:
+                raise LinkError(f"Symbol {sub.symbol!r} is defined multiply")
+            symbols.append(sub.symbol)
+            locals_by_key[id(label)] = sub.symbol
+            definitions.append((label.address, sub.symbol))
+    for label in program._local_labels:
+        if id(label) not in locals_by_key:
+            definitions.append((label.address, local_symbol(id(label), label)))
+    definitions.sort(key=lambda definition: definition[0])
+
+    references = []
+
+    def portable(value, scope):
+        if type(value) is LocalLabel:
+            try:
+                return locals_by_key[id(value)]
+            except KeyError:
+                raise LinkError(f"Local label {value!r} is not defined") from None
+        if isinstance(value, str):
+            while scope is not None:
+                if value in scope.labels:
+                    return locals_by_key[id(scope.labels[value])]
+                scope = scope.parent
+            value = str(value)
+            if value not in program.labels and value not in references:
+                references.append(value)
+            return value
+        name = program._cpu_object_name(value)
+        if name is not None:
+            return _CpuObject(name)
+        if getattr(value, "program", None) is not None:
+            raise LinkError(f"Cannot relocate {value!r}")
+        if getattr(type(value), "kind", None) is not None:
+            cls, arguments = value.__reduce__()
+            return _Operand(
+                cls.__module__,
+                cls.__qualname__,
+                tuple(arguments),
+            )
+        if value is not None and type(value) not in (bool, int):
+            raise LinkError(f"Cannot relocate {value!r}")
+        return value
+
+    def relocation(mnemonic):
+        if not program._is_cpu_mnemonic(mnemonic):
+            raise LinkError(f"Cannot relocate {mnemonic!r}")
+        name = type(mnemonic).__name__
+        args = tuple(
+            portable(arg, mnemonic.label_scope) for arg in mnemonic._args
+        )
+        if mnemonic.relaxable:
+            return name, None, None, args
+        signature = mnemonic.signature
+        return (
+            name,
+            signature.index,
+            tuple(signature.alternatives_taken.items()),
+            args,
+        )
+
+    events = []
+    code = bytearray()
+    # Relaxed jumps before a read of the position keep their longest form.
+    unpinned = program._first_unpinned if program._position_was_read else 0
+
+    def flush_code():
+        if code:
+            events.append(bytes(code))
+            code.clear()
+
+    definition_iter = iter(definitions)
+    definition = next(definition_iter, None)
+    for mnemonic in program._opcodes:
+        while definition is not None and definition[0] <= mnemonic._position:
+            flush_code()
+            events.append(_AddLabel(definition[1]))
+            definition = next(definition_iter, None)
+        if isinstance(mnemonic, RawData):
+            code += mnemonic.data
+        elif mnemonic.is_fixed:
+            code += mnemonic.find_opcode()
+        else:
+            flush_code()
+            events.append(relocation(mnemonic))
+            if mnemonic.relaxable:
+                unpinned -= 1
+                if unpinned == 0:
+                    events.append(_Pin())
+    flush_code()
+    while definition is not None:
+        events.append(_AddLabel(definition[1]))
+        definition = next(definition_iter, None)
+
+    return ObjectFile(
+        cpu=program._cpu_name,
+        cpu_digest=program.cpu["digest"],
+        origin=program.offset if program._position_was_read else None,
+        local_symbols=local_symbols,
+        symbols=symbols,
+        references=references,
+        events=events,
+    )
+
+
+def load_into(program, obj):
+    """Append the code of the `ObjectFile` `obj` to `program`."""
+    if obj.cpu != program._cpu_name:
+        raise LinkError(
+            f"Cannot link an object for {obj.cpu!r} into a program for "
+            f"{program._cpu_name!r}"
+        )
+    if obj.cpu_digest != program.cpu["digest"]:
+        raise LinkError(
+            f"Cannot link an object for a different configuration of "
+            f"{obj.cpu!r}"
+        )
+    if obj.origin is not None:
+        # Reading the position keeps everything before the object from
+        # shrinking, so the object stays at its origin.
+        position = program.position
+        if position > obj.origin:
+            raise LinkError(
+                f"Cannot place object at {obj.origin:#x}, the program "
+                f"already extends to {position:#x}"
+            )
+        if position < obj.origin:
+            program.append(RawData(bytes(obj.origin - position)))
+
+    labels = [LocalLabel(name) for name in obj.local_symbols]
+    namespace = program._cpu_namespace
+
+    def resolve(value):
+        value_type = type(value)
+        if value_type is _Local:
+            if not 0 <= value.index < len(labels):
+                raise LinkError(f"Undefined local symbol {value.index}")
+            return labels[value.index]
+        elif value_type is _CpuObject:
+            return namespace[value.name]
+        elif value_type is _Operand:
+            return operand(value)
+        return value
+
+    operand_modules = None
+
+    def operand(value):
+        # Only operand classes of the modules the CPU namespace comes from
+        # are created, never arbitrary classes named in the object.
+        nonlocal operand_modules
+        if operand_modules is None:
+            operand_modules = {
+                getattr(item, "__module__", None) or type(item).__module__
+                for item in namespace.values()
+            }
+        cls = None
+        if value.module in operand_modules and value.module in sys.modules:
+            cls = vars(sys.modules[value.module]).get(value.qualname)
+        if not isinstance(cls, type) or getattr(cls, "kind", None) is None:
+            raise LinkError(
+                f"Unknown operand type {value.module}.{value.qualname}"
+            )
+        return cls(*value.arguments)
+
+    def signature(mnemonic_type, index, alternatives, args):
+        """Return the signature `index` of `mnemonic_type` or `None` if the
+        relocation does not fit it.
+        """
+        signatures = mnemonic_type.signatures
+        if signatures is None or not 0 <= index < len(signatures):
+            return None
+        definition = signatures[index]
+        alternatives = dict(alternatives or ())
+        if (
+            len(args) != len(definition["signature"])
+            or not alternatives.keys() <= set(definition["signature"])
+        ):
+            return None
+        return mnemonic_type._interned_signature(definition, alternatives)
+
+    for offset, event in enumerate(obj.events):
+        event_type = type(event)
+        if event_type is bytes:
+            program.append(RawData(event))
+        elif event_type is _AddLabel:
+            program.add_label(resolve(event.label))
+        elif event_type is _Pin:
+            program.position
+        else:
+            name, index, alternatives, args = event
+            mnemonic_type = namespace.get(name)
+            if not isinstance(mnemonic_type, BoundMnemonic):
+                raise LinkError(
+                    f"Unknown mnemonic {name!r} in event {offset} of the "
+                    f"object"
+                )
+            args = tuple(map(resolve, args))
+            if index is None:
+                mnemonic_type(*args)
+                continue
+            matched = signature(mnemonic_type, index, alternatives, args)
+            if matched is None:
+                raise LinkError(
+                    f"Invalid signature {index} of {name!r} in event {offset} "
+                    f"of the object"
+                )
+            mnemonic_type.restore(matched, args)
+
+
+def link(objects, origin=0):
+    """Link `objects` in this order into a new program starting at `origin`.
+
+    Raises `LinkError` if the objects are for different CPUs, define the
+    same symbol or reference symbols that no object defines.
+    """
+    from yay.program import Program
+
+    objects = list(objects)
+    if not objects:
+        raise LinkError("Nothing to link")
+    cpus = {obj.cpu for obj in objects}
+    if len(cpus) != 1:
+        raise LinkError(f"Cannot link objects for different CPUs: {sorted(cpus)}")
+
+    defined = set()
+    for obj in objects:
+        duplicates = defined.intersection(obj.symbols)
+        if duplicates:
+            raise LinkError(f"Symbols defined multiply: {sorted(duplicates)}")
+        defined.update(obj.symbols)
+    undefined = {
+        reference
+        for obj in objects
+        for reference in obj.references
+        if reference not in defined
+    }
+    if undefined:
+        raise LinkError(f"Undefined symbols: {sorted(undefined)}")
+
+    class Linked(Program, cpu=cpus.pop()):
+        fragment_cache = None
+
+        def main(self):
+            for obj in objects:
+                self.link(obj)
+
+    program = Linked()
+    if origin:
+        program.relocate(origin)
+    return program
+
+
+def main(argv):
+    from yay.cli import write_output
+
+    parser = argparse.ArgumentParser(
+        prog="yay link",
+        description="Link object files written by `yay -f object`.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "object_files",
+        nargs="+",
+        metavar="object_file",
+        help="the object files in the order they are placed",
+    )
+    parser.add_argument(
+        "-o", "--outfile",
+        help="write the linked program to this location",
+        required=True,
+    )
+    parser.add_argument(
+        "-f", "--format",
+        help="output format of the linked program",
+        default="ihex",
+    )
+    parser.add_argument(
+        "--origin",
+        help="address of the first object",
+        type=lambda value: int(value, 0),
+        default=0,
+    )
+    parser.set_defaults(record_length=16, extended_linear_address=False)
+    args = parser.parse_args(argv)
+
+    try:
+        objects = []
+        for object_file in args.object_files:
+            with open(object_file, "rb") as infile:
+                objects.append(ObjectFile.load(infile))
+        program = link(objects, args.origin)
+        write_output(program, args.outfile, args)
+    except LinkError as err:
+        parser.exit(1, f"yay link: error: {err}\n")
+    return 0
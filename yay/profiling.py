@@ -0,0 +1,110 @@
+"""Wall time and counters of the phases of importing and assembling.
+
+Instrumentation is off unless a profile is active::
+
+    with profiled() as profile:
+        Main().to_binary()
+    print(profile.format())
+
+Instrumented code checks `active` before doing anything, so the overhead is
+a global lookup when profiling is off. Phases can be nested (e. g. signature
+matching happens during `main` and `subs`), so their times are inclusive.
+"""
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from time import perf_counter
+
+
+active = None
+
+
+class Profile:
+    def __init__(self):
+        # Maps phase names to the number of runs and their total wall time.
+        self.phases = OrderedDict()
+        self.counters = Counter()
+
+    def add_time(self, name, seconds, runs=1):
+        phase = self.phases.setdefault(name, [0, 0.0])
+        phase[0] += runs
+        phase[1] += seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, perf_counter() - start)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def merge(self, other):
+        """Add the phases and counters of the `Profile` `other`."""
+        for name, (runs, seconds) in other.phases.items():
+            self.add_time(name, seconds, runs)
+        self.counters.update(other.counters)
+
+    def to_dict(self):
+        return {
+            "phases": {
+                name: {"runs": runs, "seconds": seconds}
+                for name, (runs, seconds) in self.phases.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+    def to_json(self):
+        import json
+        return json.dumps(self.to_dict(), indent=2)
+
+    def format(self):
+        lines = [f"{'phase':<16}{'runs':>10}{'ms':>12}"]
+        for name, (runs, seconds) in self.phases.items():
+            lines.append(f"{name:<16}{runs:>10}{seconds * 1000:>12.3f}")
+        if self.counters:
+            lines.append("")
+            lines.append(f"{'counter':<16}{'count':>10}")
+            for name, count in sorted(self.counters.items()):
+                lines.append(f"{name:<16}{count:>10}")
+        return "\n".join(lines)
+
+
+class _NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name):
+    """Time the `with` block as phase `name` of the active profile."""
+    if active is None:
+        return _NO_PHASE
+    return active.phase(name)
+
+
+def count(name, n=1):
+    if active is not None:
+        active.count(name, n)
+
+
+@contextmanager
+def profiled(profile=None):
+    """Make `profile` (default: a new `Profile`) the active profile inside
+    the `with` block.
+    """
+    global active
+    if profile is None:
+        profile = Profile()
+    outer = active
+    active = profile
+    try:
+        yield profile
+    finally:
+        active = outer
@@ -1,77 +1,105 @@
+import mmap
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import islice
 from contextlib import contextmanager, suppress
-from itertools import count
+from functools import update_wrapper
 from types import MethodType
 
-from ihex import IHex
-
+from yay import objects, profiling
 from yay.cpu import make_cpu
-from yay.helpers import inject_names, with_bind_program
-from yay.mnemonic import Lit
+from yay.fragments import Fingerprinter, Recording
+from yay.helpers import LayeredGlobals, with_bind_program, with_globals
+from yay.image import AssembledImage
+from yay.labels import Labels, LabelScope, LocalLabel
+from yay.mnemonic import RawData
+
+
+def _program_of(receiver):
+    return receiver if isinstance(receiver, Program) else receiver.program
+
+
+class macro:
+    """Decorator for methods of programs and `Mod`s that emit code.
 
+    The method sees the CPU namespace of the program it is called on as its
+    globals. It is bound to each program the first time it is looked up
+    there (see `Program.bind_function`) and then stored on the receiver.
+    """
+    is_macro = True
 
-def macro(f):
-    # Make sure each macro has its own `__globals__` dict so `add_names` can
-    # `update` it without affecting other global namespaces.
-    f = inject_names({})(f)
+    def __init__(self, f):
+        self.f = f
+        self.name = f.__name__
+        update_wrapper(self, f)
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def bind(self, program):
+        return program.bind_function(self.f)
 
-    def add_names(names):
-        f.__globals__.update(names)
+    def __get__(self, receiver, owner=None):
+        if receiver is None:
+            return self
+        method = MethodType(_program_of(receiver)._bound_macro(self), receiver)
+        if getattr(type(receiver), self.name, None) is self:
+            receiver.__dict__[self.name] = method
+        return method
 
-    f._add_names = add_names
-    f.is_macro = True
-    return f
+    def __call__(self, receiver, *args, **kwargs):
+        return self.__get__(receiver)(*args, **kwargs)
 
 
-def block_macro(f):
-    f = macro(f)
-    context_f = contextmanager(f)
-    context_f._add_names = f._add_names
-    context_f.is_macro = f.is_macro
-    return context_f
+class block_macro(macro):
+    def bind(self, program):
+        return contextmanager(super().bind(program))
 
 
 class sub:
     def __init__(self, f):
-        self.f = macro(f)
+        self.f = f
         self.is_macro = True
         self.is_sub = True
-        self.unique_name = None
         self.containing = None
 
-    @property
-    def was_called(self):
-        return self.unique_name is not None
-
-    def direct(self, *args, **kwargs):
+    def direct(self, receiver, *args, **kwargs):
         """
         TODO: Currently requires to explicitly pass the program instance
         when called.
         """
-        return self.f(*args, **kwargs)
+        program = _program_of(receiver)
+        return program.bind_function(self.f)(receiver, *args, **kwargs)
 
-    def _add_names(self, names):
-        self.f._add_names(names)
-        self.emit_body = inject_names(names)(self.emit_body)
+    def __get__(self, receiver, owner=None):
+        if receiver is None:
+            return self
+        return MethodType(self, receiver)
 
     def __call__(self, program):
         if not isinstance(program, Program):
             self.containing = program
             program = program.program
-        if self.unique_name is None:
-            self.unique_name = program.new_label_name(self.f.__name__)
-        program.call(self.unique_name)
+        program._call_sub(self)
 
     def emit_body(self, program):
-        if self.was_called:
-            program.add_label(self.unique_name)
-            self.f(program if self.containing is None else self.containing)
-            program.ret()
+        program.add_label(program._sub_labels[self])
+        program._emit_fragment(self)
+        program.ret()
+
+    def receiver(self, program):
+        return program if self.containing is None else self.containing
+
+    @property
+    def symbol(self):
+        """The name of the label of this sub when it is exported from an
+        object file (see `Program.to_object`).
+        """
+        return self.f.__qualname__
 
     def __repr__(self):
-        return (
-            f"<sub object at {id(self):#x}, {self.f.__name__}, "
-            f"was_called={self.was_called}, name={self.unique_name}>"
-        )
+        return f"<sub object at {id(self):#x}, {self.f.__name__}>"
 
     def clone(self):
         return type(self)(self.f)
@@ -105,62 +133,287 @@ class ProgramMeta(type):
 
 
 class Program(metaclass=ProgramMeta):
+    # A `yay.fragments.FragmentCache` to replay the code emitted by sub
+    # bodies instead of executing them again. Only safe for programs whose
+    # sub bodies have no side effects besides emitting code.
+    fragment_cache = None
+
     def __init__(self):
         self._opcodes = self._opcode_destination()
-        self.cpu = make_cpu(self._cpu_name)
-        self._cpu_namespace = {}
-        for section_name in self.cpu["all"]:
-            for name, item in self.cpu[section_name].items():
-                try:
-                    self._cpu_namespace[name] = item.bind_program(self)
-                except AttributeError:
-                    self._cpu_namespace[name] = item
+        # The opcodes of fixed mnemonics are encoded into `_code` when they
+        # are appended. All other mnemonics are fixups, which are encoded
+        # when the program is output and inserted at their offset in `_code`.
+        self._code = bytearray()
+        self._fixups = []
+        self._fixup_offsets = array("L")
+        # The address of each section and where its code starts in `_code`
+        # and `_fixups`.
+        self._sections = [(0, 0, 0)]
+        self._image = None
+        with profiling.phase("make_cpu"):
+            self.cpu = make_cpu(self._cpu_name)
+        self._cpu_namespace = dict(self.cpu["unbound_names"])
+        for name, item in self.cpu["names_to_bind"].items():
+            self._cpu_namespace[name] = item.bind_program(self)
 
         for name, mod in self._mods.items():
             self._cpu_namespace[name] = mod.bind_program(self)
 
+        # Functions are bound to this program lazily, when they are first
+        # looked up, with globals that look up the CPU namespace first.
+        self._globals = {}
+        self._bound_functions = {}
+        self._bound_macros = {}
         if hasattr(self, "main"):
-            self.main = inject_names(self._cpu_namespace)(self.main)
-
-        self.subs = []
-
-        macro_sources = [self.cpu["macros_from"]["macros_from"]]
-        macro_sources.extend(type(self).__mro__)
-        for cls in macro_sources:
-            self._inject_macros(vars(cls))
-            self.subs.extend(filter(is_sub, vars(cls).values()))
+            self.main = MethodType(
+                self.bind_function(self.main.__func__),
+                self,
+            )
 
-        self.labels = {}
-        self.used_labels = set()
-        self.position = 0
+        self.labels = Labels(self)
+        self._label_scope = None
+        # Generated labels and labels of label scopes, which store their
+        # address themselves.
+        self._local_labels = []
+        self._label_counters = {}
+        self._position = 0
         self.offset = 0
+        self._relaxable = []
+        self._first_unpinned = 0
+        # The numbers of mnemonics, labels and local labels before the last
+        # section, which are not moved by relaxation.
+        self._section_start = 0, 0, 0
+        self._sub_labels = {}
+        self._extern_mods = ()
+        self._sub_worklist = deque()
+        self._recording = None
+        self._position_was_read = False
+        self._layout_started = False
+        self._cpu_names_by_id = None
 
         self._was_assembled = False
 
-    def _inject_macros(self, macros):
-        for name, value in macros.items():
-            if is_macro(value):
-                value._add_names(self._cpu_namespace)
-                setattr(self, name, MethodType(value, self))
+    def _cpu_macro(self, name):
+        """Return the macro `name` of the CPU (`macros_from`) or `None`."""
+        macros = self.__dict__.get("cpu", {}).get("macros_from")
+        if macros is None:
+            return None
+        value = vars(macros["macros_from"]).get(name)
+        return value if is_macro(value) else None
+
+    def __getattr__(self, name):
+        # The macros of the CPU are available on all programs, after those
+        # of the program classes.
+        value = self._cpu_macro(name)
+        if value is None:
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {name!r}"
+            )
+        method = self.__dict__[name] = value.__get__(self)
+        return method
+
+    def bind_function(self, f):
+        """Return a copy of the function `f` that sees the CPU namespace of
+        this program as globals (before the globals of its module).
+
+        Neither the CPU namespace nor the globals of the module are copied,
+        names are resolved when `f` first uses them.
+        """
+        try:
+            return self._bound_functions[f]
+        except KeyError:
+            pass
+        module_globals = f.__globals__
+        try:
+            f_globals = self._globals[id(module_globals)]
+        except KeyError:
+            f_globals = self._globals[id(module_globals)] = LayeredGlobals(
+                self._cpu_namespace, module_globals
+            )
+        bound = self._bound_functions[f] = with_globals(f, f_globals)
+        return bound
+
+    def _bound_macro(self, macro):
+        try:
+            return self._bound_macros[macro]
+        except KeyError:
+            bound = self._bound_macros[macro] = macro.bind(self)
+            return bound
+
+    def _address_was_read(self):
+        # Code that reads an address may bake it into the program (e. g.
+        # `add_binary_data` or `mov(DPTR, self.labels["table"])`), so jumps
+        # before it must not change their size anymore. Addresses read by the
+        # layout itself do not pin anything, so callers only call this before
+        # the layout has started.
+        self._first_unpinned = len(self._relaxable)
+        self._position_was_read = True
+        if self._recording is not None:
+            self._recording.is_relocatable = False
+
+    @property
+    def position(self):
+        if not self._layout_started:
+            self._address_was_read()
+        return self._position
 
     def append(self, mnemonic):
+        if self._recording is not None:
+            self._recording.events.append(mnemonic)
         self._opcodes.append(mnemonic)
-        self.position += mnemonic.size
+        mnemonic._position = self._position
+        self._position += mnemonic.size
+        if mnemonic.is_fixed:
+            self._code += mnemonic.find_opcode()
+        else:
+            self._fixups.append(mnemonic)
+            self._fixup_offsets.append(len(self._code))
+        if mnemonic.relaxable:
+            self._relaxable.append(mnemonic)
+        if self._label_scope is not None:
+            mnemonic.label_scope = self._label_scope
 
     def add_label(self, label):
-        self.labels[label] = self.position
+        if self._recording is not None:
+            self._recording.add_label(label)
+        if isinstance(label, LocalLabel):
+            if label.address is None:
+                self._local_labels.append(label)
+            label.address = self._position
+        elif self._label_scope is None:
+            self.labels[label] = self._position
+        else:
+            labels = self._label_scope.labels
+            scoped = labels.get(label)
+            if scoped is None:
+                scoped = labels[label] = LocalLabel(label)
+                self._local_labels.append(scoped)
+            scoped.address = self._position
+
+    def label_address(self, label, scope=None):
+        """Return the address of `label` as seen from inside `scope`."""
+        if not self._layout_started:
+            self._address_was_read()
+        if isinstance(label, LocalLabel):
+            if label.address is None:
+                raise KeyError(label)
+            return label.address
+        while scope is not None:
+            with suppress(KeyError):
+                return scope.labels[label].address
+            scope = scope.parent
+        return self.labels.address(label)
+
+    @contextmanager
+    def label_scope(self):
+        """Labels added inside this block are only visible to mnemonics
+        appended inside it and do not enter `labels`.
+
+        Labels are global by default, also inside of subs, so that they can
+        be used from outside. Wrap the body of a sub in a label scope to keep
+        its labels from clashing with those of other subs. Sub bodies that
+        open a label scope are not cached (see `fragment_cache`).
+        """
+        if self._recording is not None:
+            self._recording.is_relocatable = False
+        outer_scope = self._label_scope
+        self._label_scope = LabelScope(outer_scope)
+        try:
+            yield
+        finally:
+            self._label_scope = outer_scope
+
+    def mnemonic(self, name):
+        return self._cpu_namespace[name]
+
+    def _is_cpu_mnemonic(self, mnemonic):
+        """Whether `mnemonic` is an instance of a mnemonic of the CPU."""
+        mnemonic_type = type(mnemonic)
+        bound = self._cpu_namespace.get(mnemonic_type.__name__)
+        return getattr(bound, "cls", None) is mnemonic_type
+
+    def _cpu_object_name(self, value):
+        """Return the name of `value` in the CPU namespace or `None`."""
+        if self._cpu_names_by_id is None:
+            self._cpu_names_by_id = {
+                id(item): name for name, item in self._cpu_namespace.items()
+            }
+        name = self._cpu_names_by_id.get(id(value))
+        if name is not None and self._cpu_namespace[name] is value:
+            return name
+        return None
+
+    def _fragment_key(self, sub):
+        """Return the key of the body of `sub` in the fragment cache or
+        `None` if it cannot be cached. Each key is only computed once per
+        assembly.
+        """
+        if self.fragment_cache is None:
+            return None
+        try:
+            return self._fragment_keys[sub]
+        except KeyError:
+            key = self._fragment_keys[sub] = self.fragment_cache.key(
+                self._fingerprinter,
+                sub.f,
+                sub.receiver(self),
+            )
+            return key
+
+    def _emit_fragment(self, sub):
+        """Emit the body of `sub`, replaying the cached fragment if it was
+        emitted with the same inputs before.
+        """
+        receiver = sub.receiver(self)
+        key = self._fragment_key(sub)
+        if key is None:
+            self.bind_function(sub.f)(receiver)
+            return
+
+        cache = self.fragment_cache
+
+        fragment = cache.get(key)
+        if fragment is not None:
+            fragment.replay(self)
+            return
+
+        self._recording = Recording()
+        try:
+            self.bind_function(sub.f)(receiver)
+            fragment = self._recording.to_fragment(self)
+        finally:
+            self._recording = None
+        if fragment is not None:
+            cache.put(key, fragment)
+
+    def _call_sub(self, sub):
+        # Subs are shared by all instances of a program, so their labels are
+        # stored in the program. The label belongs to the sub, not to the
+        # fragment that happens to call it first.
+        try:
+            label = self._sub_labels[sub]
+        except KeyError:
+            if isinstance(sub.containing, self._extern_mods):
+                # Defined by another object, see `to_object`.
+                label = self._sub_labels[sub] = sub.symbol
+            else:
+                label = self._sub_labels[sub] = self._new_label(sub.f.__name__)
+                self._sub_worklist.append(sub)
+        self.call(label)
 
     def matches(self, typename, value):
-        possible_matchers = [typename]
-        possible_matchers.extend(
-            self.cpu["signature_contents"][typename].get("alternatives", [])
-        )
-        for matcher_type in possible_matchers:
-            if self._matches_specific(matcher_type, value):
+        profile = profiling.active
+        if profile is not None:
+            profile.count("matcher calls")
+        for matcher_type, matcher in self.cpu["type_matchers"][typename]:
+            if matcher(value):
                 return True, matcher_type
         return False, ""
 
     def _matches_specific(self, typename, value, from_alternative=None):
+        profile = profiling.active
+        if profile is not None:
+            profile.count("matcher calls")
         args = [value]
         if from_alternative is not None:
             args.append(from_alternative)
@@ -186,82 +439,309 @@ class Program(metaclass=ProgramMeta):
             return
 
         self._was_assembled = True
-        self.main()
+        self._emit()
+
+        self._layout_started = True
+        with profiling.phase("relax"):
+            self._relax()
+
+        profile = profiling.active
+        if profile is not None:
+            # Fixed mnemonics are encoded when they are appended (as part of
+            # `main` and `subs`). Fixups are encoded lazily when the program
+            # is output, so encode them up front to time them on their own.
+            with profile.phase("encode fixups"):
+                for mnemonic in self._fixups:
+                    mnemonic.opcode
+            profile.count("mnemonics", len(self._opcodes))
+            profile.count("fixups", len(self._fixups))
+            profile.count(
+                "labels",
+                len(self.labels) + len(self._local_labels),
+            )
 
-        # Recursively make sure all subs that are part of mods and only
-        # indirectly called (i. e. via another sub in a mod) are actually
-        # called so that they are known by the program.
-        # TODO: Refactor into either a better system or into own mathod.
-        old_append = self.append
-        self.append = lambda *args, **kwargs: None
-        for sub in self.subs:
-            if sub.was_called:
-                sub.f(self if sub.containing is None else sub.containing)
-        self.append = old_append
+    def _emit(self):
+        """Run `main` and the bodies of all subs it calls."""
+        self._fingerprinter = Fingerprinter(self)
+        self._fragment_keys = {}
+        with profiling.phase("main"):
+            self.main()
+
+        # Subs are emitted in the order in which they are first called. The
+        # body of each called sub runs exactly once and may call further
+        # subs, which are added to the worklist. Cached fragments never call
+        # subs, so replaying them does not add anything.
+        with profiling.phase("subs"):
+            while self._sub_worklist:
+                self._sub_worklist.popleft().emit_body(self)
+
+    def to_object(self, export_subs=False, extern=()):
+        """Return the program as a relocatable `yay.objects.ObjectFile`.
+
+        With `export_subs`, the subs emitted into the object are exported
+        under their `symbol` (e. g. `Delay.wait`), so the object can be used
+        as a library. Subs of the `Mod` classes in `extern` are not emitted,
+        calls to them refer to their symbol, which another object (such a
+        library) has to export.
+
+        The program is not laid out, so it cannot be output afterwards.
+        """
+        if self._was_assembled:
+            raise RuntimeError(
+                "`to_object` must be called before program is assembled."
+            )
+        self._was_assembled = True
+        self._extern_mods = tuple(getattr(mod, "cls", mod) for mod in extern)
+        self._emit()
+        return objects.from_program(self, export_subs)
+
+    def _relax(self):
+        """Shrink relaxable jumps and calls as far as their targets allow.
+
+        All relaxable mnemonics are appended in their longest form. Starting
+        with the shortest form, each is widened only if it cannot reach its
+        target, until the layout stops changing. Only the relaxable mnemonics
+        are re-encoded in each iteration; the positions of all other
+        mnemonics and labels are only updated once at the end.
+        """
+        relaxable = self._relaxable[self._first_unpinned:]
+        if not relaxable:
+            return
 
-        for sub in self.subs:
-            sub.emit_body(self)
+        # Relaxable mnemonics before the last section are pinned by `org`,
+        # so only the last section changes.
+        first_mnemonic, first_label, first_local_label = self._section_start
+        initial_positions = [mnemonic._position for mnemonic in relaxable]
+        initial_labels = dict(islice(self.labels.items(), first_label, None))
+        initial_local_labels = [
+            (label, label.address)
+            for label in self._local_labels[first_local_label:]
+        ]
+        for mnemonic in relaxable:
+            mnemonic.choice = 0
+
+        def shrinkage_before(position):
+            return shrinkage[bisect_left(initial_positions, position)]
+
+        def widen(mnemonics):
+            widened = False
+            for mnemonic in mnemonics:
+                if mnemonic.choice < len(mnemonic.candidates) - 1:
+                    mnemonic.choice += 1
+                    widened = True
+            return widened
+
+        def widen_for_fixups():
+            """Encode the other mnemonics that depend on their position (e. g.
+            `ajmp` to a label, which has to stay in the same 2k block) in the
+            current layout. If one of them does not reach its target anymore,
+            widen the relaxable mnemonics before it (or all of them) and
+            return whether the layout changed.
+            """
+            for mnemonic in islice(self._opcodes, first_mnemonic, None):
+                if (
+                    mnemonic.is_fixed
+                    or mnemonic.relaxable
+                    or isinstance(mnemonic, RawData)
+                ):
+                    continue
+                # Only relaxable mnemonics are moved until the layout is
+                # final.
+                position = mnemonic._position
+                mnemonic._position = position - shrinkage_before(position)
+                try:
+                    mnemonic.find_opcode()
+                except ValueError:
+                    index = bisect_left(initial_positions, position)
+                    return widen(relaxable[:index]) or widen(relaxable)
+                finally:
+                    mnemonic._position = position
+            return False
+
+        changed = True
+        while changed:
+            shrinkage = [0]
+            for mnemonic, position in zip(relaxable, initial_positions):
+                mnemonic._position = position - shrinkage[-1]
+                shrinkage.append(
+                    shrinkage[-1] + mnemonic.longest_size - mnemonic.size
+                )
+            for label, position in initial_labels.items():
+                self.labels[label] = position - shrinkage_before(position)
+            for label, position in initial_local_labels:
+                label.address = position - shrinkage_before(position)
+
+            changed = False
+            for mnemonic in relaxable:
+                while (
+                    mnemonic.choice < len(mnemonic.candidates) - 1
+                    and not mnemonic.reaches_target()
+                ):
+                    mnemonic.choice += 1
+                    changed = True
+            if not changed:
+                changed = widen_for_fixups()
+
+        for mnemonic in islice(self._opcodes, first_mnemonic, None):
+            if not mnemonic.relaxable:
+                mnemonic._position -= shrinkage_before(mnemonic._position)
+        self._position -= shrinkage[-1]
+
+    def _iter_code(self, start, end, first_fixup, end_fixup):
+        """Yield the code from `start` to `end` of `_code` with the fixups
+        from `first_fixup` to `end_fixup` inserted.
+        """
+        code = memoryview(self._code)
+        fixups = islice(
+            zip(self._fixup_offsets, self._fixups),
+            first_fixup,
+            end_fixup,
+        )
+        for offset, mnemonic in fixups:
+            if start != offset:
+                yield code[start:offset]
+                start = offset
+            yield mnemonic.opcode
+        if start != end:
+            yield code[start:end]
 
-    def _code_as_bytes(self):
-        return b"".join(opcode.opcode for opcode in self._opcodes)
+    @property
+    def image(self):
+        """The program as an `AssembledImage`, which is assembled and laid
+        out only once.
+        """
+        if self._image is None:
+            self._assemble()
+            with profiling.phase("output"):
+                image = AssembledImage()
+                ends = self._sections[1:]
+                ends.append((None, len(self._code), len(self._fixups)))
+                for (address, start, first_fixup), (_, end, end_fixup) in zip(
+                        self._sections, ends):
+                    for chunk in self._iter_code(
+                            start, end, first_fixup, end_fixup):
+                        image.write(address, chunk)
+                        address += len(chunk)
+                self._image = image
+        return self._image
 
     def to_binary(self):
-        self._assemble()
-        return b"\0" * self.offset + self._code_as_bytes()
+        return self.image.to_binary()
 
     def to_ihex(self, as_str=True):
-        self._assemble()
-        ihex = IHex()
-        ihex.insert_data(self.offset, self._code_as_bytes())
-        if as_str:
-            return ihex.write()
-        else:
-            return ihex
+        return self.image.to_ihex(as_str)
+
+    def write_ihex(self, outfile, **kwargs):
+        """Write the program as Intel HEX to the binary file `outfile`.
+
+        `kwargs` are passed to `yay.hexfile.IHexWriter`.
+        """
+        self.image.write_ihex(outfile, **kwargs)
 
     def get_position(self, searched):
-        position = self.offset
-        for mnemonic in self._opcodes:
-            if mnemonic is searched:
-                return position
-            position += mnemonic.size
-        raise ValueError(f"{searched} is not in this program.")
+        # The position is recorded by `append`, so looking it up does not
+        # depend on the size of the program.
+        if not self._layout_started:
+            self._address_was_read()
+        position = getattr(searched, "_position", None)
+        if position is None or searched.program is not self:
+            raise ValueError(f"{searched} is not in this program.")
+        return position
 
     def offsetof(self, label):
-        return self.position - self.labels[label]
+        return self.position - self.label_address(label, self._label_scope)
+
+    def _new_label(self, prefix):
+        n = self._label_counters.get(prefix, 0)
+        self._label_counters[prefix] = n + 1
+        return LocalLabel(f"{prefix}_{n}")
 
     def new_label_name(self, prefix):
-        for n in count():
-            name = f"{prefix}_{n}"
-            if name not in self.used_labels:
-                self.used_labels.add(name)
-                return name
+        label = self._new_label(prefix)
+        if self._recording is not None:
+            self._recording.new_label(label)
+        return label
 
     def relocate(self, offset):
-        if self.position != 0:
+        if self._position != 0:
             raise RuntimeError(
                 "Relocate must be called before program is assembled."
             )
-        self.position = offset
+        self._position = offset
         self.offset = offset
+        self._sections[0] = offset, 0, 0
+
+    @macro
+    def org(self, address):
+        """Continue the program at `address`.
+
+        Sections must not overlap. Relaxed jumps and calls before `org` keep
+        their longest form.
+        """
+        # Reading the position pins the relaxable mnemonics appended so far.
+        self.position
+        self._position = address
+        self._sections.append((address, len(self._code), len(self._fixups)))
+        self._section_start = (
+            len(self._opcodes),
+            len(self.labels),
+            len(self._local_labels),
+        )
 
     @macro
     def add_binary_data(self, data):
+        """Append `data` (bytes-like or an iterable of ints) as one block and
+        return its position.
+        """
         ptr = self.position
-        for byte in data:
-            Lit(byte)
+        self.append(RawData(data))
         return ptr
 
+    @macro
+    def incbin(self, filename, offset=0, length=None):
+        """Append `length` bytes (default: all) of the file `filename`
+        starting at `offset` and return their position.
+
+        The file is mapped into memory instead of being read, and stays
+        mapped as long as the program exists.
+        """
+        with open(filename, "rb") as binary_file:
+            try:
+                data = memoryview(
+                    mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ)
+                )
+            except ValueError:
+                # Empty files cannot be mapped.
+                data = memoryview(b"")
+        end = len(data) if length is None else offset + length
+        if not 0 <= offset <= end <= len(data):
+            raise ValueError(
+                f"Cannot include {length} bytes at offset {offset} of "
+                f"{filename!r} ({len(data)} bytes)"
+            )
+        if self._recording is not None:
+            # The contents of the file are not part of the fingerprint.
+            self._recording.is_relocatable = False
+        return self.add_binary_data(data[offset:end])
+
+    @macro
+    def link(self, obj):
+        """Append the code of the relocatable `yay.objects.ObjectFile` `obj`
+        (see `to_object`).
+        """
+        objects.load_into(self, obj)
+
 
 @with_bind_program
 class Mod:
     def __init__(self):
-        for name in dir(self):
-            value = getattr(self, name)
-            if is_macro(value):
-                with suppress(AttributeError):
-                    value = value.clone()
-                value._add_names(self.program._cpu_namespace)
+        # Subs remember the `Mod` they were called on, so each instance gets
+        # its own copies.
+        seen = set()
+        for cls in type(self).__mro__:
+            for name, value in vars(cls).items():
+                if name in seen:
+                    continue
+                seen.add(name)
                 if is_sub(value):
-                    self.program.subs.append(value)
-                    value = MethodType(value, self)
-                setattr(self, name, value)
+                    setattr(self, name, MethodType(value.clone(), self))
@@ -0,0 +1,382 @@
+"""Build server that keeps yay warm between builds.
+
+`yay serve` listens on a Unix domain socket that only its owner can connect
+to for requests, one JSON object per line::
+
+    {"input": "main.yay", "output": "main.hex", "watch": true}
+
+Optional keys are `main_class`, `format`, `record_length` and
+`extended_linear_address` with the same defaults as the command line. Each
+request is answered with one JSON line, e. g. ``{"ok": true, ...}`` or
+``{"ok": false, "error": "...", ...}``.
+
+Requests run the code of their input, so the server only builds inputs and
+writes outputs inside its root directory. When it listens on a TCP port
+instead (on platforms without Unix domain sockets), every request has to
+contain the `token` the server prints when it starts.
+
+`yay_ast`, the CPU models and the imported `.yay` library modules stay in
+memory between builds. Requests for the same target that arrive while an
+earlier build of it is still waiting are merged into one build. Watched
+targets are rebuilt when one of the `.yay` files they depend on changes.
+"""
+import argparse
+import asyncio
+import dis
+import hmac
+import json
+import os
+import secrets
+import socket
+import stat
+import sys
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from importlib.util import resolve_name
+from itertools import chain
+from types import CodeType, ModuleType
+
+
+class Target(namedtuple(
+    "Target",
+    "yay_file outfile main_class format record_length extended_linear_address",
+)):
+    """One output file and the options it is assembled with.
+
+    Has the attributes `yay.cli.write_output` reads from the parsed command
+    line.
+    """
+
+    @classmethod
+    def from_request(cls, request):
+        return cls(
+            os.path.abspath(request["input"]),
+            os.path.abspath(request["output"]),
+            request.get("main_class", "Main"),
+            request.get("format", "ihex"),
+            int(request.get("record_length", 16)),
+            bool(request.get("extended_linear_address", False)),
+        )
+
+
+def _yay_module(value):
+    if isinstance(value, ModuleType):
+        module = value
+    else:
+        module_name = getattr(value, "__module__", None)
+        if not isinstance(module_name, str):
+            return None
+        module = sys.modules.get(module_name)
+    filename = getattr(module, "__file__", None) or ""
+    return module if filename.endswith(".yay") else None
+
+
+def imported_names(code):
+    """Return the names of the modules imported by `code` and its nested
+    code objects as `(name, level)` pairs, where `level` is the number of
+    leading dots of relative imports.
+    """
+    names = set()
+    constants = [None, None]
+    for instruction in dis.get_instructions(code):
+        if instruction.opname == "LOAD_CONST":
+            constants = [constants[-1], instruction.argval]
+        elif instruction.opname == "IMPORT_NAME":
+            level = constants[0]
+            names.add((instruction.argval, level if isinstance(level, int) else 0))
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names.update(imported_names(const))
+    return names
+
+
+def _imported_modules(module):
+    try:
+        code = module.__spec__.loader.get_code(module.__name__)
+    except (AttributeError, ImportError, OSError):
+        return
+    for name, level in imported_names(code):
+        if level:
+            with suppress(ImportError, ValueError):
+                name = resolve_name("." * level + name, module.__package__)
+        imported = sys.modules.get(name)
+        if imported is not None:
+            yield imported
+
+
+def yay_dependencies(module):
+    """Return the files of `module` and of all `.yay` modules it
+    (transitively) imports or uses by name.
+    """
+    dependencies = set()
+    modules = [module]
+    while modules:
+        module = modules.pop()
+        if module.__file__ in dependencies:
+            continue
+        dependencies.add(module.__file__)
+        for value in chain(_imported_modules(module), vars(module).values()):
+            dependency = _yay_module(value)
+            if dependency is not None:
+                modules.append(dependency)
+    return dependencies
+
+
+def _mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+
+def build_target(target):
+    """Assemble `target` and return the error message (or `None`) and the
+    mtimes of the files it depends on when they were read.
+    """
+    from yay.cli import _get_main_class, write_output
+    from yay.importer import import_yay_file
+
+    mtimes = {target.yay_file: _mtime(target.yay_file)}
+    try:
+        module = import_yay_file(target.yay_file)
+        for filename in yay_dependencies(module):
+            mtimes.setdefault(filename, _mtime(filename))
+        program = _get_main_class(module, target.main_class)()
+        write_output(program, target.outfile, target)
+    except Exception:
+        return traceback.format_exc(limit=-1).rstrip(), mtimes
+    return None, mtimes
+
+
+def evict_modules(filenames):
+    """Remove the `.yay` modules that depend on one of `filenames` from
+    `sys.modules`, so that they are imported again from the changed files.
+    """
+    filenames = set(filenames)
+    for name, module in list(sys.modules.items()):
+        if _yay_module(module) is module and yay_dependencies(module) & filenames:
+            del sys.modules[name]
+
+
+class BuildServer:
+    """Builds the targets of requests for files in `root`. If `token` is
+    not `None`, requests have to contain it.
+    """
+
+    def __init__(self, root, token=None):
+        self.root = os.path.realpath(root)
+        self.token = token
+        # Builds import modules, so they run one after another in a single
+        # thread.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._build_lock = None
+        # Builds that have been requested but not started yet.
+        self._pending = {}
+        # Maps watched targets to the mtimes of the files they depend on.
+        self.watched = {}
+        self.builds = 0
+
+    async def build(self, target):
+        """Build `target` and return the error message or `None`.
+
+        Merges requests for a target whose build has not started yet.
+        """
+        if self._build_lock is None:
+            self._build_lock = asyncio.Lock()
+        future = self._pending.get(target)
+        if future is None:
+            future = asyncio.ensure_future(self._build(target))
+            self._pending[target] = future
+        return await asyncio.shield(future)
+
+    async def _build(self, target):
+        async with self._build_lock:
+            # Later requests see the files as they are now, so they are not
+            # merged into this build.
+            del self._pending[target]
+            self.builds += 1
+            error, mtimes = await asyncio.get_event_loop().run_in_executor(
+                self._executor,
+                build_target,
+                target,
+            )
+        if target in self.watched:
+            self.watched[target] = mtimes
+        return error
+
+    def watch(self, target):
+        self.watched.setdefault(target, {})
+
+    def changed_files(self):
+        return {
+            filename
+            for mtimes in self.watched.values()
+            for filename, mtime in mtimes.items()
+            if _mtime(filename) != mtime
+        }
+
+    async def rebuild_changed(self):
+        """Rebuild the watched targets that depend on changed files and
+        return them.
+        """
+        changed = self.changed_files()
+        if not changed:
+            return []
+        evict_modules(changed)
+        targets = [
+            target
+            for target, mtimes in self.watched.items()
+            if changed & mtimes.keys()
+        ]
+        await asyncio.gather(*map(self.build, targets))
+        return targets
+
+    async def watch_files(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await self.rebuild_changed()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.respond(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def respond(self, line):
+        try:
+            request = json.loads(line.decode())
+            token = request.get("token")
+            target = Target.from_request(request)
+        except (ValueError, KeyError, TypeError, AttributeError) as err:
+            return {"ok": False, "error": f"invalid request: {err!r}"}
+        if self.token is not None and not (
+            isinstance(token, str)
+            and hmac.compare_digest(token.encode(), self.token.encode())
+        ):
+            return {"ok": False, "error": "invalid token"}
+        for filename in [target.yay_file, target.outfile]:
+            if not self.is_inside_root(filename):
+                return {
+                    "ok": False,
+                    "error": f"{filename} is not inside {self.root}",
+                }
+
+        if request.get("watch"):
+            self.watch(target)
+        error = await self.build(target)
+        response = {
+            "ok": error is None,
+            "input": target.yay_file,
+            "output": target.outfile,
+        }
+        if error is not None:
+            response["error"] = error
+        return response
+
+    def is_inside_root(self, filename):
+        filename = os.path.realpath(filename)
+        try:
+            return os.path.commonpath([self.root, filename]) == self.root
+        except ValueError:
+            # On different drives.
+            return False
+
+    def close(self):
+        self._executor.shutdown()
+
+
+async def start_unix_server(handle, path):
+    """Listen on the Unix domain socket `path`, which only the current
+    user can connect to.
+    """
+    with suppress(FileNotFoundError):
+        # Remove the socket of a server that did not shut down cleanly.
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.unlink(path)
+    umask = os.umask(0o177)
+    try:
+        return await asyncio.start_unix_server(handle, path)
+    finally:
+        os.umask(umask)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="yay serve",
+        description="Yay build server.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--socket",
+        help="path of the Unix domain socket to listen on",
+        default=".yay-server.sock",
+    )
+    parser.add_argument(
+        "--port",
+        help="listen on this TCP port instead of a Unix domain socket,"
+            " requests then have to contain the printed token",
+        type=int,
+    )
+    parser.add_argument(
+        "--host",
+        help="address to listen on with --port",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--root",
+        help="only build inputs and write outputs in this directory",
+        default=".",
+    )
+    parser.add_argument(
+        "--interval",
+        help="seconds between checks for changes of watched files",
+        type=float,
+        default=0.5,
+    )
+    args = parser.parse_args(argv)
+
+    # Load everything that does not depend on the built files up front.
+    import yay
+    import yay.program
+    yay.ast
+
+    use_tcp = args.port is not None or not hasattr(socket, "AF_UNIX")
+    token = secrets.token_urlsafe(16) if use_tcp else None
+    build_server = BuildServer(args.root, token)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    if use_tcp:
+        server = loop.run_until_complete(asyncio.start_server(
+            build_server.handle,
+            args.host,
+            args.port or 0,
+        ))
+        host, port = server.sockets[0].getsockname()[:2]
+        print(f"Serving on {host}:{port} with token {token}", file=sys.stderr)
+    else:
+        server = loop.run_until_complete(
+            start_unix_server(build_server.handle, args.socket)
+        )
+        print(f"Serving on {args.socket}", file=sys.stderr)
+    watcher = loop.create_task(build_server.watch_files(args.interval))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.cancel()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        if not use_tcp:
+            with suppress(OSError):
+                os.unlink(args.socket)
+        build_server.close()
+        loop.close()